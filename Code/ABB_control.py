@@ -1,183 +1,97 @@
 import requests
-import time
-from requests.auth import HTTPDigestAuth
+from metrics import timed
+from rws_client import RWSClient, parse_bool, parse_int, rap_value
 
-# --- CONFIG ---
-url_layer = 'http://localhost/rw/rapid/symbol/data/RAPID/T_ROB1/MainModule/layer_finished?json=1'
-url_pause = 'http://localhost/rw/rapid/symbol/data/RAPID/T_ROB1/MainModule/pause_printing?json=1'
-url_weld = 'http://localhost/rw/rapid/symbol/data/RAPID/T_ROB1/MainModule/wielding?json=1'
-url_number_of_layer = 'http://localhost/rw/rapid/symbol/data/RAPID/T_ROB1/MainModule/number_of_layer_piece_{}?json=1'
-url_number_pieces_printed = 'http://localhost/rw/rapid/symbol/data/RAPID/T_ROB1/MainModule/which_pieces?json=1'
+# one pooled client for the whole process (fetch.py and the watcher use it too)
+client = RWSClient()
+auth = client.auth
+session = client.session
 
-auth = HTTPDigestAuth("Default User", "robotics")
-session = requests.Session()
 
-# --- FETCH if ABB finished a layer ---
-def fetch_layer():
+def _read(name, parse):
+    # every fetch helper: read one symbol, report errors, None on failure
     try:
-        # Make the request to fetch data
-        response = session.get(url_layer, auth=auth)
-
-        # Check if the request was successful
-        if response.status_code == 200:
-            # Parse the JSON data
-            data = response.json()
-
-            # Extract and print data from the JSON object
-            if '_embedded' in data:
-                state = data['_embedded'].get('_state')
-                if state:  # Check if the list is not empty
-                    for target in state:  # Iterate through the list of targets
-
-                        if target.get('value') =="TRUE":
-                            layer_finished = True
-                        else: 
-                            layer_finished = False
-                        
-                        return layer_finished
-        else:
-            print(f"Failed to fetch data. Status code: {response.status_code}")
-            print(f"Response body: {response.text}")  # Print the response body for debugging
+        value = client.read_symbol(name)
+    except requests.RequestException as e:
+        print(f"HTTP error fetching {name}: {e}")
+        return None
     except Exception as e:
-        print(f"An error occurred: {e}")
-    
+        print(f"Unexpected error fetching {name}: {e}")
+        return None
+    if value is None:
+        print(f"⚠️ No rap-data/value entry found for {name}")
+        return None
+    return parse(value)
+
+
+# --- FETCH if ABB finished a layer ---
+@timed("rws_request_seconds", call="fetch_layer")
+def fetch_layer():
+    return _read("layer_finished", parse_bool)
+
+
+@timed("rws_request_seconds", call="fetch_welding")
 def fetch_welding():
-    try:
-        # Make the request to fetch data
-        response = session.get(url_weld, auth=auth)
-
-        # Check if the request was successful
-        if response.status_code == 200:
-            # Parse the JSON data
-            data = response.json()
-
-            # Extract and print data from the JSON object
-            if '_embedded' in data:
-                state = data['_embedded'].get('_state')
-                if state:  # Check if the list is not empty
-                    for target in state:  # Iterate through the list of targets
-
-                        if target.get('value') =="TRUE":
-                            weld = True
-                        else: 
-                            weld = False
-                        
-                        return weld
-        else:
-            print(f"Failed to fetch data. Status code: {response.status_code}")
-            print(f"Response body: {response.text}")  # Print the response body for debugging
-    except Exception as e:
-        print(f"An error occurred: {e}")
+    return _read("wielding", parse_bool)
+
 
+@timed("rws_request_seconds", call="fetch_number_of_layer")
 def fetch_number_of_layer(url):
+    """
+    url: full symbol URL (as before) or just the symbol name,
+    e.g. "number_of_layer_piece_2". 0 if it cannot be read.
+    """
+    if "/" not in url:
+        return _read(url, parse_int) or 0
     try:
-        resp = session.get(url, auth=auth)
-        resp.raise_for_status()
-        data = resp.json()
-
-        state = data.get('_embedded', {}).get('_state', [])
-        # find the rap-data entry
-        for entry in state:
-            if entry.get('_type') == 'rap-data' and 'value' in entry:
-                # value is a string, e.g. "1"
-                try:
-                    return int(entry['value'])
-                except ValueError:
-                    print(f"Cannot parse layer value {entry['value']!r}, defaulting to 0")
-                    return 0
-
-        # if we never found it
-        print("⚠️ No rap-data/value entry found; defaulting to 0")
-        return 0
-
+        value = rap_value(client.get_json(url))
     except requests.RequestException as e:
         print(f"HTTP error fetching layer count: {e}")
+        return 0
     except Exception as e:
         print(f"Unexpected error in fetch_number_of_layer: {e}")
+        return 0
+    if value is None:
+        print("⚠️ No rap-data/value entry found; defaulting to 0")
+        return 0
+    return parse_int(value)
+
 
-    return 0
+@timed("rws_request_seconds", call="fetch_layer_counts")
+def fetch_layer_counts(piece_ids):
+    """
+    number_of_layer_piece_N of several pieces in one parallel read.
+    """
+    names = {pid: f"number_of_layer_piece_{pid}" for pid in piece_ids}
+    values = client.read_symbols(names.values())
+    return {pid: 0 if values[name] is None else parse_int(values[name]) for pid, name in names.items()}
 
 
 # fetch which pieces it is printing
+@timed("rws_request_seconds", call="fetch_pieces_being_print")
 def fetch_pieces_being_print():
-    try:
-        resp = session.get(url_number_pieces_printed, auth=auth)
-        resp.raise_for_status()
-        data = resp.json()
-
-        state = data.get('_embedded', {}).get('_state', [])
-        # find the rap-data entry
-        for entry in state:
-            if entry.get('_type') == 'rap-data' and 'value' in entry:
-                # value is a string, e.g. "1"
-                try:
-                    return int(entry['value'])
-                except ValueError:
-                    print(f"Cannot parse layer value {entry['value']!r}, defaulting to 0")
-                    return 0
-
-        # if we never found it
-        print("⚠️ No rap-data/value entry found; defaulting to 0")
-        return 0
-
-    except requests.RequestException as e:
-        print(f"HTTP error fetching layer count: {e}")
-    except Exception as e:
-        print(f"Unexpected error in fetch_number_of_layer: {e}")
-
-    return 0
+    return _read("which_pieces", parse_int) or 0
 
 
 # --- Tell ABB to pause/resume printing ---
+@timed("rws_request_seconds", call="set_pause_printing")
 def set_pause_printing(value: bool):
-    # IMPORTANT: add ?action=set to the URL
-    url = "http://localhost/rw/rapid/symbol/data/RAPID/T_ROB1/MainModule/pause_printing?action=set"
-
-    payload = {"value": "TRUE" if value else "FALSE"}
-
     try:
-        response = session.post(
-            url,
-            auth=auth,
-            data=payload,
-            headers={"Content-Type": "application/x-www-form-urlencoded"}
-        )
-
-        if response.status_code == 204:
+        if client.write_symbol("pause_printing", "TRUE" if value else "FALSE"):
             print(f"pause_printing set to {value}")
-        else:
-            print(f"Failed to set pause_printing: {response.status_code}")
-            print(response.text)
     except Exception as e:
         print(f"Error setting pause_printing: {e}")
 
 
-
 # --- Tell ABB which piece to print next ---
+@timed("rws_request_seconds", call="set_piece_choice")
 def set_piece_choice(choice: int):
     """
     choice: the next piece index (e.g. 1, 2, 3, 4)
     """
-    # note: match your Rapid module path here exactly
-    url = (
-        "http://localhost/rw/rapid/symbol/data/"
-        "RAPID/T_ROB1/MainModule/piece_choice?action=set"
-    )
-
-    # for a NUM symbol you just send the numeric value as a string
-    payload = {"value": str(choice)}
-
     try:
-        response = session.post(
-            url,
-            auth=auth,
-            data=payload,
-            headers={"Content-Type": "application/x-www-form-urlencoded"}
-        )
-        if response.status_code == 204:
+        # for a NUM symbol you just send the numeric value as a string
+        if client.write_symbol("piece_choice", choice):
             print(f"piece_choice set to {choice}")
-        else:
-            print(f"Failed to set piece_choice: {response.status_code}")
-            print(response.text)
     except Exception as e:
-        print(f"Error setting piece_choice: {e}")
\ No newline at end of file
+        print(f"Error setting piece_choice: {e}")
@@ -1,8 +1,10 @@
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.ndimage import label, binary_closing
+from scipy.ndimage import label, binary_closing, maximum_filter, find_objects
 import json
 import gzip
+from bbox_store import write_bbox_npz, piece_bbox_path
+from metrics import timed
 
 # ---------------------------
 # Function to map real-world coordinates to voxel indices using shift/scale
@@ -28,6 +30,30 @@ def point_to_voxel_indices(x, y, z,
 
     return ix, iy, iz
 
+# ---------------------------
+# Array version of point_to_voxel_indices: same arithmetic, all points at once
+# ---------------------------
+def points_to_voxel_indices(points,
+                            nx, ny, nz,
+                            x_min, y_min, z_min,
+                            x_range, y_range, z_range,
+                            layer_height=None):
+    points = np.asarray(points, dtype=np.float64)
+    x, y, z = points[:, 0], points[:, 1], points[:, 2]
+    fx = (x - x_min) / x_range if x_range > 0 else np.zeros_like(x)
+    fy = (y - y_min) / y_range if y_range > 0 else np.zeros_like(y)
+    ix = np.clip(fx * (nx - 1), 0, nx - 1).astype(np.int64)
+    iy = np.clip(fy * (ny - 1), 0, ny - 1).astype(np.int64)
+
+    if layer_height is not None:
+        iz = np.floor((z - z_min) / layer_height)
+    else:
+        fz = (z - z_min) / z_range if z_range > 0 else np.zeros_like(z)
+        iz = fz * (nz - 1)
+    iz = np.clip(iz, 0, nz - 1).astype(np.int64)
+
+    return ix, iy, iz
+
 # ---------------------------
 # Local 2D Fill Function (thickens points in the same z-slice)
 # ---------------------------
@@ -62,29 +88,82 @@ def vertical_smoothing(voxel_grid, window=3):
 # ---------------------------
 # Store Bounding Boxes + Pixel Coordinates (no geometry analysis)
 # ---------------------------
-def store_voxel_bounding_boxes(labeled_grid, voxel_dump="voxel_bounding_boxes.json.gz"):
-    bounding_data = {}
+def extract_layer_bboxes(labeled_grid):
+    """
+    Per-label, per-layer bbox and relative pixels of an (nx, ny, nz) label grid,
+    in one sweep: find_objects bounds the labelled region, its non-zero voxels
+    are taken once in C order and stably sorted by (label, z), so each group
+    keeps the (x, y) order np.argwhere would give.
+    Returns [(label, z, min_xy, max_xy, rel_pixels), ...] sorted by label, then z.
+    """
+    objects = [s for s in find_objects(labeled_grid) if s is not None]
+    if not objects:
+        return []
+    # union bounding box of every label
+    lo = [min(s[d].start for s in objects) for d in range(3)]
+    hi = [max(s[d].stop for s in objects) for d in range(3)]
+    region = labeled_grid[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]]
+
+    flat = np.flatnonzero(region)
+    labels = region.ravel()[flat].astype(np.int64)
+    x, y, z = np.unravel_index(flat, region.shape)
+    x, y, z = x + lo[0], y + lo[1], z + lo[2]
+
+    nz = labeled_grid.shape[2]
+    group = labels * nz + z
+    order = np.argsort(group, kind="stable")
+    group, xy = group[order], np.stack([x[order], y[order]], axis=1)
+
+    starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+    ends = np.r_[starts[1:], len(group)]
+    mins = np.minimum.reduceat(xy, starts, axis=0)
+    maxs = np.maximum.reduceat(xy, starts, axis=0)
+
+    entries = []
+    for s, e, min_xy, max_xy in zip(starts, ends, mins, maxs):
+        g = int(group[s])
+        entries.append((g // nz, g % nz, min_xy, max_xy, xy[s:e] - min_xy))
+    return entries
+
+
+def _extract_layer_bboxes_loop(labeled_grid):
+    # reference: one full-grid pass per label, one filter per layer
+    entries = []
     unique_labels = np.unique(labeled_grid)
     unique_labels = unique_labels[unique_labels != 0]
     for label_val in unique_labels:
         indices = np.argwhere(labeled_grid == label_val)
-        per_layer_voxels = {}
         for z in np.unique(indices[:, 2]):
             slice_inds = indices[indices[:, 2] == z][:, :2]
             if slice_inds.shape[0] == 0:
                 continue
             min_xy = slice_inds.min(axis=0)
             max_xy = slice_inds.max(axis=0)
-            rel_pixels = (slice_inds - min_xy).tolist()
-            per_layer_voxels[int(z)] = {
+            entries.append((int(label_val), int(z), min_xy, max_xy, slice_inds - min_xy))
+    return entries
+
+
+def store_voxel_bounding_boxes(labeled_grid, voxel_dump="voxel_bounding_boxes.json.gz"):
+    """
+    Dump every label's per-layer bbox and relative pixels. The format follows
+    the extension: ".npz" writes the compact binary layout of bbox_store,
+    anything else the gzipped JSON.
+    """
+    entries = extract_layer_bboxes(labeled_grid)
+
+    if voxel_dump.endswith(".npz"):
+        write_bbox_npz(voxel_dump, entries)
+        print(f"Per-layer bounding boxes and pixel coordinates stored (npz) in {voxel_dump}")
+    else:
+        bounding_data = {}
+        for label_val, z, min_xy, max_xy, rel_pixels in entries:
+            bounding_data.setdefault(label_val, {})[z] = {
                 "bounding_box": [min_xy.tolist(), max_xy.tolist()],
-                "active_pixels": rel_pixels
+                "active_pixels": rel_pixels.tolist()
             }
-        bounding_data[int(label_val)] = per_layer_voxels
-
-    with gzip.open(voxel_dump, "wt") as f:
-        json.dump(bounding_data, f, indent=2)
-    print(f"Per-layer bounding boxes and pixel coordinates stored (gzipped) in {voxel_dump}")
+        with gzip.open(voxel_dump, "wt") as f:
+            json.dump(bounding_data, f, indent=2)
+        print(f"Per-layer bounding boxes and pixel coordinates stored (gzipped) in {voxel_dump}")
     print()
     print()
 
@@ -92,7 +171,14 @@ def store_voxel_bounding_boxes(labeled_grid, voxel_dump="voxel_bounding_boxes.js
 # Main Voxel Processing Function
 # ---------------------------
 
-def process_voxel(deposition_points, nz, nx, ny, layer_height, fill_radius=3):
+@timed("stage_seconds", stage="process_voxel")
+def process_voxel(deposition_points, nz, nx, ny, layer_height, fill_radius=3, backend="vectorized"):
+    """
+    Voxelize the deposition points into an (nx, ny, nz) 0/1 grid, each point
+    thickened to a (2r+1)^2 square in its own z-slice.
+    backend: "vectorized" (default) scatters all points at once and dilates
+    each slice; "loop" is the per-point reference. Both give the same grid.
+    """
     arr = np.array(deposition_points)
     x_min, x_max = arr[:,0].min(), arr[:,0].max()
     y_min, y_max = arr[:,1].min(), arr[:,1].max()
@@ -102,6 +188,33 @@ def process_voxel(deposition_points, nz, nx, ny, layer_height, fill_radius=3):
     print("Data bounds:")
     print(f"  Z: {z_min:.4f} → {z_max:.4f}  (range={z_range:.4f})")
 
+    if backend == "loop":
+        return _process_voxel_loop(deposition_points, nz, nx, ny, layer_height, fill_radius,
+                                   x_min, y_min, z_min, x_range, y_range, z_range)
+    if backend != "vectorized":
+        raise ValueError(f"Unknown voxel backend {backend!r}, expected 'vectorized' or 'loop'")
+
+    ix, iy, iz = points_to_voxel_indices(
+        arr, nx, ny, nz,
+        x_min, y_min, z_min,
+        x_range, y_range, z_range,
+        layer_height=layer_height
+    )
+    occupied = np.zeros((nx, ny, nz), dtype=np.uint8)
+    occupied[ix, iy, iz] = 1
+    # square stamp in x/y only, never across z-slices: a binary dilation,
+    # run as a separable max filter (zero outside the grid, as in fill_local_2d)
+    width = 2 * fill_radius + 1
+    voxel_grid = maximum_filter(occupied, size=(width, width, 1), mode="constant", cval=0).astype(int)
+
+    # DEBUG: which slices got any points?
+    print("→ actually used z‐slices:", np.unique(iz))
+
+    return voxel_grid
+
+
+def _process_voxel_loop(deposition_points, nz, nx, ny, layer_height, fill_radius,
+                        x_min, y_min, z_min, x_range, y_range, z_range):
     voxel_grid = np.zeros((nx, ny, nz), dtype=int)
     for x, y, z in deposition_points:
         ix, iy, iz = point_to_voxel_indices(
@@ -126,10 +239,135 @@ def process_voxel(deposition_points, nz, nx, ny, layer_height, fill_radius=3):
     return voxel_grid
 
 
-def save_bounding_boxes_from_grid(voxel_grid, piece_id):
+# ---------------------------
+# Incremental per-piece voxel grid (one layer of points at a time)
+# ---------------------------
+class IncrementalVoxelGrid:
+    """
+    Persistent voxel grid of one piece, fed with the points of each new layer.
+
+    add_points() gives the same grid as
+        process_voxel(filter_points_by_layer(all_points, layer_height, min_points), nz, ...)
+    but only rasterizes the points that became valid in this call. The XY
+    normalization (and with it the whole grid) is re-derived only when the
+    bounds of the kept points change. Points and slices grow in chunks.
+    """
+
+    def __init__(self, nx, ny, layer_height, fill_radius=3, min_points=100, chunk=16):
+        self.nx, self.ny = nx, ny
+        self.layer_height = layer_height
+        self.fill_radius = fill_radius
+        self.min_points = min_points
+        self.chunk = chunk
+
+        self._points = np.empty((0, 3), dtype=np.float64)
+        self.n_points = 0
+        self._kept = np.zeros(0, dtype=bool)
+        self._bounds = None
+        # occupancy by unclipped slice index; only the first `depth` slices are used
+        self._occupied = np.zeros((nx, ny, 0), dtype=np.uint8)
+        self.depth = 0
+        self.rebuilds = 0
+
+    @property
+    def points(self):
+        return self._points[:self.n_points]
+
+    def add_points(self, new_points, nz, min_points=None):
+        """
+        Append the points of the latest layer and return the (nx, ny, nz) int grid.
+        """
+        if min_points is not None and min_points != self.min_points:
+            self.min_points = min_points
+            self._bounds = None  # force a rebuild with the new threshold
+        self._append(np.asarray(new_points, dtype=np.float64).reshape(-1, 3))
+
+        pts = self.points
+        if self.n_points == 0:
+            return self.voxel_grid(nz)
+
+        # same layer filter as filter_points_by_layer, on all points (cheap, vectorized)
+        layer_idxs = np.floor((pts[:, 2] - pts[:, 2].min()) / self.layer_height).astype(int)
+        counts = np.bincount(layer_idxs)
+        kept = (counts >= self.min_points)[layer_idxs]
+        print(f"Layer counts: {dict(enumerate(counts[counts > 0].tolist()))} → keeping layers {np.flatnonzero(counts >= self.min_points).tolist()}")
+
+        previously = np.zeros(self.n_points, dtype=bool)
+        previously[:len(self._kept)] = self._kept
+        self._kept = kept
+        if not kept.any():
+            self._bounds = None
+            self.depth = 0
+            return self.voxel_grid(nz)
+
+        kp = pts[kept]
+        bounds = (kp[:, 0].min(), kp[:, 0].max(), kp[:, 1].min(), kp[:, 1].max(), kp[:, 2].min())
+        if bounds != self._bounds or np.any(previously & ~kept):
+            # normalization changed: every slice moves, rasterize everything again
+            self._bounds = bounds
+            self.depth = 0
+            self._occupied[:] = 0
+            self._rasterize(kp)
+            self.rebuilds += 1
+        else:
+            self._rasterize(pts[kept & ~previously])
+        return self.voxel_grid(nz)
+
+    def voxel_grid(self, nz):
+        """
+        (nx, ny, nz) int grid; slices beyond nz are folded into nz-1,
+        like the clipping in point_to_voxel_indices.
+        """
+        grid = np.zeros((self.nx, self.ny, nz), dtype=int)
+        if nz <= 0 or self.depth == 0:
+            return grid
+        d = min(nz, self.depth)
+        grid[:, :, :d] = self._occupied[:, :, :d]
+        if self.depth > nz:
+            grid[:, :, nz - 1] = self._occupied[:, :, nz - 1:self.depth].max(axis=2)
+        return grid
+
+    def _append(self, new):
+        needed = self.n_points + len(new)
+        if needed > len(self._points):
+            grown = np.empty((max(needed, 2 * len(self._points), 1024), 3), dtype=np.float64)
+            grown[:self.n_points] = self.points
+            self._points = grown
+        self._points[self.n_points:needed] = new
+        self.n_points = needed
+
+    def _rasterize(self, pts):
+        if len(pts) == 0:
+            return
+        x_min, x_max, y_min, y_max, z_min = self._bounds
+        z_top = int(np.floor((pts[:, 2].max() - z_min) / self.layer_height)) + 1
+        ix, iy, iz = points_to_voxel_indices(
+            pts, self.nx, self.ny, z_top,
+            x_min, y_min, z_min,
+            x_max - x_min, y_max - y_min, None,
+            layer_height=self.layer_height
+        )
+        if z_top > self._occupied.shape[2]:
+            cap = -(-z_top // self.chunk) * self.chunk
+            grown = np.zeros((self.nx, self.ny, cap), dtype=np.uint8)
+            grown[:, :, :self._occupied.shape[2]] = self._occupied
+            self._occupied = grown
+        self.depth = max(self.depth, int(iz.max()) + 1)
+
+        # stamp only the touched slices, then OR them in (dilation distributes over union)
+        slices, local_iz = np.unique(iz, return_inverse=True)
+        new = np.zeros((self.nx, self.ny, len(slices)), dtype=np.uint8)
+        new[ix, iy, local_iz] = 1
+        width = 2 * self.fill_radius + 1
+        new = maximum_filter(new, size=(width, width, 1), mode="constant", cval=0)
+        self._occupied[:, :, slices] |= new
+
+
+def save_bounding_boxes_from_grid(voxel_grid, piece_id, fmt="json"):
     """
     Given a boolean 3D grid for one piece, do one label() and
-    dump the bboxes to piece_{piece_id}_bounding_boxes.json.gz.
+    dump the bboxes to piece_{piece_id}_bounding_boxes.json.gz
+    (or .npz with fmt="npz").
     """
 
 
@@ -137,7 +375,7 @@ def save_bounding_boxes_from_grid(voxel_grid, piece_id):
     labeled, n = label(voxel_grid, structure=struct3d)
     print(f"[Voxel_grid] piece {piece_id}: found {n} blob(s)")
 
-    bbox_path = f"piece_{piece_id}_bounding_boxes.json.gz"
+    bbox_path = piece_bbox_path(piece_id, fmt)
     store_voxel_bounding_boxes(labeled, voxel_dump=bbox_path)
     print(f"[Voxel_grid] piece {piece_id}: saved bboxes → {bbox_path}")
     print()
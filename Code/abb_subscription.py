@@ -0,0 +1,285 @@
+import base64
+import os
+import re
+import socket
+import struct
+import threading
+import time
+from urllib.parse import urlparse
+
+from ABB_control import client
+from rws_client import RWSClient
+
+# --- CONFIG ---
+symbol_path = '/rw/rapid/symbol/data/RAPID/T_ROB1/MainModule/{}'
+
+# one event per changed symbol in the RWS 1.0 subscription XML
+_event_re = re.compile(r'<li class="rap-value-ev"[^>]*>(.*?)</li>', re.S)
+_href_re = re.compile(r'href="[^"]*/MainModule/([^";/]+);value"')
+_value_re = re.compile(r'<span class="value">([^<]*)</span>')
+
+
+# ---------------------------
+# Minimal WebSocket client (RFC 6455), enough for RWS event push
+# ---------------------------
+class _WebSocket:
+    def __init__(self, ws_url, cookies="", protocol="robapi2_subscription", timeout=5.0):
+        parsed = urlparse(ws_url)
+        host, port = parsed.hostname, parsed.port or 80
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        key = base64.b64encode(os.urandom(16)).decode()
+        request = (
+            f"GET {parsed.path or '/'} HTTP/1.1\r\n"
+            f"Host: {host}:{port}\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\n"
+            "Sec-WebSocket-Version: 13\r\n"
+            f"Sec-WebSocket-Protocol: {protocol}\r\n"
+            + (f"Cookie: {cookies}\r\n" if cookies else "")
+            + "\r\n"
+        )
+        self.sock.sendall(request.encode())
+        head = b""
+        while b"\r\n\r\n" not in head:
+            chunk = self.sock.recv(1024)
+            if not chunk:
+                raise ConnectionError("WebSocket handshake: connection closed")
+            head += chunk
+        status = head.split(b"\r\n", 1)[0]
+        if b" 101 " not in status + b" ":
+            raise ConnectionError(f"WebSocket handshake refused: {status.decode(errors='replace')}")
+        self._buffer = head.split(b"\r\n\r\n", 1)[1]
+        self.sock.settimeout(None)
+
+    def _read(self, n):
+        while len(self._buffer) < n:
+            chunk = self.sock.recv(4096)
+            if not chunk:
+                raise ConnectionError("WebSocket closed")
+            self._buffer += chunk
+        data, self._buffer = self._buffer[:n], self._buffer[n:]
+        return data
+
+    def _send(self, opcode, payload=b""):
+        # client frames are always masked
+        mask = os.urandom(4)
+        header = bytes([0x80 | opcode])
+        n = len(payload)
+        if n < 126:
+            header += bytes([0x80 | n])
+        elif n < 65536:
+            header += bytes([0x80 | 126]) + struct.pack(">H", n)
+        else:
+            header += bytes([0x80 | 127]) + struct.pack(">Q", n)
+        masked = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        self.sock.sendall(header + mask + masked)
+
+    def recv(self):
+        """
+        Next text message, or None once the server closed the socket.
+        """
+        message = b""
+        while True:
+            b0, b1 = self._read(2)
+            opcode, fin = b0 & 0x0F, b0 & 0x80
+            n = b1 & 0x7F
+            if n == 126:
+                n = struct.unpack(">H", self._read(2))[0]
+            elif n == 127:
+                n = struct.unpack(">Q", self._read(8))[0]
+            mask = self._read(4) if b1 & 0x80 else None
+            payload = self._read(n)
+            if mask:
+                payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+            if opcode == 0x8:      # close
+                return None
+            if opcode == 0x9:      # ping
+                self._send(0xA, payload)
+                continue
+            if opcode in (0x0, 0x1, 0x2):
+                message += payload
+                if fin:
+                    return message.decode("utf-8", errors="replace")
+
+    def close(self):
+        try:
+            self._send(0x8)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+# ---------------------------
+# Symbol watcher: subscription push, polling fallback
+# ---------------------------
+class SymbolWatcher:
+    """
+    Keeps the latest value of a few rarely-changing RAPID symbols
+    (layer_finished, wielding, which_pieces by default).
+
+    mode="subscribe" asks the controller to push changes (RWS subscription
+    over a WebSocket) and falls back to polling if that is not available;
+    mode="poll" polls them on a background thread. Either way readers only
+    touch the local cache, so the HTTP link is left to position polling.
+    Each symbol has a version counter bumped on every change, to tell a fresh
+    edge from a value left over from before.
+    """
+
+    def __init__(self, symbols=("layer_finished", "wielding", "which_pieces"), base=None,
+                 mode="subscribe", poll_interval=0.001, priority=1):
+        self.symbols = list(symbols)
+        # the process-wide client, or a private one for another controller
+        self.client = client if base is None else RWSClient(base)
+        self.base = self.client.base_url
+        self.mode = mode
+        self.poll_interval = poll_interval
+        self.priority = priority
+
+        self.values = {}
+        self.versions = {s: 0 for s in self.symbols}
+        self.active_mode = None
+        self._changed = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        self._ws = None
+        self._subscription_url = None
+
+    # --- cache ---
+    def get(self, symbol, default=None):
+        return self.values.get(symbol, default)
+
+    def version(self, symbol):
+        return self.versions.get(symbol, 0)
+
+    def layer_finished(self):
+        return self.get("layer_finished") == "TRUE"
+
+    def welding(self):
+        return self.get("wielding") == "TRUE"
+
+    def piece(self):
+        try:
+            return int(self.get("which_pieces", 0))
+        except ValueError:
+            return 0
+
+    def wait_for_change(self, symbol, since_version, timeout=None):
+        """
+        Block until `symbol` changed after `since_version`; returns True if it did.
+        """
+        with self._changed:
+            return self._changed.wait_for(lambda: self.version(symbol) > since_version, timeout)
+
+    def _update(self, symbol, value):
+        with self._changed:
+            if self.values.get(symbol) != value:
+                self.values[symbol] = value
+                self.versions[symbol] = self.versions.get(symbol, 0) + 1
+                self._changed.notify_all()
+
+    def _seed(self, symbol, value):
+        # initial value: only if no event got there first
+        with self._changed:
+            if symbol not in self.values:
+                self._update(symbol, value)
+
+    # --- lifecycle ---
+    def start(self):
+        """
+        Subscribe (or fall back to polling), then read the initial values.
+        An event that arrives while they are read is newer than the read, so
+        it wins; later events override the initial values as usual.
+        Returns the mode actually in use ("subscribe" or "poll").
+        """
+        if self.mode == "subscribe":
+            try:
+                self._subscribe()
+                self.active_mode = "subscribe"
+                self._thread = threading.Thread(target=self._listen, daemon=True)
+                self._thread.start()
+            except Exception as e:
+                print(f"Subscription unavailable ({e}); falling back to polling")
+
+        for s in self.symbols:
+            value = self._read_symbol(s)
+            if value is not None:
+                self._seed(s, value)
+
+        if self.active_mode is None:
+            self.active_mode = "poll"
+            self._thread = threading.Thread(target=self._poll, daemon=True)
+            self._thread.start()
+        return self.active_mode
+
+    def stop(self):
+        self._stop.set()
+        if self._ws is not None:
+            self._ws.close()
+        if self._subscription_url:
+            try:
+                self.client.request("DELETE", self._subscription_url)
+            except Exception:
+                pass
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # --- transport ---
+    def _read_symbol(self, symbol):
+        try:
+            return self.client.read_symbol(symbol)
+        except Exception as e:
+            print(f"Error reading {symbol}: {e}")
+        return None
+
+    def _subscribe(self):
+        payload = {"resources": [str(i + 1) for i in range(len(self.symbols))]}
+        for i, s in enumerate(self.symbols, start=1):
+            payload[str(i)] = f"{symbol_path.format(s)};value"
+            payload[f"{i}-p"] = str(self.priority)
+        resp = self.client.request("POST", "/subscription", data=payload, retries=0,
+                                   headers={"Content-Type": "application/x-www-form-urlencoded"})
+        if resp.status_code != 201 or "Location" not in resp.headers:
+            raise ConnectionError(f"subscription refused: {resp.status_code}")
+        location = resp.headers["Location"]
+        cookies = "; ".join(f"{c.name}={c.value}" for c in self.client.session.cookies)
+        self._ws = _WebSocket(location, cookies=cookies)
+        # the subscription itself is deleted through HTTP
+        parsed = urlparse(location)
+        self._subscription_url = f"/subscription/{parsed.path.rstrip('/').split('/')[-1]}"
+
+    def _listen(self):
+        while not self._stop.is_set():
+            try:
+                message = self._ws.recv()
+            except OSError:
+                message = None
+            if message is None:
+                if not self._stop.is_set():
+                    print("Subscription closed by the controller; falling back to polling")
+                    self.active_mode = "poll"
+                    self._poll()
+                return
+            for event in _event_re.findall(message):
+                name = _href_re.search(event)
+                if not name or name.group(1) not in self.versions:
+                    continue
+                value = _value_re.search(event)
+                # some controllers only send the href: read the value once
+                self._update(name.group(1), value.group(1) if value else self._read_symbol(name.group(1)))
+
+    def _poll(self):
+        while not self._stop.is_set():
+            for s in self.symbols:
+                value = self._read_symbol(s)
+                if value is not None:
+                    self._update(s, value)
+            time.sleep(self.poll_interval)
@@ -0,0 +1,198 @@
+import os
+import threading
+import weakref
+import zipfile
+from collections.abc import Mapping
+import numpy as np
+
+# ---------------------------
+# Compact binary format for per-layer bounding boxes / active pixels
+# ---------------------------
+# An uncompressed .npz holding two arrays:
+#   "pixels": (N, 2) relative [x, y] pixels of every component-layer, concatenated
+#   "index":  (M, 8) one row per component-layer:
+#             label, z, xmin, ymin, xmax, ymax, start, count   (rows of "pixels")
+# Members are stored uncompressed so "pixels" can be memory-mapped and each
+# layer read lazily. Same content as the gzipped JSON of store_voxel_bounding_boxes.
+
+BBOX_FORMATS = {"json": ".json.gz", "npz": ".npz"}
+INDEX_COLUMNS = ("label", "z", "xmin", "ymin", "xmax", "ymax", "start", "count")
+
+# Every live BBoxArchive, so write_bbox_npz can release the maps of the file it
+# replaces (a mapped file cannot be replaced on Windows).
+_archives = weakref.WeakValueDictionary()   # id → archive (Mappings are unhashable)
+_archives_lock = threading.Lock()
+
+
+def write_bbox_npz(path, entries):
+    """
+    entries: iterable of (label, z, min_xy, max_xy, rel_pixels) with
+    rel_pixels an (n, 2) int array.
+    """
+    index, chunks, start = [], [], 0
+    for label, z, min_xy, max_xy, rel in entries:
+        rel = np.asarray(rel).reshape(-1, 2)
+        index.append([label, z, min_xy[0], min_xy[1], max_xy[0], max_xy[1], start, len(rel)])
+        chunks.append(rel)
+        start += len(rel)
+    pixels = np.concatenate(chunks) if chunks else np.empty((0, 2), dtype=np.int64)
+    # relative pixels are small and non-negative: 2 bytes each when they fit
+    dtype = np.uint16 if pixels.size == 0 or (pixels.min() >= 0 and pixels.max() <= np.iinfo(np.uint16).max) else np.int32
+    # write next to the target and swap it in; archives still reading the old
+    # file keep its content in memory and let go of the mapping first
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, pixels=pixels.astype(dtype), index=np.asarray(index, dtype=np.int64).reshape(-1, 8))
+    with _archives_lock:
+        readers = [a for a in _archives.values() if os.path.abspath(a.path) == os.path.abspath(path)]
+    for archive in readers:
+        archive.detach()
+    os.replace(tmp_path, path)
+
+
+def _mmap_npz_member(path, name):
+    """
+    Memory-map one uncompressed array of an .npz (falls back to reading it).
+    """
+    with zipfile.ZipFile(path) as zf:
+        info = zf.getinfo(name + ".npy")
+        if info.compress_type != zipfile.ZIP_STORED:
+            with zf.open(info) as member:
+                return np.lib.format.read_array(member)
+    with open(path, "rb") as f:
+        # skip the zip local file header to reach the .npy bytes
+        f.seek(info.header_offset + 26)
+        name_len, extra_len = np.frombuffer(f.read(4), dtype="<u2")
+        f.seek(info.header_offset + 30 + int(name_len) + int(extra_len))
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    if 0 in shape:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape,
+                     order="F" if fortran else "C")
+
+
+class _LayerData(Mapping):
+    """
+    One component-layer: {"bounding_box": [[xmin, ymin], [xmax, ymax]],
+    "active_pixels": (n, 2) int64 array, read from the file on access}.
+    """
+
+    def __init__(self, archive, row):
+        self._archive = archive
+        self._row = row
+
+    def __getitem__(self, key):
+        label, z, xmin, ymin, xmax, ymax, start, count = self._row
+        if key == "bounding_box":
+            return [[int(xmin), int(ymin)], [int(xmax), int(ymax)]]
+        if key == "active_pixels":
+            # widen the on-disk uint16 so offsets like y - 1 cannot wrap around
+            return self._archive.pixels[start:start + count].astype(np.int64)
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(("bounding_box", "active_pixels"))
+
+    def __len__(self):
+        return 2
+
+
+class _ComponentLayers(Mapping):
+    # str(z) → _LayerData for one component label
+    def __init__(self, archive, rows):
+        self._archive = archive
+        self._rows = {str(int(row[1])): row for row in rows}
+
+    def __getitem__(self, z_str):
+        return _LayerData(self._archive, self._rows[z_str])
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __len__(self):
+        return len(self._rows)
+
+
+class BBoxArchive(Mapping):
+    """
+    Read-only, lazy view of a .npz bbox file with the same shape as the JSON:
+    str(label) → str(z) → {"bounding_box", "active_pixels"}.
+    Only the small index is read up front; pixels are memory-mapped.
+    The view keeps the content it was opened with: when write_bbox_npz
+    replaces the file, the pixels are read into memory first (detach).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # a copy: the index must not keep the file mapped
+        self.index = np.array(_mmap_npz_member(path, "index"))
+        self._pixels = None
+        self._labels = {}
+        for row in self.index:
+            self._labels.setdefault(str(int(row[0])), []).append(row)
+        with _archives_lock:
+            _archives[id(self)] = self
+
+    @property
+    def pixels(self):
+        if self._pixels is None:
+            self._pixels = _mmap_npz_member(self.path, "pixels")
+        return self._pixels
+
+    def detach(self):
+        """
+        Read the pixels into memory and drop the file mapping, so the file
+        can be replaced or deleted (also on Windows).
+        """
+        if self._pixels is None or isinstance(self._pixels, np.memmap):
+            self._pixels = np.array(self.pixels)
+
+    def __getitem__(self, label):
+        return _ComponentLayers(self, self._labels[label])
+
+    def __iter__(self):
+        return iter(self._labels)
+
+    def __len__(self):
+        return len(self._labels)
+
+    def to_dict(self):
+        """
+        Plain nested dict with list pixels, identical to the JSON content.
+        """
+        return {label: {z: {"bounding_box": layer["bounding_box"],
+                            "active_pixels": np.asarray(layer["active_pixels"]).tolist()}
+                        for z, layer in layers.items()}
+                for label, layers in self.items()}
+
+
+def detect_bbox_format(path):
+    """
+    "npz" or "json", from the file's magic bytes (zip vs gzip).
+    """
+    with open(path, "rb") as f:
+        magic = f.read(2)
+    if magic == b"PK":
+        return "npz"
+    if magic == b"\x1f\x8b":
+        return "json"
+    raise ValueError(f"{path}: not a gzipped JSON or .npz bbox file")
+
+
+def piece_bbox_path(piece_id, fmt=None):
+    """
+    Path of a piece's bbox file. With fmt=None, whichever format was
+    written last (the JSON name if none exists yet).
+    """
+    if fmt is not None:
+        return f"piece_{piece_id}_bounding_boxes{BBOX_FORMATS[fmt]}"
+    existing = [p for p in (f"piece_{piece_id}_bounding_boxes{ext}" for ext in BBOX_FORMATS.values())
+                if os.path.exists(p)]
+    if not existing:
+        return f"piece_{piece_id}_bounding_boxes{BBOX_FORMATS['json']}"
+    return max(existing, key=os.path.getmtime)
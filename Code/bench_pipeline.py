@@ -0,0 +1,242 @@
+import argparse
+import io
+import json
+import os
+import pickle
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+import numpy as np
+from scipy.ndimage import label
+
+from filter_outliers import filter_points_by_layer
+from Voxel_grid import process_voxel, store_voxel_bounding_boxes
+from heat import simulate_heat, load_voxel_data, compute_piece_avg_temp
+from q_agent import QAgent
+from point_log import load_layers
+
+# ---------------------------
+# End-to-end benchmark: every stage of one layer's processing, per workload
+# ---------------------------
+# Workloads are synthetic (ring-shaped walls, one ring per piece) at a few
+# preset sizes, or the recorded deposition_points_piece_N files. Each stage
+# is timed on its own (best of `repeats`, summed over the pieces) and the
+# results are written as JSON; --baseline flags stages that got slower.
+
+STAGES = ("filter", "voxelize", "label", "bbox_json", "bbox_npz", "heat", "avg_temp", "decision")
+
+# name: (points per layer, layers, pieces, grid resolution nx = ny)
+SIZES = {
+    "tiny":   (500,  3,  1, 100),
+    "small":  (2000, 5,  2, 200),
+    "medium": (4000, 10, 4, 400),
+    "large":  (8000, 20, 4, 400),
+}
+
+layer_height = 1.0
+fill_radius  = 3
+min_points   = 50
+cool_time    = 10.0
+decisions    = 200   # decisions timed per repeat (encode_state + choose_action + update)
+
+
+def synthetic_piece(points_per_layer, n_layers, center, radius=20.0, seed=0):
+    """
+    A cylindrical wall printed layer by layer, with some positioning noise.
+    """
+    rng = np.random.default_rng(seed)
+    layers = []
+    for z in range(n_layers):
+        angle = np.linspace(0, 2 * np.pi, points_per_layer, endpoint=False)
+        r = radius + rng.normal(0, 0.3, points_per_layer)
+        layers.append(np.column_stack([
+            center[0] + r * np.cos(angle),
+            center[1] + r * np.sin(angle),
+            z * layer_height + 0.2 + rng.normal(0, 0.05, points_per_layer),
+        ]))
+    return layers
+
+
+def synthetic_workload(name, points_per_layer, n_layers, n_pieces, grid):
+    pieces = {pid: synthetic_piece(points_per_layer, n_layers, (100.0 * pid, 0.0), seed=pid)
+              for pid in range(1, n_pieces + 1)}
+    return {"name": name, "kind": "synthetic", "grid": grid, "pieces": pieces,
+            "points_per_layer": points_per_layer, "layers": n_layers}
+
+
+def recorded_workload(directory=".", piece_ids=(1, 2, 3, 4), grid=400):
+    pieces = {}
+    for pid in piece_ids:
+        for ext in (".bin", ".json"):
+            path = os.path.join(directory, f"deposition_points_piece_{pid}{ext}")
+            if os.path.exists(path) and os.path.getsize(path) > 2:
+                pieces[pid] = load_layers(path, layer_height)
+                break
+    if not pieces:
+        return None
+    n_points = sum(len(l) for layers in pieces.values() for l in layers)
+    n_layers = max(len(layers) for layers in pieces.values())
+    return {"name": "recorded", "kind": "recorded", "grid": grid, "pieces": pieces,
+            "points_per_layer": n_points // max(1, sum(len(l) for l in pieces.values())), "layers": n_layers}
+
+
+def _best(fn, repeats):
+    best, out = float("inf"), None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        with redirect_stdout(io.StringIO()):   # the stages print progress
+            out = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, out
+
+
+def run_workload(workload, repeats=3, workdir="."):
+    nx = ny = workload["grid"]
+    timings = dict.fromkeys(STAGES, 0.0)
+    stats = {}
+    struct3d = np.ones((3, 3, 3), dtype=bool)
+
+    for pid, layers in workload["pieces"].items():
+        points = np.concatenate(layers).tolist()
+        nz = len(layers)
+
+        t, filtered = _best(lambda: filter_points_by_layer(points, layer_height, min_points=min_points), repeats)
+        timings["filter"] += t
+        t, grid = _best(lambda: process_voxel(filtered, nz, nx, ny, layer_height, fill_radius=fill_radius), repeats)
+        timings["voxelize"] += t
+        t, (labeled, _) = _best(lambda: label(grid, structure=struct3d), repeats)
+        timings["label"] += t
+
+        json_path = os.path.join(workdir, f"piece_{pid}_bounding_boxes.json.gz")
+        npz_path = os.path.join(workdir, f"piece_{pid}_bounding_boxes.npz")
+        t, _ = _best(lambda: store_voxel_bounding_boxes(labeled, voxel_dump=json_path), repeats)
+        timings["bbox_json"] += t
+        t, _ = _best(lambda: store_voxel_bounding_boxes(labeled, voxel_dump=npz_path), repeats)
+        timings["bbox_npz"] += t
+
+        t, output = _best(lambda: simulate_heat(json_path, nz, nx, ny, cool_time), repeats)
+        timings["heat"] += t
+        piece_bbox = load_voxel_data(json_path)
+        t, (avg_temp, _) = _best(lambda: compute_piece_avg_temp(output, piece_bbox, mask_heatmap=True), repeats)
+        timings["avg_temp"] += t
+        stats[pid] = {"avg_temp": avg_temp}
+
+    # one agent decision over all pieces, averaged over `decisions` runs
+    agent = QAgent()
+    if os.path.exists("q_table.pkl"):
+        with open("q_table.pkl", "rb") as f:
+            agent.q_table = pickle.load(f)
+    piece_ids = sorted(stats)
+    counts = {pid: len(workload["pieces"][pid]) for pid in piece_ids}
+    rnd = random.Random(0)
+
+    def decide():
+        for _ in range(decisions):
+            state = agent.encode_state(stats, piece_ids, layer_counts=counts)
+            action = agent.choose_action(state, piece_ids)
+            agent.update(state, action, rnd.choice((-6, 0, 4)), state, piece_ids)
+
+    t, _ = _best(decide, repeats)
+    timings["decision"] = t / decisions
+    return timings
+
+
+def machine_info():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": time.time(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(results, baseline, tolerance=0.5, min_delta=0.002):
+    """
+    Stages slower than baseline by more than `tolerance` (relative) and
+    `min_delta` seconds (absolute, to ignore timer noise on tiny stages).
+    """
+    base = {(r["workload"], r["stage"]): r["seconds"] for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        old = base.get((r["workload"], r["stage"]))
+        if old is None:
+            continue
+        if r["seconds"] > old * (1 + tolerance) and r["seconds"] - old > min_delta:
+            regressions.append({"workload": r["workload"], "stage": r["stage"],
+                                "baseline": old, "seconds": r["seconds"], "ratio": r["seconds"] / old})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage benchmark of the processing pipeline")
+    parser.add_argument("--sizes", nargs="*", default=["tiny", "small", "medium"], choices=sorted(SIZES))
+    parser.add_argument("--custom", nargs="*", default=[], metavar="P,L,N,G",
+                        help="extra synthetic workloads: points/layer,layers,pieces,grid")
+    parser.add_argument("--recorded", action="store_true", help="also run the recorded deposition points")
+    parser.add_argument("--data", default=".", help="directory holding the recordings")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--baseline", help="flag regressions against this results file (exit code 1)")
+    parser.add_argument("--save-baseline", help="also write the results to this baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="relative slowdown allowed")
+    args = parser.parse_args()
+
+    workloads = [synthetic_workload(name, *SIZES[name]) for name in args.sizes]
+    for spec in args.custom:
+        p, l, n, g = (int(v) for v in spec.split(","))
+        workloads.append(synthetic_workload(f"custom_{p}x{l}x{n}@{g}", p, l, n, g))
+    if args.recorded:
+        recorded = recorded_workload(args.data)
+        if recorded is None:
+            print(f"No recordings found in {args.data}, skipping the recorded workload")
+        else:
+            workloads.append(recorded)
+
+    results = []
+    print(f"{'workload':<24}" + "".join(f"{s:>11}" for s in STAGES) + f"{'total':>10}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for w in workloads:
+            timings = run_workload(w, args.repeats, workdir)
+            for stage, seconds in timings.items():
+                results.append({"workload": w["name"], "kind": w["kind"], "stage": stage, "seconds": seconds,
+                                "points_per_layer": w["points_per_layer"], "layers": w["layers"],
+                                "pieces": len(w["pieces"]), "grid": w["grid"]})
+            print(f"{w['name']:<24}" + "".join(f"{timings[s]:>11.3g}" for s in STAGES)
+                  + f"{sum(timings.values()):>10.3f}")
+
+    report = {"meta": machine_info(), "repeats": args.repeats, "results": results}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report["regressions"] = compare(results, baseline, args.tolerance)
+        for r in report["regressions"]:
+            print(f"REGRESSION {r['workload']}/{r['stage']}: {r['baseline']:.4f}s → {r['seconds']:.4f}s "
+                  f"({r['ratio']:.2f}x)")
+        if not report["regressions"]:
+            print(f"No regression against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+    print(f"Results → {args.out}")
+
+    if report.get("regressions"):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import json
+import time
+import numpy as np
+from contextlib import redirect_stdout
+import io
+from glob import glob
+from Voxel_grid import process_voxel
+
+# ---------------------------
+# Benchmark: per-point vs vectorized voxelization on the recorded point clouds
+# ---------------------------
+nx, ny       = 400, 400
+layer_height = 1.0
+fill_radius  = 3
+repeats      = 3
+
+
+def time_backend(points, nz, backend):
+    best = float("inf")
+    grid = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        with redirect_stdout(io.StringIO()):  # process_voxel prints its bounds
+            grid = process_voxel(points, nz, nx, ny, layer_height, fill_radius=fill_radius, backend=backend)
+        best = min(best, time.perf_counter() - start)
+    return best, grid
+
+
+def main():
+    print(f"{'file':<34}{'points':>8}{'nz':>4}{'loop [s]':>10}{'vector [s]':>12}{'speedup':>9}  same")
+    for path in sorted(glob("deposition_points_piece_*.json")):
+        with open(path) as f:
+            points = json.load(f)
+        if not points:
+            continue
+        z = np.array(points)[:, 2]
+        nz = int(np.floor((z.max() - z.min()) / layer_height)) + 1
+
+        t_loop, g_loop = time_backend(points, nz, "loop")
+        t_vec, g_vec = time_backend(points, nz, "vectorized")
+        same = np.array_equal(g_loop, g_vec)
+        print(f"{path:<34}{len(points):>8}{nz:>4}{t_loop:>10.3f}{t_vec:>12.4f}{t_loop / t_vec:>8.1f}x  {same}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,12 +3,34 @@ import time
 # We only need to remember, for each piece, the timestamp when it last finished.
 _last_end_times = {}
 
+# Source of "now" for the print timers and the thermal state (perf_counter
+# seconds). Offline replays swap in a simulated clock with set_clock().
+_clock = time.perf_counter
+
+
+def now():
+    return _clock()
+
+
+def set_clock(clock=None):
+    """
+    Use `clock()` as the time source (None restores time.perf_counter).
+    Timers already recorded keep their values, so reset_timers() first
+    when switching between unrelated clocks.
+    """
+    global _clock
+    _clock = clock or time.perf_counter
+
+
+def reset_timers():
+    _last_end_times.clear()
+
 def start_print(piece_id):
     """
     Call this exactly once when you begin printing piece_id.
     Returns the idle time (since it last finished) that you should use.
     """
-    now = time.perf_counter()
+    now = _clock()
     # Measure how long it’s been since the last end_print
     last_end = _last_end_times.get(piece_id, now)
     idle     = now - last_end
@@ -21,14 +43,14 @@ def end_print(piece_id):
     Call this once when you finish printing piece_id.
     It updates the “last end” timestamp so the next start_print can measure idle.
     """
-    _last_end_times[piece_id] = time.perf_counter()
+    _last_end_times[piece_id] = _clock()
 
 def get_cooling_time(piece_id, reset: bool = False):
     """
     Return the time elapsed since you last called end_print(piece_id).
     If reset=True, zero it out (i.e. treat “now” as the new last_end).
     """
-    now = time.perf_counter()
+    now = _clock()
     last_end = _last_end_times.get(piece_id)
     if last_end is None:
         # never printed this piece yet
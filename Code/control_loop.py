@@ -0,0 +1,243 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import fetch
+import metrics
+from ABB_control import set_piece_choice
+from calculate_cooling_time import start_print, end_print, now as clock_now
+from point_log import deposition_log_path
+from save_heat_stats import save_heat_stats, refresh_cooling_stats, time_until_cold
+from thermal_state import get_piece_state
+from Voxel_grid import IncrementalVoxelGrid, save_bounding_boxes_from_grid
+
+# ---------------------------
+# Pipelined AI phase: the analysis of one layer overlaps the print of the next
+# ---------------------------
+# The sequential loop of main.py voxelizes, simulates and decides while the
+# robot sits paused. Here the next piece is chosen while the current layer
+# prints, so the robot restarts as soon as layer_finished flips:
+#   - during the print of piece A, a background worker pre-scores the next
+#     choice among the other pieces, each piece's average temperature being
+#     predicted at the expected end of A's layer from its thermal state;
+#   - when the layer ends, the pre-scored piece is checked against the thermal
+#     model at the actual time and sent to the controller right away;
+#   - A's new layer (voxels, bboxes, thermal deposit) is then processed by the
+#     worker while the next piece prints.
+# The worker is a single thread, so a layer's deposit is always applied before
+# the pre-scoring that follows it. When no piece is predicted cold enough, the
+# loop falls back to processing the layer first, then sleeps until the
+# thermal model predicts the first piece cold enough, and stops (NoPieceCools)
+# if it predicts none ever will.
+
+
+class PipelinedController:
+    """
+        controller = PipelinedController(agent, piece_ids, snapshot, watcher=watcher,
+                                         layer_targets={1: 5}, stats=stats)
+        controller.run()      # until every piece reached its target layer count
+
+    piece_ids is updated in place as pieces complete. `stats` is a
+    save_heat_stats(..., incremental=True) result for piece_ids; it is kept up
+    to date as layers are processed. Rewards (same shaping as main.py) are
+    appended to `reward_history`; a choice is learned once the decision that
+    follows it is known, its reward shaping the wait before that decision.
+    """
+
+    def __init__(self, agent, piece_ids, snapshot, watcher=None, layer_targets=None, layers_per_piece=10,
+                 stats=None, voxel_grids=None, reward_history=None, nx=400, ny=400, layer_height=1.0,
+                 min_points=100, fill_radius=3, layer_time=60.0):
+        self.agent = agent
+        self.piece_ids = piece_ids
+        self.snapshot = snapshot
+        self.watcher = watcher
+        self.layer_targets = layer_targets or {}
+        self.layers_per_piece = layers_per_piece
+        self.voxel_grids = {} if voxel_grids is None else voxel_grids
+        self.reward_history = [] if reward_history is None else reward_history
+        self.nx, self.ny = nx, ny
+        self.layer_height = layer_height
+        self.min_points = min_points
+        self.fill_radius = fill_radius
+        self.layer_time = layer_time    # expected print time of a layer before any was measured
+
+        self.stats = stats if stats is not None else save_heat_stats(
+            piece_ids, nx, ny, incremental=True, layer_counts=snapshot.layer_counts(piece_ids))
+        self.layer_times = {}           # piece id → duration of its last layer
+        self.robot_idle = []            # seconds between a layer's end and the next start
+        self.prescored = 0              # layers started on a pre-scored choice
+        self._worker = ThreadPoolExecutor(max_workers=1)
+        self._processing = None
+
+    def target(self, piece_id):
+        return self.layer_targets.get(piece_id, self.layers_per_piece)
+
+    def expected_layer_time(self, piece_id):
+        if piece_id in self.layer_times:
+            return self.layer_times[piece_id]
+        if self.layer_times:
+            return sum(self.layer_times.values()) / len(self.layer_times)
+        return self.layer_time
+
+    # --- decisions ---
+    def _valid(self, stats, candidates):
+        return [pid for pid in candidates if stats[pid]["avg_temp"] < self.agent.temp_threshold]
+
+    def _decide(self, stats, active, valid, waiting_time=0.0, layer_counts=None):
+        if layer_counts is None:
+            layer_counts = self.snapshot.layer_counts(active)
+        state = self.agent.encode_state(stats, active, layer_counts=layer_counts)
+        choice = self.agent.choose_action(state, valid)
+        return {"choice": choice, "state": state, "valid": valid, "stats": stats, "active": active,
+                "waiting_time": waiting_time}
+
+    def prescore(self, at, active, candidates, layer_counts=None):
+        """
+        Decision for clock time `at`, from every active piece's predicted
+        average temperature (and layer counts, default: the current ones).
+        None if no candidate is predicted cold enough.
+        """
+        stats = {pid: dict(self.stats[pid], avg_temp=get_piece_state(pid, self.nx, self.ny).avg_temp_at(at))
+                 for pid in active}
+        valid = self._valid(stats, candidates)
+        return self._decide(stats, active, valid, layer_counts=layer_counts) if valid else None
+
+    def decide_now(self):
+        """
+        Decision on the current thermal state. If no piece is cold enough,
+        sleep until the thermal model predicts the first crossing, then
+        check it with refresh_cooling_stats. Raises save_heat_stats.NoPieceCools
+        (out of run() too) if no piece is predicted to cool at all.
+        """
+        active = list(self.piece_ids)
+        stats = refresh_cooling_stats(self.stats, active)
+        valid = self._valid(stats, active)
+        waiting_time = 0.0
+        wait_start = time.perf_counter()
+        while not valid:
+            print()
+            wake, first = time_until_cold(stats, active, self.agent.temp_threshold)
+            print(f"No pieces is cold enough. waiting {wake:.1f}s for piece {first}...")
+            time.sleep(wake)
+            stats = refresh_cooling_stats(self.stats, active)
+            for pid, info in stats.items():
+                print(f"Piece {pid}: average temp = {info['avg_temp']:.2f} °C")
+            valid = self._valid(stats, active)
+            waiting_time = time.perf_counter() - wait_start
+        if waiting_time:
+            metrics.observe("control_seconds", waiting_time, stage="wait_cold")
+        return self._decide(dict(stats), active, valid, waiting_time)
+
+    def _confirm(self, decision):
+        # the layer may have ended earlier than expected: re-check the choice at the actual time,
+        # and re-score (cheap, no simulation) if it is no longer cold enough or a piece completed
+        if decision is None:
+            return None
+        at = clock_now()
+        temp = get_piece_state(decision["choice"], self.nx, self.ny).avg_temp_at(at)
+        if temp < self.agent.temp_threshold and decision["active"] == self.piece_ids:
+            return decision
+        candidates = [pid for pid in decision["valid"] if pid in self.piece_ids]
+        return self.prescore(at, list(self.piece_ids), candidates) if candidates else None
+
+    # --- layer processing (worker thread) ---
+    def _process_layer(self, piece_id, new_points, nz):
+        grid = self.voxel_grids.setdefault(
+            piece_id, IncrementalVoxelGrid(self.nx, self.ny, self.layer_height, fill_radius=self.fill_radius))
+        voxel_grid = grid.add_points(new_points, nz, min_points=self.min_points)
+        save_bounding_boxes_from_grid(voxel_grid, piece_id, fmt="npz")
+        self.stats.update(save_heat_stats([piece_id], self.nx, self.ny, incremental=True,
+                                          layer_counts={piece_id: nz}))
+
+    def _learn(self, previous, decision):
+        # learning step for the previous (state, choice), with the decision it led to as the
+        # next state; None: no decision followed, the episode ended without a wait
+        state, choice = previous
+        if decision is None:
+            next_state, next_valid, waiting_time = state, [], 0.0
+        else:
+            next_state, next_valid, waiting_time = decision["state"], decision["valid"], decision["waiting_time"]
+        reward = self._reward(waiting_time)
+        self.agent.update(state, choice, reward, next_state, next_valid)
+        self.reward_history.append(reward)
+        self.agent.decay_epsilon()
+
+    def _reward(self, waiting_time):
+        reward = -1
+        if waiting_time == 0:
+            reward += 5
+        elif waiting_time < 30:
+            reward += 1
+        else:
+            reward -= 5
+        return reward
+
+    # --- main loop ---
+    def run(self):
+        paused_at = None
+        previous = None     # (state, choice) of the last decision, learned once the next one is known
+        # pieces that already reached their target never get a decision
+        for pid in list(self.piece_ids):
+            if self.snapshot.layer_count(pid) >= self.target(pid):
+                self.piece_ids.remove(pid)
+                print(f"Piece {pid} has reached {self.target(pid)} layers - removing from queue")
+        decision = self.decide_now() if self.piece_ids else None
+        try:
+            while decision is not None:
+                choice = decision["choice"]
+                print(f"→ Ml chose : {choice} ({decision['stats'][choice]['avg_temp']:.2f} °C)")
+                set_piece_choice(choice)
+                idle = start_print(choice)
+                print(f"→ Piece {choice} cooled for {idle:.2f}s since last print")
+
+                if previous is not None:
+                    self._learn(previous, decision)
+                previous = (decision["state"], choice)
+
+                # robot time lost between the previous layer and this one
+                if paused_at is not None:
+                    self.robot_idle.append(time.perf_counter() - paused_at)
+                    metrics.observe("robot_idle_seconds", self.robot_idle[-1])
+
+                # pre-score the choice after this one while the layer prints
+                active = list(self.piece_ids)
+                others = [pid for pid in active if pid != choice]
+                pending = None
+                if others:
+                    at = clock_now() + self.expected_layer_time(choice)
+                    # the decision's state is the one at the end of this layer, one more layer on `choice`
+                    counts = self.snapshot.layer_counts(active)
+                    counts[choice] += 1
+                    pending = self._worker.submit(self.prescore, at, active, others, counts)
+
+                new_points = fetch.run_fetch_loop(path=deposition_log_path(choice), watcher=self.watcher)
+                paused_at = time.perf_counter()
+                end_print(choice)
+                self.layer_times[choice] = fetch.sample_stats.get("duration", self.layer_time)
+                if self._processing is not None:
+                    self._processing.result()   # surface errors of the previous layer's processing
+
+                nz = self.snapshot.layer_count(choice)
+                if nz >= self.target(choice):
+                    self.piece_ids.remove(choice)
+                    print(f"Piece {choice} has reached {self.target(choice)} layers - removing from queue")
+
+                decision = self._confirm(pending.result()) if pending is not None else None
+                if decision is not None:
+                    self.prescored += 1
+                    metrics.count("control_prescore_total", outcome="hit")
+                    self._processing = self._worker.submit(self._process_layer, choice, new_points, nz)
+                else:
+                    # nothing predicted cold enough: decide on the processed layer, waiting if needed
+                    self._worker.submit(self._process_layer, choice, new_points, nz).result()
+                    self._processing = None
+                    decision = self.decide_now() if self.piece_ids else None
+                    if decision is not None:
+                        metrics.count("control_prescore_total", outcome="miss")
+            if previous is not None:
+                self._learn(previous, None)
+            if self._processing is not None:
+                self._processing.result()
+        finally:
+            self._worker.shutdown(wait=True)
+        print(f"Pipelined loop: {self.prescored} layer(s) started on a pre-scored choice")
+        return self.reward_history
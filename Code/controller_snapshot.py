@@ -0,0 +1,81 @@
+import threading
+import time
+
+from ABB_control import client
+from rws_client import parse_int
+
+# ---------------------------
+# Controller state read once per decision
+# ---------------------------
+# number_of_layer_piece_N and which_pieces only change when a layer ends, yet
+# each decision used to fetch every layer count three times (main loop,
+# save_heat_stats, QAgent.encode_state). The snapshot reads them all in one
+# parallel request and serves every consumer from memory until a
+# layer_finished change is seen (or the TTL runs out, as a safety net).
+
+
+class ControllerSnapshot:
+    """
+        snapshot = ControllerSnapshot([1, 2, 3, 4], watcher=watcher)
+        snapshot.layer_count(2)          # one bulk read, then cached
+        snapshot.layer_counts()          # {1: 3, 2: 2, ...} for save_heat_stats / encode_state
+
+    With a started abb_subscription.SymbolWatcher, the cache is dropped as
+    soon as layer_finished changes; without one, call invalidate() when a
+    layer ends. `ttl` bounds the age of a cached read either way.
+    """
+
+    def __init__(self, piece_ids, ttl=30.0, watcher=None, rws=None):
+        self.piece_ids = list(piece_ids)
+        self.ttl = ttl
+        self.watcher = watcher
+        self.rws = rws or client
+        self._lock = threading.Lock()
+        self._counts = None
+        self._piece = None
+        self._read_at = None
+        self._layer_version = None
+        self.refreshes = 0
+
+    def _stale(self):
+        if self._counts is None:
+            return True
+        if time.monotonic() - self._read_at > self.ttl:
+            return True
+        return self.watcher is not None and self.watcher.version("layer_finished") != self._layer_version
+
+    def refresh(self):
+        names = {pid: f"number_of_layer_piece_{pid}" for pid in self.piece_ids}
+        # version first: a layer ending during the read invalidates it again
+        version = self.watcher.version("layer_finished") if self.watcher is not None else None
+        values = self.rws.read_symbols(list(names.values()) + ["which_pieces"])
+        self._counts = {pid: 0 if values[name] is None else parse_int(values[name]) for pid, name in names.items()}
+        self._piece = 0 if values["which_pieces"] is None else parse_int(values["which_pieces"])
+        self._read_at = time.monotonic()
+        self._layer_version = version
+        self.refreshes += 1
+
+    def _ensure(self):
+        with self._lock:
+            if self._stale():
+                self.refresh()
+
+    def invalidate(self):
+        with self._lock:
+            self._counts = None
+
+    def layer_counts(self, piece_ids=None):
+        self._ensure()
+        ids = self.piece_ids if piece_ids is None else piece_ids
+        return {pid: self._counts.get(pid, 0) for pid in ids}
+
+    def layer_count(self, piece_id):
+        if piece_id not in self.piece_ids:
+            self.piece_ids.append(piece_id)
+            self.invalidate()
+        self._ensure()
+        return self._counts[piece_id]
+
+    def current_piece(self):
+        self._ensure()
+        return self._piece
@@ -1,69 +1,112 @@
-from requests.auth import HTTPDigestAuth
-from ABB_control import fetch_layer, fetch_welding, set_pause_printing, fetch_pieces_being_print
-import requests
+from ABB_control import fetch_layer, fetch_welding, set_pause_printing, fetch_pieces_being_print, client
 import time
 import json
 import os
-import time
-from collections import defaultdict
-
-# URL for the API
-# url = 'http://localhost/rw/motionsystem/mechunits/ROB_1/robtarget?coordinate=Wobj&json=1'
-url = 'http://localhost/rw/motionsystem/mechunits/ROB_1/robtarget?tool=bendedTool&coordinate=Base&json=1'
-url_weld = 'http://localhost/rw/rapid/symbol/data/RAPID/T_ROB1/MainModule/wielding?json=1'
-url_layer = 'http://localhost/rw/rapid/symbol/data/RAPID/T_ROB1/MainModule/layer_finished?json=1'
+from concurrent.futures import ThreadPoolExecutor
+from point_log import DepositionLog
+import metrics
+from metrics import timed
 
-# Create a session to persist cookies
-session = requests.Session()
-
-# Use Digest Authentication
-auth = HTTPDigestAuth("Default User", "robotics")
+# robtarget query (same pooled RWS client as ABB_control)
+# coordinate=Wobj was used before; Base with the bent tool is the welding tip
+robtarget_tool = 'bendedTool'
+robtarget_coordinate = 'Base'
 
 deposition_points = []
+current_piece = None
+sample_stats = {}
+sample_times = []
 
 
 # Function to fetch and print x, y, z values
+@timed("rws_request_seconds", call="fetch_xyz")
 def fetch_xyz():
     try:
-        # Make the request to fetch data
-        response = session.get(url, auth=auth)
-
-        # Check if the request was successful
-        if response.status_code == 200:
-            # Parse the JSON data
-            data = response.json()
-
-            # Extract and print data from the JSON object
-            if '_embedded' in data:
-                state = data['_embedded'].get('_state')
-                if state:  # Check if the list is not empty
-                    for target in state:  # Iterate through the list of targets
-                        x = float(target.get('x'))
-                        y = float(target.get('y'))
-                        z = float(target.get('z'))
-                        # print(z)
-                        return x, y, z
-        else:
-            print(f"Failed to fetch data. Status code: {response.status_code}")
-            print(f"Response body: {response.text}")  # Print the response body for debugging
+        return client.robtarget(tool=robtarget_tool, coordinate=robtarget_coordinate)
     except Exception as e:
         print(f"An error occurred: {e}")
 
 
 
+# ---------------------------
+# Concurrent sampling: the four reads of one iteration issued at once
+# ---------------------------
+class ConcurrentSampler:
+    """
+    Issue fetch_xyz, fetch_welding, fetch_pieces_being_print and fetch_layer
+    together on a small thread pool, so one sample costs about one round trip
+    instead of four and the position and weld flag are read at the same moment.
+    Each sample is stamped with one time.monotonic() clock (midpoint of the reads).
+    """
+
+    def __init__(self, workers=4):
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+
+    def sample(self):
+        t0 = time.monotonic()
+        futures = [self.pool.submit(f) for f in (fetch_xyz, fetch_welding, fetch_pieces_being_print, fetch_layer)]
+        xyz, weld, pid, layer_done = [f.result() for f in futures]
+        t1 = time.monotonic()
+        return (t0 + t1) / 2, xyz, weld, pid, layer_done
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+
+
+def fetch_sample_sequential():
+    # the original one-after-the-other reads, same return shape as ConcurrentSampler.sample
+    t0 = time.monotonic()
+    xyz = fetch_xyz()
+    weld = fetch_welding()
+    pid = fetch_pieces_being_print()
+    layer_done = fetch_layer()
+    return (t0 + time.monotonic()) / 2, xyz, weld, pid, layer_done
+
+
+def fetch_sample_watched(watcher, layer_version):
+    """
+    Only the position goes over HTTP; weld flag, piece id and layer flag come
+    from a SymbolWatcher's cache. The layer counts as finished only once
+    layer_finished changed after `layer_version` (the value seen when the layer
+    started), so a TRUE left over from the previous layer is not taken for a new one.
+    """
+    t0 = time.monotonic()
+    xyz = fetch_xyz()
+    layer_done = watcher.layer_finished() and watcher.version("layer_finished") > layer_version
+    return (t0 + time.monotonic()) / 2, xyz, watcher.welding(), watcher.piece(), layer_done
+
+
 # Run the loop to continuously fetch x, y, z
 
-def run_fetch_loop(path):
-    global current_piece
+def run_fetch_loop(path, concurrent=True, workers=4, watcher=None, flush_every=256):
+    """
+    Record one layer's deposition points until the controller flags
+    layer_finished. concurrent=True samples with ConcurrentSampler; with a
+    started abb_subscription.SymbolWatcher only the position is polled.
+    The achieved rate is printed and kept in `sample_stats`; the sample
+    timestamps of the recorded points are in `sample_times`.
+
+    Points are appended to the point log at `path` (point_log.DepositionLog,
+    one layer segment per call) in chunks of `flush_every` while printing.
+    A `.json` path keeps the old whole-file rewrite at the end of the layer.
+    """
+    global current_piece, sample_stats, sample_times
 
     deposition_points = []
+    sample_times = []
+    n_samples = 0
+    sampler = ConcurrentSampler(workers) if concurrent and watcher is None else None
+    log = None if path.endswith(".json") else DepositionLog(path, chunk=flush_every)
+    if log is not None:
+        log.begin_layer()
 
     # ——— 1) Un-pause the printer ———
     set_pause_printing(False)
     print()             
 
     # ——— 2) Immediately read the piece ID ———
-    current_piece = fetch_pieces_being_print()
+    layer_version = watcher.version("layer_finished") if watcher is not None else 0
+    current_piece = watcher.piece() if watcher is not None else fetch_pieces_being_print()
     print(f"→ Now printing piece {current_piece}")
     print()  # blank line
 
@@ -72,23 +115,30 @@ def run_fetch_loop(path):
 
     try:
         while True:
-            # a) Fetch XYZ & weld
-            x, y, z = fetch_xyz()
-            weld    = fetch_welding()
+            # a) Fetch XYZ, weld, piece id and layer flag
+            if watcher is not None:
+                t, xyz, weld, pid, layer_done = fetch_sample_watched(watcher, layer_version)
+            elif sampler is not None:
+                t, xyz, weld, pid, layer_done = sampler.sample()
+            else:
+                t, xyz, weld, pid, layer_done = fetch_sample_sequential()
+            n_samples += 1
 
             # b) Check if the printer switched to another piece mid-layer
-            pid = fetch_pieces_being_print()
             if pid != current_piece:
                 current_piece = pid
                 print(f"→ Switched to printing piece {current_piece}")
                 print()     # blank line
 
             # c) Collect points
-            if x is not None and y is not None and weld:
-                deposition_points.append((x, y, z))
+            if xyz is not None and weld:
+                deposition_points.append(xyz)
+                sample_times.append(t)
+                if log is not None:
+                    log.append(xyz, t)
 
             # d) Detect layer completion
-            if fetch_layer():
+            if layer_done:
                 print("Layer finished! Pausing printing...")
                 set_pause_printing(True)
                 print()   # blank line
@@ -97,28 +147,51 @@ def run_fetch_loop(path):
             time.sleep(0.001)
 
 
-        if os.path.exists(path):
-                with open(path, "r") as f:
-                    try:
-                        all_points = json.load(f)
-                    except json.JSONDecodeError:
-                        all_points = []  # file is empty or broken
+        if log is not None:
+            log.flush()
+            print(f"Saved {len(deposition_points)} new points. Total points now: {log.count}")
         else:
-                all_points = []
+            if os.path.exists(path):
+                    with open(path, "r") as f:
+                        try:
+                            all_points = json.load(f)
+                        except json.JSONDecodeError:
+                            all_points = []  # file is empty or broken
+            else:
+                    all_points = []
 
-        # Append new points
-        all_points.extend(deposition_points)
+            # Append new points
+            all_points.extend(deposition_points)
 
-        # Save updated points
-        with open(path, "w") as f:
-            json.dump(all_points, f)
+            # Save updated points
+            with open(path, "w") as f:
+                json.dump(all_points, f)
 
-        print(f"Saved {len(deposition_points)} new points. Total points now: {len(all_points)}")
+            print(f"Saved {len(deposition_points)} new points. Total points now: {len(all_points)}")
 
     except KeyboardInterrupt:
         print("Loop stopped by user.")
     finally:
         duration = time.perf_counter() - start
-
+        if sampler is not None:
+            sampler.close()
+        if log is not None:
+            log.close()     # whatever was recorded before an interrupt is kept
+
+    sample_stats = {
+        "samples": n_samples,
+        "points": len(deposition_points),
+        "duration": duration,
+        "sample_rate": n_samples / duration if duration > 0 else 0.0,
+        "point_rate": len(deposition_points) / duration if duration > 0 else 0.0,
+    }
+    metrics.count("fetch_samples_total", n_samples)
+    metrics.count("fetch_points_total", len(deposition_points))
+    metrics.observe("layer_print_seconds", duration)
     print(f"Printed piece {current_piece} in {duration:.2f}s")
-    print()
\ No newline at end of file
+    print(f"Sampled {n_samples} times ({sample_stats['sample_rate']:.1f} samples/s, "
+          f"{sample_stats['point_rate']:.1f} points/s)")
+    print()
+
+    # only this layer's points, for incremental consumers (IncrementalVoxelGrid)
+    return deposition_points
\ No newline at end of file
@@ -1,5 +1,9 @@
 import numpy as np
 from scipy.spatial import KDTree
+import hashlib
+import json
+import os
+import threading
 
 def analyze_geometry(active_pixels, bbox_dims):
     if len(active_pixels) < 2:
@@ -36,3 +40,91 @@ def analyze_geometry(active_pixels, bbox_dims):
         "wall_count_estimate": 1,
         "max_internal_gap": max_gap,
     }
+
+# ---------------------------
+# Per-layer geometry cache
+# ---------------------------
+# (piece, layer, pixel digest) → analyze_geometry result.
+# A printed layer's pixels never change, so each layer is analysed once
+# for the lifetime of the process (or of the print, when persisted).
+# save_heat_stats' worker threads fill it concurrently: every access holds the lock.
+_geometry_cache = {}
+_geometry_lock = threading.Lock()
+
+
+def pixels_digest(active_pixels, bbox_dims):
+    """
+    Content hash of a layer's active pixels and bbox size.
+    """
+    coords = np.ascontiguousarray(np.asarray(active_pixels, dtype=np.int64).reshape(-1, 2))
+    h = hashlib.sha1(coords.tobytes())
+    h.update(np.asarray(bbox_dims, dtype=np.int64).tobytes())
+    return h.hexdigest()
+
+
+def cached_analyze_geometry(active_pixels, bbox_dims, piece=None, layer=None):
+    """
+    analyze_geometry, computed once per (piece, layer, content of active_pixels).
+    """
+    key = (str(piece), -1 if layer is None else int(layer), pixels_digest(active_pixels, bbox_dims))
+    with _geometry_lock:
+        stats = _geometry_cache.get(key)
+    if stats is None:
+        # analysed outside the lock; two threads on the same layer store equal stats
+        stats = analyze_geometry(active_pixels, bbox_dims)
+        with _geometry_lock:
+            stats = _geometry_cache.setdefault(key, stats)
+    return stats
+
+
+def geometry_cache_path(bbox_path):
+    """
+    piece_1_bounding_boxes.json.gz (or .npz) → piece_1_bounding_boxes.geometry.json
+    """
+    base = bbox_path
+    for ext in (".json.gz", ".npz"):
+        if base.endswith(ext):
+            base = base[:-len(ext)]
+    return base + ".geometry.json"
+
+
+def save_geometry_cache(path, piece_prefix=None):
+    """
+    Write the cached entries (only those whose piece starts with
+    piece_prefix, if given) to a JSON file. The file is written next to
+    `path` and swapped in, so a crash never leaves a truncated cache.
+    """
+    with _geometry_lock:
+        snapshot = dict(_geometry_cache)
+    entries = [
+        {"piece": piece, "layer": layer, "digest": digest,
+         "stats": {k: (int(v) if isinstance(v, (int, np.integer)) else float(v)) for k, v in stats.items()}}
+        for (piece, layer, digest), stats in snapshot.items()
+        if piece_prefix is None or piece.startswith(str(piece_prefix))
+    ]
+    # per-thread temp name: pieces saved from worker threads never share it
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(entries, f)
+    os.replace(tmp_path, path)
+    return len(entries)
+
+
+def load_geometry_cache(path):
+    """
+    Merge a file written by save_geometry_cache into the cache.
+    Returns the number of entries read (0 if the file does not exist).
+    """
+    if not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        entries = json.load(f)
+    with _geometry_lock:
+        for e in entries:
+            _geometry_cache[(e["piece"], e["layer"], e["digest"])] = e["stats"]
+    return len(entries)
+
+
+def clear_geometry_cache():
+    with _geometry_lock:
+        _geometry_cache.clear()
@@ -3,11 +3,20 @@ import json
 import gzip
 import matplotlib.pyplot as plt
 from scipy.spatial import KDTree
-from geometry_analysis import analyze_geometry
+from geometry_analysis import analyze_geometry, cached_analyze_geometry
+from bbox_store import BBoxArchive, detect_bbox_format, piece_bbox_path
 from ABB_control import fetch_number_of_layer
 import csv
+from metrics import timed
 
 def load_voxel_data(gz_file):
+    """
+    Load a bbox file, gzipped JSON or .npz (detected from its content).
+    The .npz comes back as a lazy, memory-mapped BBoxArchive with the same
+    label → layer → {"bounding_box", "active_pixels"} layout.
+    """
+    if detect_bbox_format(gz_file) == "npz":
+        return BBoxArchive(gz_file)
     with gzip.open(gz_file, "rt") as f:
         return json.load(f)
 
@@ -38,9 +47,11 @@ def voxel_parameters(neighbor_temp, geom, nz, time_cooling):
 
     return alpha, beta, gamma
 
-def simulate_heat(voxel_data_path, nz, nx, ny,time_cooling,  T_init=20.0, T_amb=20.0, Q_val=660.0, dt=1.0, steps_per_layer=1):
-
-    voxel_data = load_voxel_data(voxel_data_path)
+def _simulate_heat_loop(voxel_data, nz, nx, ny, time_cooling, T_init, T_amb, Q_val, dt, steps_per_layer):
+    """
+    Reference engine: walks every active pixel in Python.
+    Kept to validate the vectorized engine against.
+    """
     T = np.full((nz, ny, nx), T_init, dtype=np.float64)
 
     for z in range(nz):
@@ -73,17 +84,325 @@ def simulate_heat(voxel_data_path, nz, nx, ny,time_cooling,  T_init=20.0, T_amb=
 
     return T
 
-def load_piece_bbox(piece_id, path_template="piece_{id}_bounding_boxes.json.gz"):
+
+def layer_components(voxel_data, z, nx, ny, piece=None):
+    """
+    Active voxels of layer z, one (ys, xs, geometry_stats) entry per component
+    with pixels in the layer; voxels off the plate are dropped.
+    Geometry stats come from the per-layer cache of geometry_analysis,
+    keyed by piece/component, layer and pixel content.
+    """
+    components = []
+    for piece_id, layers in voxel_data.items():
+        if str(z) not in layers:
+            continue
+        layer_data = layers[str(z)]
+        bbox_min = layer_data["bounding_box"][0]
+        bbox_max = layer_data["bounding_box"][1]
+        bbox_dims = [bbox_max[0] - bbox_min[0] + 1, bbox_max[1] - bbox_min[1] + 1]
+        active_pixels = layer_data["active_pixels"]
+        if len(active_pixels) == 0:
+            continue
+
+        rel = np.asarray(active_pixels, dtype=np.int64)
+        cache_piece = piece_id if piece is None else f"{piece}/{piece_id}"
+        geometry_stats = cached_analyze_geometry(rel, bbox_dims, piece=cache_piece, layer=z)
+
+        x = bbox_min[0] + rel[:, 0]
+        y = bbox_min[1] + rel[:, 1]
+        inside = (x >= 0) & (x < nx) & (y >= 0) & (y < ny)
+        components.append((y[inside], x[inside], geometry_stats))
+    return components
+
+
+def layer_active_voxels(voxel_data, z, nx, ny, nz, time_cooling, piece=None):
+    """
+    Gather every active voxel of layer z (all components) as flat arrays.
+    Returns ys, xs and the per-voxel alpha, beta, gamma coefficients
+    (one value per component, repeated over its pixels).
+    """
+    ys, xs, alphas, betas, gammas = [], [], [], [], []
+    for y, x, geometry_stats in layer_components(voxel_data, z, nx, ny, piece):
+        alpha, beta, gamma = voxel_parameters(None, geometry_stats, nz, time_cooling)
+        n = y.size
+        ys.append(y)
+        xs.append(x)
+        alphas.append(np.full(n, alpha))
+        betas.append(np.full(n, beta))
+        gammas.append(np.full(n, gamma))
+
+    if not ys:
+        empty_i = np.empty(0, dtype=np.int64)
+        empty_f = np.empty(0, dtype=np.float64)
+        return empty_i, empty_i, empty_f, empty_f, empty_f
+    return (np.concatenate(ys), np.concatenate(xs),
+            np.concatenate(alphas), np.concatenate(betas), np.concatenate(gammas))
+
+
+def neighbor_mean_2d(plane):
+    """
+    Mean of the 8 in-plane neighbours of every pixel, using shifted-slice sums.
+    Out-of-grid neighbours are left out of the mean (same as get_voxel_neighbors).
+    """
+    ny, nx = plane.shape
+    total = np.zeros_like(plane)
+    count = np.zeros_like(plane)
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            if dy == 0 and dx == 0:
+                continue
+            # destination window and the matching shifted source window
+            dst_y = slice(max(0, -dy), ny - max(0, dy))
+            dst_x = slice(max(0, -dx), nx - max(0, dx))
+            src_y = slice(max(0, dy), ny - max(0, -dy))
+            src_x = slice(max(0, dx), nx - max(0, -dx))
+            total[dst_y, dst_x] += plane[src_y, src_x]
+            count[dst_y, dst_x] += 1
+    return total / count
+
+
+def piece_domain(voxel_data, nx, ny, halo=1):
+    """
+    Union XY bounding box of every component and layer, grown by `halo`
+    pixels and clipped to the plate. Returns half-open (y0, y1, x0, x1).
+    A one-pixel halo keeps the neighbour mean of every active voxel identical
+    to the full-plate one (inactive neighbours stay at T_init either way).
+    """
+    x_lo, y_lo, x_hi, y_hi = nx, ny, -1, -1
+    for layers in voxel_data.values():
+        for layer_data in layers.values():
+            (bx0, by0), (bx1, by1) = layer_data["bounding_box"]
+            x_lo, y_lo = min(x_lo, bx0), min(y_lo, by0)
+            x_hi, y_hi = max(x_hi, bx1), max(y_hi, by1)
+    if x_hi < x_lo or y_hi < y_lo:
+        return 0, 0, 0, 0
+    return (max(0, y_lo - halo), min(ny, y_hi + halo + 1),
+            max(0, x_lo - halo), min(nx, x_hi + halo + 1))
+
+
+def simulate_heat_cropped(voxel_data, nz, nx, ny, time_cooling, T_init=20.0, T_amb=20.0, Q_val=660.0, dt=1.0,
+                          steps_per_layer=1, halo=1, piece=None):
+    """
+    Whole-layer engine on the piece's own domain instead of the full plate:
+    one neighbour-mean pass and one ODE evaluation per layer step, over all
+    active voxels at once.
+    Returns (T, origin): the (nz, y1-y0, x1-x0) field and its (y0, x0) offset
+    on the plate. Use embed_in_plate to get the full-plate field.
+    """
+    y0, y1, x0, x1 = piece_domain(voxel_data, nx, ny, halo)
+    T = np.full((nz, y1 - y0, x1 - x0), T_init, dtype=np.float64)
+
+    for z in range(nz):
+        ys, xs, alpha, beta, gamma = layer_active_voxels(voxel_data, z, nx, ny, nz, time_cooling, piece)
+        if ys.size == 0:
+            continue
+        ys, xs = ys - y0, xs - x0
+        for _ in range(steps_per_layer):
+            T[z] = layer_step(T[z], ys, xs, alpha, beta, gamma, T_amb, Q_val, dt)
+
+    return T, (y0, x0)
+
+
+def embed_in_plate(T, origin, nx, ny, fill=20.0):
+    """
+    Place a cropped (nz, h, w) field at `origin` on a full (nz, ny, nx) plate.
+    """
+    y0, x0 = origin
+    plate = np.full((T.shape[0], ny, nx), fill, dtype=T.dtype)
+    plate[:, y0:y0 + T.shape[1], x0:x0 + T.shape[2]] = T
+    return plate
+
+
+def _simulate_heat_vectorized(voxel_data, nz, nx, ny, time_cooling, T_init, T_amb, Q_val, dt, steps_per_layer):
+    T, origin = simulate_heat_cropped(voxel_data, nz, nx, ny, time_cooling,
+                                      T_init, T_amb, Q_val, dt, steps_per_layer)
+    return embed_in_plate(T, origin, nx, ny, T_init)
+
+
+def layer_step(plane, ys, xs, alpha, beta, gamma, T_amb, Q_val, dt):
+    """
+    One explicit step of heat_equation_ode on the active voxels of one layer.
+    Returns a new (ny, nx) plane; the input plane is left untouched.
+    """
+    neighbor_T = neighbor_mean_2d(plane)[ys, xs]
+    averaged_T = 0.6 * plane[ys, xs] + 0.4 * neighbor_T
+    dT = dt * heat_equation_ode(averaged_T, Q_val, T_amb, alpha, beta, gamma)
+    new_plane = plane.copy()
+    np.add.at(new_plane, (ys, xs), dT)
+    return new_plane
+
+
+# ---------------------------
+# Sparse active-voxel engine
+# ---------------------------
+_NEIGHBOR_OFFSETS = [(dy, dx) for dy in (-1, 0, 1) for dx in (-1, 0, 1) if not (dy == 0 and dx == 0)]
+
+
+class SparseVoxelGrid:
+    """
+    Active voxels of a bbox file as flat arrays, grouped by layer:
+    voxels layer_ptr[z]:layer_ptr[z+1] belong to layer z.
+    The in-plane neighbour table is a CSR adjacency (indptr, indices) between
+    active voxels; n_inbounds counts all in-grid neighbours of each voxel, so
+    inactive neighbours (always at T_init) can be added back without a dense grid.
+    Memory scales with the deposited material, not with nx * ny.
+    """
+
+    def __init__(self, zs, ys, xs, alpha, beta, gamma, layer_ptr, indptr, indices, n_inbounds, nx, ny):
+        self.zs, self.ys, self.xs = zs, ys, xs
+        self.alpha, self.beta, self.gamma = alpha, beta, gamma
+        self.layer_ptr = layer_ptr
+        self.indptr, self.indices = indptr, indices
+        self.n_inbounds = n_inbounds
+        self.nx, self.ny = nx, ny
+
+    @property
+    def nz(self):
+        return len(self.layer_ptr) - 1
+
+    @property
+    def size(self):
+        return len(self.zs)
+
+    @classmethod
+    def from_voxel_data(cls, voxel_data, nz, nx, ny, time_cooling):
+        zs, ys, xs, alphas, betas, gammas = [], [], [], [], [], []
+        layer_ptr = [0]
+        for z in range(nz):
+            y, x, a, b, g = layer_active_voxels(voxel_data, z, nx, ny, nz, time_cooling)
+            zs.append(np.full(y.size, z, dtype=np.int64))
+            ys.append(y)
+            xs.append(x)
+            alphas.append(a)
+            betas.append(b)
+            gammas.append(g)
+            layer_ptr.append(layer_ptr[-1] + y.size)
+
+        if not zs:
+            # nz == 0 (e.g. a failed layer count read): an empty grid, as in the dense engines
+            zs = ys = xs = [np.empty(0, dtype=np.int64)]
+            alphas = betas = gammas = [np.empty(0, dtype=np.float64)]
+        zs, ys, xs = np.concatenate(zs), np.concatenate(ys), np.concatenate(xs)
+        indptr, indices, n_inbounds = _build_plane_adjacency(zs, ys, xs, nx, ny)
+        return cls(zs, ys, xs, np.concatenate(alphas), np.concatenate(betas), np.concatenate(gammas),
+                   np.asarray(layer_ptr, dtype=np.int64), indptr, indices, n_inbounds, nx, ny)
+
+    def neighbor_sum(self, values, start, end):
+        """
+        Sum of `values` over the active neighbours of voxels start:end.
+        """
+        ptr = self.indptr[start:end + 1]
+        rows = np.repeat(np.arange(end - start), np.diff(ptr))
+        return np.bincount(rows, weights=values[self.indices[ptr[0]:ptr[-1]]], minlength=end - start)
+
+    def to_dense(self, values, T_init=20.0):
+        T = np.full((self.nz, self.ny, self.nx), T_init, dtype=np.float64)
+        T[self.zs, self.ys, self.xs] = values
+        return T
+
+
+def _build_plane_adjacency(zs, ys, xs, nx, ny):
+    """
+    CSR table of the 8 in-plane neighbours between active voxels.
+    Voxels are looked up by their flat (z, y, x) key with searchsorted.
+    """
+    n = len(zs)
+    keys = (zs * ny + ys) * nx + xs
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+
+    rows, cols = [], []
+    n_inbounds = np.zeros(n, dtype=np.int64)
+    for dy, dx in _NEIGHBOR_OFFSETS:
+        y, x = ys + dy, xs + dx
+        inside = (x >= 0) & (x < nx) & (y >= 0) & (y < ny)
+        n_inbounds += inside
+        nb_keys = (zs * ny + y) * nx + x
+        pos = np.clip(np.searchsorted(sorted_keys, nb_keys), 0, max(n - 1, 0))
+        found = inside & (sorted_keys[pos] == nb_keys) if n else inside
+        rows.append(np.nonzero(found)[0])
+        cols.append(order[pos[found]])
+
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    by_row = np.argsort(rows, kind="stable")
+    indices = cols[by_row]
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+    return indptr, indices, n_inbounds
+
+
+def simulate_heat_sparse(voxel_data, nz, nx, ny, time_cooling, T_init=20.0, T_amb=20.0, Q_val=660.0, dt=1.0,
+                         steps_per_layer=1):
+    """
+    Same model as the dense engines, on active voxels only.
+    Returns (grid, values): the SparseVoxelGrid and the temperature of each of its voxels.
+    """
+    grid = SparseVoxelGrid.from_voxel_data(voxel_data, nz, nx, ny, time_cooling)
+    T = np.full(grid.size, T_init, dtype=np.float64)
+    has_neighbors = grid.n_inbounds > 0
+
+    for z in range(nz):
+        s, e = grid.layer_ptr[z], grid.layer_ptr[z + 1]
+        if s == e:
+            continue
+        n_in = grid.n_inbounds[s:e]
+        n_inactive = n_in - np.diff(grid.indptr[s:e + 1])
+        for _ in range(steps_per_layer):
+            Tz = T[s:e]
+            # inactive in-grid neighbours never leave T_init
+            total = grid.neighbor_sum(T, s, e) + n_inactive * T_init
+            neighbor_T = np.where(has_neighbors[s:e], total / np.maximum(n_in, 1), Tz)
+            averaged_T = 0.6 * Tz + 0.4 * neighbor_T
+            T[s:e] = Tz + dt * heat_equation_ode(averaged_T, Q_val, T_amb,
+                                                 grid.alpha[s:e], grid.beta[s:e], grid.gamma[s:e])
+
+    return grid, T
+
+
+def _simulate_heat_sparse(voxel_data, nz, nx, ny, time_cooling, T_init, T_amb, Q_val, dt, steps_per_layer):
+    grid, values = simulate_heat_sparse(voxel_data, nz, nx, ny, time_cooling,
+                                        T_init, T_amb, Q_val, dt, steps_per_layer)
+    return grid.to_dense(values, T_init)
+
+
+HEAT_BACKENDS = {
+    "loop": _simulate_heat_loop,
+    "vectorized": _simulate_heat_vectorized,
+    "sparse": _simulate_heat_sparse,
+}
+DEFAULT_HEAT_BACKEND = "vectorized"
+
+
+@timed("stage_seconds", stage="simulate_heat")
+def simulate_heat(voxel_data_path, nz, nx, ny,time_cooling,  T_init=20.0, T_amb=20.0, Q_val=660.0, dt=1.0, steps_per_layer=1,
+                  backend=None):
+    """
+    Simulate the layer-by-layer heating of every component in the bbox file.
+    backend: "vectorized" (default), "sparse" (active voxels only)
+    or "loop" (per-voxel reference).
+    """
+    backend = backend or DEFAULT_HEAT_BACKEND
+    if backend not in HEAT_BACKENDS:
+        raise ValueError(f"Unknown heat backend {backend!r}, expected one of {sorted(HEAT_BACKENDS)}")
+
+    voxel_data = load_voxel_data(voxel_data_path)
+    return HEAT_BACKENDS[backend](voxel_data, nz, nx, ny, time_cooling,
+                                  T_init, T_amb, Q_val, dt, steps_per_layer)
+
+def load_piece_bbox(piece_id, path_template=None):
     """
     Load and return the JSON for one piece’s connected components.
-    The JSON maps component‐labels → per‐layer bounding_box/active_pixels.+    """
-    fname = path_template.format(id=piece_id)
-    with gzip.open(fname, "rt") as f:
-        return json.load(f)
+    The JSON maps component‐labels → per‐layer bounding_box/active_pixels.
+    Without a path_template, the piece's latest bbox file is used, in
+    either format.
+    """
+    fname = piece_bbox_path(piece_id) if path_template is None else path_template.format(id=piece_id)
+    return load_voxel_data(fname)
     
-def compute_piece_avg_temp(output, piece_bbox, mask_heatmap=False):
+def compute_piece_avg_temp(output, piece_bbox, mask_heatmap=False, origin=(0, 0)):
     """
-    output: 3D array shape (nz, ny, nx)
+    output: 3D array shape (nz, ny, nx), either the full plate or a cropped
+            field whose [0, 0] sits at `origin` = (y0, x0) on the plate
     piece_bbox: dict mapping component_label(str) → layer dict,
                 where layer dict maps str(z) → {
                   "bounding_box": [ [xmin,ymin], [xmax,ymax] ],
@@ -91,26 +410,34 @@ def compute_piece_avg_temp(output, piece_bbox, mask_heatmap=False):
                 }
     """
     nz, ny, nx = output.shape
-    mask = np.zeros_like(output, dtype=bool)
+    y0, x0 = origin
 
     # Walk each connected component, then each layer within it
+    zs, ys, xs = [], [], []
     for comp_label, layers in piece_bbox.items():
         for z_str, layer_data in layers.items():
-            z = int(z_str)
             bbox_min, _ = layer_data["bounding_box"]
-            for rel_x, rel_y in layer_data["active_pixels"]:
-                x = bbox_min[0] + rel_x
-                y = bbox_min[1] + rel_y
-                if 0 <= x < nx and 0 <= y < ny and 0 <= z < nz:
-                    mask[z, y, x] = True
+            rel = np.asarray(layer_data["active_pixels"], dtype=np.int64).reshape(-1, 2)
+            zs.append(np.full(len(rel), int(z_str), dtype=np.int64))
+            xs.append(bbox_min[0] + rel[:, 0] - x0)
+            ys.append(bbox_min[1] + rel[:, 1] - y0)
+
+    if zs:
+        z, y, x = np.concatenate(zs), np.concatenate(ys), np.concatenate(xs)
+        inside = (x >= 0) & (x < nx) & (y >= 0) & (y < ny) & (z >= 0) & (z < nz)
+        mask = np.zeros(output.size, dtype=bool)
+        mask[np.ravel_multi_index((z[inside], y[inside], x[inside]), output.shape)] = True
+        flat = np.flatnonzero(mask)
+    else:
+        flat = np.empty(0, dtype=np.int64)
 
     # Gather only the temperatures for your piece’s voxels
-    temps = output[mask]
+    temps = output.ravel()[flat]
     avg_temp = float(np.mean(temps)) if temps.size else 0.0
 
     if mask_heatmap:
         heatmap = np.zeros_like(output)
-        heatmap[mask] = output[mask]
+        heatmap.ravel()[flat] = temps
         return avg_temp, heatmap
 
     return avg_temp, None
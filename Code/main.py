@@ -1,12 +1,17 @@
 from maping import RealTime3DMap
-from Voxel_grid import process_voxel, show_slices, store_voxel_bounding_boxes, save_bounding_boxes_from_grid
+from Voxel_grid import process_voxel, show_slices, store_voxel_bounding_boxes, save_bounding_boxes_from_grid, IncrementalVoxelGrid
 from heat import simulate_heat, visualize_slice, load_piece_bbox, compute_piece_avg_temp
 import fetch 
-from ABB_control import fetch_number_of_layer, set_piece_choice, set_pause_printing
+from ABB_control import set_piece_choice, set_pause_printing
 from filter_outliers import filter_points_by_layer
 from calculate_cooling_time import start_print, end_print, get_cooling_time
-from save_heat_stats import save_heat_stats, display_stats
+from save_heat_stats import save_heat_stats, display_stats, refresh_cooling_stats, time_until_cold, NoPieceCools
 from q_agent import QAgent
+from point_log import deposition_log_path
+import metrics
+from abb_subscription import SymbolWatcher
+from controller_snapshot import ControllerSnapshot
+from control_loop import PipelinedController
 
 import json, os
 import time
@@ -15,6 +20,8 @@ import numpy as np
 from glob import glob
 import matplotlib.pyplot as plt
 
+# array Q-table (q_array.ArrayQTable); an older q_table.pkl is imported once
+Q_TABLE_DIR = "q_table_array"
 
 
 def recreating_the_map(deposition_points):
@@ -30,56 +37,66 @@ def recreating_the_map(deposition_points):
     
     map_3d.show()
 
-def main():
+def main(pipelined=True, stabilisation_pause=0.0):
+    """
+    pipelined=True runs the AI phase with control_loop.PipelinedController
+    (next choice scored while the current layer prints); False keeps the
+    sequential loop below, which pauses `stabilisation_pause` seconds after
+    each layer.
+    """
     piece_ids  = [1, 2, 3, 4]
-    agent = QAgent()
+    agent = QAgent(table="array", actions=piece_ids)
     reward_history = []
+    voxel_grids = {}   # piece_id → IncrementalVoxelGrid, fed one layer of points at a time
+
+    # METRICS_JSONL / METRICS_PROM set → timers and counters exported periodically
+    metrics.enable_from_env()
+    paused_since = None   # perf_counter when the robot last stopped for a layer
+
+    # layer_finished / wielding / which_pieces pushed by the controller (polled if it cannot)
+    watcher = SymbolWatcher()
+    print(f"Controller flags acquired by {watcher.start()}")
+    # layer counts / which_pieces read once per layer, shared by every consumer
+    snapshot = ControllerSnapshot(piece_ids, watcher=watcher)
 
     start_time = time.time()
     # Charger la table Q si elle existe
-    if os.path.exists("q_table.pkl"):
+    if os.path.isdir(Q_TABLE_DIR):
         print("🧠 Loading existing Q-table...")
+        agent.load(Q_TABLE_DIR)
+    elif os.path.exists("q_table.pkl"):
+        print("🧠 Importing the pickled Q-table...")
         agent.load("q_table.pkl")
     else:
         print("🧠 Starting with new Q-table.")
 
     for i in piece_ids:
-            path_to_clean = f"deposition_points_piece_{i}.json"
-            with open(path_to_clean, "w") as f:
-                json.dump([], f)
+            path_to_clean = deposition_log_path(i)
+            open(path_to_clean, "wb").close()
     try:
         for i in piece_ids:
             print("-----------NEW LOOP-----------")
             print()
 
             piece_id = fetch.fetch_pieces_being_print()
-            path = f"deposition_points_piece_{piece_id}.json"
+            path = deposition_log_path(piece_id)
 
             idle = start_print(piece_id)
             print(f"→ Piece {piece_id} cooled for {idle:.2f}s since last print")
 
             #fetch all the points in one layer printed
-            fetch.run_fetch_loop(path=path)
+            new_points = fetch.run_fetch_loop(path=path, watcher=watcher)
 
             end_print(piece_id)
 
-            deposition_points = json.load(open(path))
-
             layer_height =  1.0     #printer’s layer height in mm
             min_pts     = 50
-            deposition_points = filter_points_by_layer(deposition_points, layer_height=layer_height, min_points=min_pts )
 
             #show the points collected
             #recreating_the_map(deposition_points)
 
             print()
-            url_number_of_layers = (
-                f"http://localhost/rw/rapid/symbol/data/"
-                f"RAPID/T_ROB1/MainModule/"
-                f"number_of_layer_piece_{piece_id}?json=1"
-            )
-
-            nz = fetch_number_of_layer(url_number_of_layers)
+            nz = snapshot.layer_count(piece_id)
             print(f"number of layers:{nz}")
             ny, nx = (400,400) 
 
@@ -89,10 +106,12 @@ def main():
             print()
 
             #compute the voxel representation
-            voxel_grid= process_voxel(deposition_points, nz, nx, ny,layer_height,  fill_radius=3)
+            # only this layer's points are rasterized (same grid as process_voxel on the filtered history)
+            grid = voxel_grids.setdefault(piece_id, IncrementalVoxelGrid(nx, ny, layer_height, fill_radius=3))
+            voxel_grid = grid.add_points(new_points, nz, min_points=min_pts)
             show_slices(voxel_grid)
 
-            _, bbox_path = save_bounding_boxes_from_grid(voxel_grid, current_piece)
+            _, bbox_path = save_bounding_boxes_from_grid(voxel_grid, current_piece, fmt="npz")
 
             #compute the heat propagation inside all pieces 
             print("Starting the simulation of the heat")
@@ -117,21 +136,24 @@ def main():
         prev_action = None
 
 
-        stats = save_heat_stats(piece_ids, nx, ny)
+        stats = save_heat_stats(piece_ids, nx, ny, incremental=True, workers=len(piece_ids),
+                                layer_counts=snapshot.layer_counts(piece_ids))
         display_stats(stats)
+        if pipelined:
+            controller = PipelinedController(
+                agent, piece_ids, snapshot, watcher=watcher,
+                layer_targets={1: 5}, layers_per_piece=number_of_layers_to_print,
+                stats=stats, voxel_grids=voxel_grids, reward_history=reward_history, nx=nx, ny=ny)
+            # returns once piece_ids is empty: the loop below only runs its exit branch
+            controller.run()
         while True:
             
             print("-----------NEW LOOP-----------")
             print()
             to_remove = []
             for piece_id in piece_ids.copy():  # Use copy to avoid modification during iteration
-                url = (
-                    f"http://localhost/rw/rapid/symbol/data/"
-                    f"RAPID/T_ROB1/MainModule/"
-                    f"number_of_layer_piece_{piece_id}?json=1"
-                )
                 try:
-                    nz = fetch_number_of_layer(url)
+                    nz = snapshot.layer_count(piece_id)
                     print(f"Piece {piece_id} has {nz} layers")
 
                     threshold = 5 if piece_id == 1 else number_of_layers_to_print
@@ -153,11 +175,12 @@ def main():
                 print("All pieces have reached their final layers. Printing complete!")
                 set_piece_choice(0)
                 set_pause_printing(False)
-                stats = save_heat_stats(piece_ids, nx, ny)
+                stats = save_heat_stats(piece_ids, nx, ny, incremental=True, workers=len(piece_ids),
+                                        layer_counts=snapshot.layer_counts(piece_ids))
                 display_stats(stats)
                 print("💾 Saving Q-table...")
                 print()
-                agent.save("q_table.pkl")
+                agent.save(Q_TABLE_DIR)
                 plt.figure(figsize=(10, 4))
                 plt.plot(reward_history, label="Total reward per episode")
                 plt.xlabel("episode")
@@ -174,34 +197,40 @@ def main():
                         f.write(f"{i},{r}\n")
                 total_time = time.time() - start_time
                 print(f" AI total time: {total_time}")
+                watcher.stop()
                 break
 
             #update thermal stats
-            stats = save_heat_stats(piece_ids, nx, ny)
+            stats = save_heat_stats(piece_ids, nx, ny, incremental=True, workers=len(piece_ids),
+                                    layer_counts=snapshot.layer_counts(piece_ids))
             for pid, info in stats.items():
                     avg_temp = info["avg_temp"]
                     print(f"Piece {pid}: average temp = {avg_temp:.2f} °C")
 
 
-            state = agent.encode_state(stats, piece_ids)
+            state = agent.encode_state(stats, piece_ids, layer_counts=snapshot.layer_counts(piece_ids))
 
             valid_actions = [pid for pid in piece_ids if stats[pid]["avg_temp"] < agent.temp_threshold]
 
-            # trying every 10 seconds if no pieces available
+            # no piece available: sleep until the thermal model predicts the first one cold enough
             waiting_time = 0
+            wait_start = time.perf_counter()
             while not valid_actions:
+                wake, first = time_until_cold(stats, piece_ids, agent.temp_threshold)
                 print()
-                print("No pieces is cold enough. waiting of 10s...")
+                print(f"No pieces is cold enough. waiting {wake:.1f}s for piece {first}...")
 
-                time.sleep(10)
-                waiting_time += 10  
-                stats = save_heat_stats(piece_ids, nx, ny)
+                time.sleep(wake)
+                waiting_time += wake
+                stats = refresh_cooling_stats(stats, piece_ids)
                 for pid, info in stats.items():
                     avg_temp = info["avg_temp"]
                     print(f"Piece {pid}: average temp = {avg_temp:.2f} °C")
                     cool_time = get_cooling_time(pid)
                     print(f"pieces cool time: {cool_time}")
                 valid_actions = [pid for pid in piece_ids if stats[pid]["avg_temp"] < agent.temp_threshold]
+            if waiting_time:
+                metrics.observe("control_seconds", time.perf_counter() - wait_start, stage="wait_cold")
 
 
             reward = -1
@@ -236,34 +265,29 @@ def main():
             print(f"[auto] → Printing piece {choice}")
 
             piece_id = choice
-            path = f"deposition_points_piece_{piece_id}.json"
+            path = deposition_log_path(piece_id)
 
             idle = start_print(piece_id)
             print(f"→ Piece {piece_id} cooled for {idle:.2f}s since last print")
 
+            # robot time lost between the previous layer and this one
+            if paused_since is not None:
+                metrics.observe("robot_idle_seconds", time.perf_counter() - paused_since)
+
             #fetch all the points in one layer printed and print the layer
-            fetch.run_fetch_loop(path=path)
+            new_points = fetch.run_fetch_loop(path=path, watcher=watcher)
+            paused_since = time.perf_counter()
 
             end_print(piece_id)
 
-            deposition_points = json.load(open(path))
-
-
             layer_height =  1.0     #printer’s layer height in mm
             min_pts     = 100
-            deposition_points = filter_points_by_layer(deposition_points, layer_height=layer_height, min_points=min_pts )
 
             #show the points collected
             #recreating_the_map(deposition_points)
 
             print()
-            url_number_of_layers = (
-                f"http://localhost/rw/rapid/symbol/data/"
-                f"RAPID/T_ROB1/MainModule/"
-                f"number_of_layer_piece_{piece_id}?json=1"
-            )
-
-            nz = fetch_number_of_layer(url_number_of_layers)
+            nz = snapshot.layer_count(piece_id)
             print(f"number of layers:{nz}")
             ny, nx = (400,400) 
 
@@ -273,13 +297,16 @@ def main():
             print()
 
             #compute the voxel representation
-            voxel_grid= process_voxel(deposition_points, nz, nx, ny,layer_height,  fill_radius=3)
-
-            _, bbox_path = save_bounding_boxes_from_grid(voxel_grid, current_piece)
+            # only this layer's points are rasterized (same grid as process_voxel on the filtered history)
+            grid = voxel_grids.setdefault(piece_id, IncrementalVoxelGrid(nx, ny, layer_height, fill_radius=3))
+            voxel_grid = grid.add_points(new_points, nz, min_points=min_pts)
 
-            print("⏳ Pause simulated for thermo stabilisation ...")
+            _, bbox_path = save_bounding_boxes_from_grid(voxel_grid, current_piece, fmt="npz")
 
-            time.sleep(5) 
+            if stabilisation_pause:
+                print("⏳ Pause simulated for thermo stabilisation ...")
+                with metrics.timer("control_seconds", stage="stabilisation_pause"):
+                    time.sleep(stabilisation_pause)
 
             print(f"🔁 Total reward for this episode: {episode_reward}")
             reward_history.append(episode_reward)
@@ -297,14 +324,18 @@ def main():
             print()
 
 
-    except KeyboardInterrupt:
+    except (KeyboardInterrupt, NoPieceCools) as stop:
+        # NoPieceCools: every remaining piece stays above the threshold, waiting would never end
+        if isinstance(stop, NoPieceCools):
+            print(f"⛔ Stopping: {stop}")
         set_piece_choice(0)
         set_pause_printing(False)
-        stats = save_heat_stats(piece_ids, nx, ny)
+        stats = save_heat_stats(piece_ids, nx, ny, incremental=True, workers=len(piece_ids),
+                                layer_counts=snapshot.layer_counts(piece_ids))
         display_stats(stats)
         print("💾 Saving Q-table...")
         print()
-        agent.save("q_table.pkl")
+        agent.save(Q_TABLE_DIR)
         plt.figure(figsize=(10, 4))
         plt.plot(reward_history, label="Total reward per episode")
         plt.xlabel("episode")
@@ -322,6 +353,7 @@ def main():
         total_time = time.time() - start_time
         print(f" AI total time: {total_time}")
         print("🏁 All done — exiting.")
+        watcher.stop()
         
 
 
@@ -0,0 +1,239 @@
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# ---------------------------
+# Hot-path instrumentation: counters, histograms and timers
+# ---------------------------
+# Disabled by default: an instrumented call then costs one global flag check.
+# enable() (or METRICS_JSONL / METRICS_PROM in the environment, see
+# enable_from_env) starts collecting and exports every `interval` seconds:
+#   - one JSON object per export appended to a .jsonl file
+#   - a Prometheus text-format snapshot, rewritten in place (textfile collector)
+# Metrics are keyed by name and labels, e.g. rws_request_seconds{call="fetch_xyz"}.
+
+# seconds; +inf is implicit
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_enabled = False
+_lock = threading.Lock()
+_counters = {}     # (name, labels) → float
+_histograms = {}   # (name, labels) → _Histogram
+_exporter = None
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def cumulative(self):
+        out, total = [], 0
+        for c in self.counts:
+            total += c
+            out.append(total)
+        return out
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def enabled():
+    return _enabled
+
+
+# ---------------------------
+# Recording
+# ---------------------------
+def count(name, value=1, **labels):
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    if not _enabled:
+        return
+    _observe(_key(name, labels), value)
+
+
+def _observe(key, value):
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = _Histogram()
+        hist.observe(value)
+
+
+@contextmanager
+def timer(name, **labels):
+    """
+    with timer("control_seconds", stage="wait_cold"): ...
+    """
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def timed(name, **labels):
+    """
+    Decorator: observe the call's duration in histogram `name`, and count
+    exceptions in `{name}_errors_total`.
+    """
+    key = _key(name, labels)
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except BaseException:
+                count(name + "_errors_total", **labels)
+                raise
+            finally:
+                _observe(key, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+# ---------------------------
+# Export
+# ---------------------------
+def _label_str(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+def snapshot():
+    with _lock:
+        counters = {name + _label_str(labels): v for (name, labels), v in _counters.items()}
+        histograms = {
+            name + _label_str(labels): {
+                "count": h.count, "sum": h.sum, "max": h.max,
+                "buckets": dict(zip([str(b) for b in BUCKETS] + ["+Inf"], h.cumulative())),
+            }
+            for (name, labels), h in _histograms.items()
+        }
+    return {"ts": time.time(), "counters": counters, "histograms": histograms}
+
+
+def prometheus_text():
+    lines = []
+    with _lock:
+        for name in sorted({n for n, _ in _counters}):
+            lines.append(f"# TYPE {name} counter")
+            for (n, labels), v in sorted(_counters.items()):
+                if n == name:
+                    lines.append(f"{name}{_label_str(labels)} {v}")
+        for name in sorted({n for n, _ in _histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (n, labels), h in sorted(_histograms.items(), key=lambda kv: kv[0]):
+                if n != name:
+                    continue
+                for le, c in zip([str(b) for b in BUCKETS] + ["+Inf"], h.cumulative()):
+                    lines.append(f"{name}_bucket{_label_str(labels, [('le', le)])} {c}")
+                lines.append(f"{name}_sum{_label_str(labels)} {h.sum}")
+                lines.append(f"{name}_count{_label_str(labels)} {h.count}")
+    return "\n".join(lines) + "\n"
+
+
+def export(jsonl_path=None, prom_path=None):
+    if jsonl_path:
+        with open(jsonl_path, "a") as f:
+            f.write(json.dumps(snapshot()) + "\n")
+    if prom_path:
+        # swap the file in whole so a scraper never reads half of it
+        tmp = prom_path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(prometheus_text())
+        os.replace(tmp, prom_path)
+
+
+class _Exporter(threading.Thread):
+    def __init__(self, jsonl_path, prom_path, interval):
+        super().__init__(daemon=True)
+        self.jsonl_path, self.prom_path, self.interval = jsonl_path, prom_path, interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            export(self.jsonl_path, self.prom_path)
+
+    def stop(self):
+        self.stopped.set()
+        self.join(timeout=self.interval)
+        export(self.jsonl_path, self.prom_path)
+
+
+def enable(jsonl_path=None, prom_path=None, interval=10.0):
+    """
+    Start collecting. With a path, export there every `interval` seconds
+    and once more on disable() / interpreter exit.
+    """
+    global _enabled, _exporter
+    _enabled = True
+    if _exporter is not None:
+        _exporter.stop()
+        _exporter = None
+    if jsonl_path or prom_path:
+        _exporter = _Exporter(jsonl_path, prom_path, interval)
+        _exporter.start()
+
+
+def enable_from_env():
+    """
+    METRICS_JSONL / METRICS_PROM: export paths; METRICS_INTERVAL: seconds.
+    Returns True if metrics were enabled.
+    """
+    jsonl_path = os.environ.get("METRICS_JSONL")
+    prom_path = os.environ.get("METRICS_PROM")
+    if not (jsonl_path or prom_path):
+        return False
+    enable(jsonl_path, prom_path, float(os.environ.get("METRICS_INTERVAL", 10.0)))
+    return True
+
+
+def disable():
+    global _enabled, _exporter
+    if _exporter is not None:
+        _exporter.stop()
+        _exporter = None
+    _enabled = False
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+atexit.register(disable)
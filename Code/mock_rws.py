@@ -0,0 +1,473 @@
+import base64
+import hashlib
+import itertools
+import json
+import os
+import random
+import socket
+import struct
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# ---------------------------
+# Local stand-in for the controller's Robot Web Services
+# ---------------------------
+# Serves what the pipeline talks to:
+#   GET  /rw/motionsystem/mechunits/ROB_1/robtarget           current position
+#   GET  /rw/rapid/symbol/data/RAPID/T_ROB1/MainModule/<sym>   RAPID data
+#        (layer_finished, wielding, which_pieces, number_of_layer_piece_N, ...)
+#   POST .../<sym>?action=set                                  pause_printing, piece_choice, ...
+#   POST /subscription, ws://.../poll/{id}                     RWS 1.0 event push
+#   GET  /mock/stats                                           request counters (not counted)
+# With recorded layers loaded it also plays the robot: every un-pause prints
+# the next layer of the chosen piece, moving robtarget at `rate` points/s.
+# Every request can be delayed by latency ± jitter, and is counted per
+# endpoint and per printed layer.
+
+SYMBOL_PREFIX = "/rw/rapid/symbol/data/RAPID/T_ROB1/MainModule/"
+ROBTARGET_PATH = "/rw/motionsystem/mechunits/ROB_1/robtarget"
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC11B85"
+
+DEFAULT_SYMBOLS = {
+    "layer_finished": "FALSE",
+    "wielding": "FALSE",
+    "which_pieces": "1",
+    "pause_printing": "FALSE",
+    "piece_choice": "1",
+}
+
+
+def _ws_frame(text):
+    # server → client frames are not masked
+    payload = text.encode("utf-8")
+    n = len(payload)
+    if n < 126:
+        header = bytes([0x81, n])
+    elif n < 65536:
+        header = bytes([0x81, 126]) + struct.pack(">H", n)
+    else:
+        header = bytes([0x81, 127]) + struct.pack(">Q", n)
+    return header + payload
+
+
+def symbol_event(sid, name, value, base="http://127.0.0.1/"):
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<html xmlns="http://www.w3.org/1999/xhtml"><head>'
+        f'<base href="{base}"/></head><body><div class="state">'
+        f'<a href="subscription/{sid}" rel="group"></a><ul>'
+        f'<li class="rap-value-ev" title="{name}">'
+        f'<a href="{SYMBOL_PREFIX}{name};value" rel="self"/>'
+        f'<span class="value">{value}</span></li>'
+        '</ul></div></body></html>'
+    )
+
+
+class _Subscription:
+    def __init__(self, sid, symbols):
+        self.sid = sid
+        self.symbols = set(symbols)
+        self.sockets = []
+        self.lock = threading.Lock()
+
+    def push(self, name, value):
+        frame = _ws_frame(symbol_event(self.sid, name, value))
+        with self.lock:
+            for sock in list(self.sockets):
+                try:
+                    sock.sendall(frame)
+                except OSError:
+                    self.sockets.remove(sock)
+
+    def close(self):
+        with self.lock:
+            for sock in self.sockets:
+                try:
+                    sock.sendall(bytes([0x88, 0]))
+                except OSError:
+                    pass
+            self.sockets.clear()
+
+
+class MockRWS:
+    """
+    In-process fake controller. Point the client modules at `base_url`
+    (or run it on port 80 so the hardcoded http://localhost URLs hit it).
+
+        with MockRWS(layers={1: load_layers("deposition_points_piece_1.bin")},
+                     rate=200, latency=0.002, jitter=0.001) as rws:
+            ...                                  # run the control loop
+            rws.layer_stats                      # HTTP requests per printed layer
+
+    layers:        piece id → list of (n, 3) point arrays, replayed in order
+    rate:          replayed points per second
+    latency/jitter: seconds added to every request (uniform ± jitter)
+    subscriptions: False makes POST /subscription fail (polling fallback)
+    digest:        answer requests without Authorization with a Digest
+                   challenge, like the real controller (not verified)
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, symbols=None, subscriptions=True,
+                 layers=None, rate=100.0, latency=0.0, jitter=0.0, digest=False, seed=None):
+        self.symbols = dict(DEFAULT_SYMBOLS)
+        self.layers = {int(pid): list(l) for pid, l in (layers or {}).items()}
+        for pid in self.layers:
+            self.symbols.setdefault(f"number_of_layer_piece_{pid}", "0")
+        self.symbols.update(symbols or {})
+        self.robtarget = (0.0, 0.0, 0.0)
+        self.subscriptions_enabled = subscriptions
+        self.rate = rate
+        self.latency = latency
+        self.jitter = jitter
+        self.digest = digest
+        self._random = random.Random(seed)
+
+        self.subscriptions = {}
+        self.counts = Counter()
+        self.layer_stats = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._resumed = threading.Condition(self._lock)
+        self._resume_count = 0
+        self._stop = threading.Event()
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self._threads = []
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    # --- state ---
+    def get_symbol(self, name):
+        with self._lock:
+            return self.symbols.get(name)
+
+    def set_symbol(self, name, value):
+        value = str(value)
+        with self._lock:
+            changed = self.symbols.get(name) != value
+            self.symbols[name] = value
+            targets = [s for s in self.subscriptions.values() if name in s.symbols] if changed else []
+        for sub in targets:
+            sub.push(name, value)
+
+    def _client_set(self, name, value):
+        # writes from the client; un-pausing starts the next layer
+        self.set_symbol(name, value)
+        if name == "pause_printing" and str(value) == "FALSE" and self.layers:
+            # clear the flag before answering, as RAPID does when it resumes
+            self.set_symbol("layer_finished", "FALSE")
+            with self._resumed:
+                self._resume_count += 1
+                self._resumed.notify_all()
+
+    def stats(self):
+        with self._lock:
+            return {"counts": dict(self.counts), "total": sum(self.counts.values()),
+                    "layers": list(self.layer_stats)}
+
+    def reset_counts(self):
+        with self._lock:
+            self.counts.clear()
+            self.layer_stats.clear()
+
+    # --- robot replay ---
+    def _next_piece(self, order):
+        try:
+            choice = int(self.get_symbol("piece_choice"))
+        except (TypeError, ValueError):
+            choice = 0
+        remaining = [pid for pid in order if self._progress[pid] < len(self.layers[pid])]
+        if choice in remaining:
+            return choice
+        # no valid choice (manual phase): next piece in order
+        return remaining[0] if remaining else None
+
+    def _replay(self):
+        order = sorted(self.layers)
+        self._progress = {pid: 0 for pid in order}
+        seen = 0
+        while not self._stop.is_set():
+            with self._resumed:
+                if not self._resumed.wait_for(lambda: self._resume_count > seen or self._stop.is_set()):
+                    continue
+                seen = self._resume_count
+            if self._stop.is_set():
+                return
+            pid = self._next_piece(order)
+            if pid is None:
+                continue
+            points = self.layers[pid][self._progress[pid]]
+            with self._lock:
+                before = Counter(self.counts)
+            start = time.perf_counter()
+
+            self.set_symbol("which_pieces", pid)
+            self.set_symbol("wielding", "TRUE")
+            for i, p in enumerate(points):
+                if self._stop.is_set():
+                    return
+                self.robtarget = (float(p[0]), float(p[1]), float(p[2]))
+                # absolute schedule: request handling does not slow the robot down
+                delay = start + (i + 1) / self.rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            self.set_symbol("wielding", "FALSE")
+
+            self._progress[pid] += 1
+            self.set_symbol(f"number_of_layer_piece_{pid}", self._progress[pid])
+            self.set_symbol("layer_finished", "TRUE")
+            with self._lock:
+                requests = self.counts - before
+                self.layer_stats.append({
+                    "piece": pid, "layer": self._progress[pid], "points": len(points),
+                    "duration": time.perf_counter() - start,
+                    "requests": dict(requests), "total": sum(requests.values()),
+                })
+
+    # --- lifecycle ---
+    def start(self):
+        self._threads = [threading.Thread(target=self.server.serve_forever, daemon=True)]
+        if self.layers:
+            self._threads.append(threading.Thread(target=self._replay, daemon=True))
+        for t in self._threads:
+            t.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        with self._resumed:
+            self._resumed.notify_all()
+        for sub in list(self.subscriptions.values()):
+            sub.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # --- HTTP ---
+    def _handler_class(self):
+        rws = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # headers and body go out in separate writes: don't let Nagle hold the body
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, code, body=b"", content_type="application/json", headers=None):
+                self.send_response(code)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                if body:
+                    self.wfile.write(body)
+
+            def _form(self):
+                n = int(self.headers.get("Content-Length", 0))
+                return parse_qs(self.rfile.read(n).decode()) if n else {}
+
+            def _admit(self, endpoint):
+                """
+                Count the request, apply latency and the auth challenge.
+                Returns False if the request was already answered.
+                """
+                with rws._lock:
+                    rws.counts[endpoint] += 1
+                delay = rws.latency + (rws._random.uniform(-rws.jitter, rws.jitter) if rws.jitter else 0.0)
+                if delay > 0:
+                    time.sleep(delay)
+                if rws.digest and not self.headers.get("Authorization", "").startswith("Digest"):
+                    with rws._lock:
+                        rws.counts["401"] += 1
+                    self._form()   # drain the body before answering on a kept-alive connection
+                    nonce = base64.b64encode(os.urandom(12)).decode()
+                    self._reply(401, headers={"WWW-Authenticate":
+                                              f'Digest realm="validusers@robapi.abb", nonce="{nonce}", qop="auth"'})
+                    return False
+                return True
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                if parsed.path == "/mock/stats":
+                    return self._reply(200, json.dumps(rws.stats()).encode())
+                if parsed.path.startswith("/poll/") and self.headers.get("Upgrade", "").lower() == "websocket":
+                    return self._websocket(parsed.path)
+                if parsed.path == ROBTARGET_PATH:
+                    if not self._admit("robtarget"):
+                        return
+                    x, y, z = rws.robtarget
+                    body = {"_embedded": {"_state": [{
+                        "_type": "ms-robtargets", "_title": "ROB_1",
+                        "x": f"{x:.6f}", "y": f"{y:.6f}", "z": f"{z:.6f}",
+                        "q1": "1", "q2": "0", "q3": "0", "q4": "0",
+                    }]}}
+                    return self._reply(200, json.dumps(body).encode())
+                if parsed.path.startswith(SYMBOL_PREFIX):
+                    name = parsed.path[len(SYMBOL_PREFIX):]
+                    if not self._admit(name):
+                        return
+                    value = rws.get_symbol(name)
+                    if value is None:
+                        return self._reply(400, b'{"status": {"code": -1073445865}}')
+                    body = {"_embedded": {"_state": [{"_type": "rap-data", "_title": name, "value": value}]}}
+                    return self._reply(200, json.dumps(body).encode())
+                self._reply(404)
+
+            def do_POST(self):
+                parsed = urlparse(self.path)
+                if parsed.path == "/subscription":
+                    if not self._admit("subscription"):
+                        return
+                    form = self._form()
+                    if not rws.subscriptions_enabled:
+                        return self._reply(503)
+                    names = []
+                    for rid in form.get("resources", []):
+                        resource = form.get(rid, [""])[0]
+                        if resource.startswith(SYMBOL_PREFIX):
+                            names.append(resource[len(SYMBOL_PREFIX):].split(";")[0])
+                    sid = next(rws._ids)
+                    with rws._lock:
+                        rws.subscriptions[sid] = _Subscription(sid, names)
+                    host, port = rws.server.server_address[:2]
+                    return self._reply(201, headers={
+                        "Location": f"ws://{host}:{port}/poll/{sid}",
+                        "Set-Cookie": f"-http-session-={sid}; path=/",
+                    })
+                if parsed.path.startswith(SYMBOL_PREFIX) and "action=set" in parsed.query:
+                    name = parsed.path[len(SYMBOL_PREFIX):]
+                    if not self._admit(name + ":set"):
+                        return
+                    rws._client_set(name, self._form().get("value", [""])[0])
+                    return self._reply(204)
+                self._form()
+                self._reply(404)
+
+            def do_DELETE(self):
+                parsed = urlparse(self.path)
+                if parsed.path.startswith("/subscription/"):
+                    if not self._admit("subscription:delete"):
+                        return
+                    try:
+                        sid = int(parsed.path.rsplit("/", 1)[-1])
+                    except ValueError:
+                        return self._reply(404)
+                    with rws._lock:
+                        sub = rws.subscriptions.pop(sid, None)
+                    if sub is None:
+                        return self._reply(404)
+                    sub.close()
+                    return self._reply(200)
+                self._reply(404)
+
+            def _websocket(self, path):
+                try:
+                    sid = int(path.rstrip("/").rsplit("/", 1)[-1])
+                except ValueError:
+                    return self._reply(404)
+                sub = rws.subscriptions.get(sid)
+                key = self.headers.get("Sec-WebSocket-Key")
+                if sub is None or not key:
+                    return self._reply(404)
+                accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+                self.send_response(101)
+                self.send_header("Upgrade", "websocket")
+                self.send_header("Connection", "Upgrade")
+                self.send_header("Sec-WebSocket-Accept", accept)
+                self.send_header("Sec-WebSocket-Protocol", "robapi2_subscription")
+                self.end_headers()
+                self.wfile.flush()
+                with sub.lock:
+                    sub.sockets.append(self.connection)
+                # hold the connection until the client closes it
+                try:
+                    while True:
+                        head = self.connection.recv(2)
+                        if len(head) < 2 or head[0] & 0x0F == 0x8:
+                            break
+                        n = head[1] & 0x7F
+                        if n == 126:
+                            n = struct.unpack(">H", self.connection.recv(2))[0]
+                        elif n == 127:
+                            n = struct.unpack(">Q", self.connection.recv(8))[0]
+                        self.connection.recv(4 + n)  # mask + payload, ignored
+                except (OSError, socket.timeout):
+                    pass
+                with sub.lock:
+                    if self.connection in sub.sockets:
+                        sub.sockets.remove(self.connection)
+                self.close_connection = True
+
+        return Handler
+
+
+def recorded_layers(pattern="deposition_points_piece_{}", piece_ids=(1, 2, 3, 4), layer_height=1.0):
+    """
+    piece id → layers, from the point logs (.bin) or, failing that, the JSON recordings.
+    """
+    from point_log import load_layers
+
+    layers = {}
+    for pid in piece_ids:
+        for ext in (".bin", ".json"):
+            path = pattern.format(pid) + ext
+            if os.path.exists(path) and os.path.getsize(path) > 2:
+                layers[pid] = load_layers(path, layer_height)
+                break
+    return layers
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local stand-in for the controller's RWS")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=80,
+                        help="80 lets the modules' hardcoded http://localhost URLs reach it")
+    parser.add_argument("--pieces", type=int, nargs="*", default=[1, 2, 3, 4],
+                        help="replay the recorded layers of these pieces")
+    parser.add_argument("--no-replay", action="store_true")
+    parser.add_argument("--rate", type=float, default=100.0, help="replayed points per second")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to each request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="± seconds of uniform jitter")
+    parser.add_argument("--digest", action="store_true", help="send Digest challenges like the controller")
+    parser.add_argument("--no-subscriptions", action="store_true")
+    parser.add_argument("--stats", help="write the request counters to this JSON file on exit")
+    args = parser.parse_args()
+
+    layers = {} if args.no_replay else recorded_layers(piece_ids=args.pieces)
+    rws = MockRWS(args.host, args.port, layers=layers, rate=args.rate, latency=args.latency,
+                  jitter=args.jitter, digest=args.digest, subscriptions=not args.no_subscriptions)
+    with rws:
+        print(f"Mock RWS listening on {rws.base_url}, replaying "
+              + (", ".join(f"piece {pid}: {len(l)} layers" for pid, l in layers.items()) or "nothing"))
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+    stats = rws.stats()
+    print(f"{stats['total']} requests: {stats['counts']}")
+    for layer in stats["layers"]:
+        print(f"piece {layer['piece']} layer {layer['layer']}: {layer['total']} requests "
+              f"in {layer['duration']:.2f}s ({layer['points']} points)")
+    if args.stats:
+        with open(args.stats, "w") as f:
+            json.dump(stats, f, indent=2)
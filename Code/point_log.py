@@ -0,0 +1,180 @@
+import json
+import os
+import numpy as np
+
+# ---------------------------
+# Append-only deposition point log
+# ---------------------------
+# A headerless file of fixed-size little-endian records, one per recorded point:
+#   x, y, z  (float64, robot coordinates)
+#   t        (float64, time.monotonic() of the sample)
+#   layer    (int32, per-file layer counter, non-decreasing along the file)
+# Points are appended in chunks while a layer prints, so a crash loses at most
+# one chunk; a torn record at the end is ignored by readers. Because layers
+# only grow, a layer's segment is found by binary search on the mapped file.
+
+RECORD_DTYPE = np.dtype([("x", "<f8"), ("y", "<f8"), ("z", "<f8"), ("t", "<f8"), ("layer", "<i4")])
+
+
+def deposition_log_path(piece_id):
+    return f"deposition_points_piece_{piece_id}.bin"
+
+
+class DepositionLog:
+    """
+    Writer side. Buffers points and appends them every `chunk` points
+    (and on flush/close). Layers are numbered from 0 and continue after the
+    last layer already in the file.
+
+        with DepositionLog(path) as log:
+            log.begin_layer()
+            log.append((x, y, z), t)
+    """
+
+    def __init__(self, path, chunk=256, fsync=False):
+        self.path = path
+        self.chunk = chunk
+        self.fsync = fsync
+        self._buffer = []
+
+        existing = read_log(path) if os.path.exists(path) else None
+        self.count = 0 if existing is None else len(existing)
+        self.layer = -1 if not self.count else int(existing["layer"][-1])
+        del existing
+        # drop a torn trailing record before appending behind it
+        if os.path.exists(path) and os.path.getsize(path) != self.count * RECORD_DTYPE.itemsize:
+            with open(path, "r+b") as f:
+                f.truncate(self.count * RECORD_DTYPE.itemsize)
+        self._file = open(path, "ab")
+
+    def begin_layer(self):
+        self.flush()
+        self.layer += 1
+        return self.layer
+
+    def append(self, xyz, t=0.0):
+        if self.layer < 0:
+            self.layer = 0
+        x, y, z = xyz
+        self._buffer.append((x, y, z, t, self.layer))
+        if len(self._buffer) >= self.chunk:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._file.write(np.array(self._buffer, dtype=RECORD_DTYPE).tobytes())
+            self.count += len(self._buffer)
+            self._buffer = []
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ---------------------------
+# Readers
+# ---------------------------
+def read_log(path):
+    """
+    Memory-mapped structured view of every complete record (empty array
+    for an empty file).
+    """
+    n = os.path.getsize(path) // RECORD_DTYPE.itemsize
+    if n == 0:
+        return np.empty(0, dtype=RECORD_DTYPE)
+    return np.memmap(path, dtype=RECORD_DTYPE, mode="r", shape=(n,))
+
+
+def _xyz(records):
+    out = np.empty((len(records), 3), dtype=np.float64)
+    out[:, 0], out[:, 1], out[:, 2] = records["x"], records["y"], records["z"]
+    return out
+
+
+def log_points(path):
+    """
+    (N, 3) float array of all logged points, in recording order.
+    """
+    return _xyz(read_log(path))
+
+
+def layer_range(records, layer):
+    # records are sorted by layer: binary search touches only a few pages
+    layers = records["layer"]
+    return int(np.searchsorted(layers, layer, "left")), int(np.searchsorted(layers, layer, "right"))
+
+
+def layer_points(path, layer=-1):
+    """
+    (n, 3) points of one layer; layer=-1 is the last layer in the file.
+    """
+    records = read_log(path)
+    if len(records) == 0:
+        return np.empty((0, 3))
+    if layer < 0:
+        layer = int(records["layer"][-1]) + 1 + layer
+    start, stop = layer_range(records, layer)
+    return _xyz(records[start:stop])
+
+
+def iter_layers(path):
+    """
+    Yield (layer, (n, 3) points) for every layer in the file.
+    """
+    records = read_log(path)
+    if len(records) == 0:
+        return
+    layers = np.asarray(records["layer"])
+    bounds = np.flatnonzero(np.diff(layers)) + 1
+    for start, stop in zip(np.r_[0, bounds], np.r_[bounds, len(layers)]):
+        yield int(layers[start]), _xyz(records[start:stop])
+
+
+def layers_from_z(z, layer_height=1.0):
+    """
+    Non-decreasing layer numbers for points recorded in print order
+    (for recordings that do not carry them).
+    """
+    z = np.asarray(z, dtype=np.float64)
+    if len(z) == 0:
+        return np.empty(0, dtype=np.int32)
+    return np.maximum.accumulate(np.floor((z - z.min()) / layer_height).astype(np.int32))
+
+
+def load_layers(path, layer_height=1.0):
+    """
+    List of (n, 3) point arrays, one per layer, from a point log or a
+    legacy JSON recording.
+    """
+    if not path.endswith(".json"):
+        return [points for _, points in iter_layers(path)]
+    with open(path) as f:
+        points = np.asarray(json.load(f), dtype=np.float64).reshape(-1, 3)
+    layers = layers_from_z(points[:, 2], layer_height)
+    bounds = np.flatnonzero(np.diff(layers)) + 1
+    return np.split(points, bounds) if len(points) else []
+
+
+def convert_json_log(json_path, log_path, layer_height=1.0):
+    """
+    Import a legacy deposition_points_piece_N.json (flat list of [x, y, z]).
+    Layers are not recorded there, so they are recovered from z / layer_height.
+    """
+    with open(json_path) as f:
+        points = np.asarray(json.load(f), dtype=np.float64).reshape(-1, 3)
+    records = np.zeros(len(points), dtype=RECORD_DTYPE)
+    records["x"], records["y"], records["z"] = points[:, 0], points[:, 1], points[:, 2]
+    records["layer"] = layers_from_z(points[:, 2], layer_height)
+    with open(log_path, "wb") as f:
+        f.write(records.tobytes())
+    return len(records)
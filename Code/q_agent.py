@@ -1,49 +1,89 @@
 from calculate_cooling_time import get_cooling_time
 from ABB_control import fetch_number_of_layer
+import os
 import random
 import pickle
+from metrics import timed
+from q_array import ArrayQTable
 
 class QAgent:
-    def __init__(self, alpha=0.1, gamma=0.9, epsilon=0.2, temp_threshold=400):
-        self.q_table = {}  # dictionnary : (state, action) → Q-value
+    def __init__(self, alpha=0.1, gamma=0.9, epsilon=0.2, temp_threshold=400, table="dict", actions=(1, 2, 3, 4)):
+        # table="dict": dictionnary (state, action) → Q-value
+        # table="array": q_array.ArrayQTable, same lookups on a NumPy array
+        if table not in ("dict", "array"):
+            raise ValueError(f"Unknown table {table!r}, expected 'dict' or 'array'")
+        self.q_table = {} if table == "dict" else ArrayQTable(actions)
         self.alpha = alpha
         self.gamma = gamma
         self.epsilon = epsilon
         self.temp_threshold = temp_threshold
 
-    def encode_state(self, stats, active_ids):
+    @timed("agent_seconds", step="encode_state")
+    def encode_state(self, stats, active_ids, layer_counts=None, cool_times=None):
+        # layer_counts (piece id → layers) skips the controller lookups,
+        # cool_times (piece id → s) the print timers (e.g. simulated print cells)
         state = []
         for pid in active_ids:
             temp = int(stats[pid]["avg_temp"] // 10)
-            cool = int(get_cooling_time(pid) // 10)
-            try:
-                layers = fetch_number_of_layer(
-                    f"http://localhost/rw/rapid/symbol/data/RAPID/T_ROB1/MainModule/number_of_layer_piece_{pid}?json=1"
-                )
-            except:
-                layers = 0
+            cool = int((get_cooling_time(pid) if cool_times is None else cool_times[pid]) // 10)
+            if layer_counts is not None:
+                layers = layer_counts.get(pid, 0)
+            else:
+                try:
+                    layers = fetch_number_of_layer(
+                        f"http://localhost/rw/rapid/symbol/data/RAPID/T_ROB1/MainModule/number_of_layer_piece_{pid}?json=1"
+                    )
+                except:
+                    layers = 0
             state.append((temp, cool, layers))
         return tuple(state)
 
+    @timed("agent_seconds", step="choose_action")
     def choose_action(self, state, valid_actions):
         if random.random() < self.epsilon:
             return random.choice(valid_actions)
-        q_vals = [self.q_table.get((state, a), 0.0) for a in valid_actions]
+        q_vals = self._q_values(state, valid_actions)
         return valid_actions[q_vals.index(max(q_vals))]
 
+    @timed("agent_seconds", step="update")
     def update(self, state, action, reward, next_state, next_valid_actions):
-        max_q_next = max([self.q_table.get((next_state, a), 0.0) for a in next_valid_actions], default=0)
+        max_q_next = max(self._q_values(next_state, next_valid_actions), default=0)
         old_q = self.q_table.get((state, action), 0.0)
         new_q = old_q + self.alpha * (reward + self.gamma * max_q_next - old_q)
         self.q_table[(state, action)] = new_q
 
+    def _q_values(self, state, actions):
+        if isinstance(self.q_table, ArrayQTable):
+            return self.q_table.values(state, actions)
+        return [self.q_table.get((state, a), 0.0) for a in actions]
+
     def save(self, path="q_table.pkl"):
-        with open(path, "wb") as f:
-            pickle.dump(self.q_table, f)
+        """
+        A .pkl path pickles the table as a dict (either mode); any other
+        path saves an array table as an ArrayQTable directory.
+        """
+        if path.endswith(".pkl"):
+            table = self.q_table.to_dict() if isinstance(self.q_table, ArrayQTable) else self.q_table
+            with open(path, "wb") as f:
+                pickle.dump(table, f)
+        elif isinstance(self.q_table, ArrayQTable):
+            self.q_table.save(path)
+        else:
+            raise ValueError(f"A dict Q-table is saved as .pkl, got {path!r}")
 
     def load(self, path="q_table.pkl"):
+        """
+        A pickled dict (converted in array mode) or an ArrayQTable directory
+        (memory-mapped; the agent switches to array mode).
+        """
+        if os.path.isdir(path):
+            self.q_table = ArrayQTable.load(path)
+            return
         with open(path, "rb") as f:
-            self.q_table = pickle.load(f)
+            table = pickle.load(f)
+        if isinstance(self.q_table, ArrayQTable):
+            table = ArrayQTable.from_dict(table, self.q_table.actions, self.q_table.bins)
+        self.q_table = table
 
     def decay_epsilon(self, min_epsilon=0.05, decay=0.995):
         self.epsilon = max(min_epsilon, self.epsilon * decay)
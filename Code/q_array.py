@@ -0,0 +1,233 @@
+import os
+import shutil
+
+import numpy as np
+
+# ---------------------------
+# Q-table as a NumPy array
+# ---------------------------
+# QAgent's states are tuples of per-piece (temp, cool, layers) bins, one triple
+# per active piece. Each triple is packed into one integer with a mixed-radix
+# code (radices `bins`, fixed per table), and a state into one integer key over
+# its piece codes; a state with a bin outside the radices keeps its tuple as key.
+# Every new state gets the next row of a dense (rows, actions) float64 array;
+# a never-visited cell holds NaN and reads as the dict's default.
+# save() writes plain .npy files into a directory; load() memory-maps them
+# (copy-on-write), so a large table opens without being read in full; the
+# next save() reads it into memory.
+
+DEFAULT_BINS = (256, 4096, 1024)   # temp // 10, cool // 10, layers: 2560 °C, 11 h, 1024 layers
+_PAD = np.iinfo(np.int32).min       # states past a state's length (bins may be negative)
+
+
+class ArrayQTable:
+    """
+    Drop-in for QAgent's dict table:
+
+        table = ArrayQTable(actions=[1, 2, 3, 4])
+        table.get((state, action), 0.0)
+        table[(state, action)] = q
+        table.values(state, [1, 3])        # one row lookup for several actions
+        ArrayQTable.from_dict(pickle.load(f))
+
+    The radices are fixed at construction; by default they span QAgent's
+    encoder (2560 °C, 11 h, 1024 layers). A state with a bin outside them
+    (e.g. a negative temperature bin) is keyed by its tuple instead, as in
+    the dict table: it still gets a row of its own. Reads never change the
+    table.
+    """
+
+    def __init__(self, actions=(), bins=DEFAULT_BINS, capacity=1024):
+        self.bins = tuple(int(b) for b in bins)
+        self.actions = list(actions)
+        self._col = {a: i for i, a in enumerate(self.actions)}
+        self._per_piece = self.bins[0] * self.bins[1] * self.bins[2]
+        self._rows = {}        # state key → row
+        self.n_rows = 0
+        self.q = np.full((capacity, len(self.actions)), np.nan)
+        # bins of each row's state, _PAD past the state's length (to rebuild keys on load)
+        self.states = np.full((capacity, 4, 3), _PAD, dtype=np.int32)
+
+    # --- indexing ---
+    def key(self, state):
+        """
+        Mixed-radix integer of a state whose bins are all within the radices;
+        states of different lengths never collide. Any other state is keyed
+        by its tuple, which never equals an integer key.
+        """
+        rt, rc, rl = self.bins
+        base = self._per_piece + 1
+        key = 0
+        for temp, cool, layers in state:
+            if not (0 <= temp < rt and 0 <= cool < rc and 0 <= layers < rl):
+                return tuple(tuple(t) for t in state)
+            key = key * base + (temp * rc + cool) * rl + layers + 1
+        return key
+
+    def _keys_of_rows(self):
+        # key() of every stored state, from the states array (load)
+        rt, rc, rl = self.bins
+        s = self.states[:self.n_rows].astype(np.int64)
+        present = s[:, :, 0] != _PAD
+        inside = ((0 <= s) & (s < self.bins)).all(axis=2) | ~present
+        codes = np.where(present, (s[:, :, 0] * rc + s[:, :, 1]) * rl + s[:, :, 2] + 1, 0)
+        base = self._per_piece + 1
+        keys = []
+        for triples, row, ok in zip(s.tolist(), codes.tolist(), inside.all(axis=1).tolist()):
+            if not ok:
+                keys.append(tuple(tuple(t) for t in triples if t[0] != _PAD))
+                continue
+            key = 0
+            for code in row:
+                if code:
+                    key = key * base + code
+            keys.append(key)
+        return keys
+
+    def row(self, state, create=False):
+        key = self.key(state)
+        row = self._rows.get(key)
+        if row is None and create:
+            row = self._add_row(key, state)
+        return row
+
+    def _add_row(self, key, state):
+        if self.n_rows == len(self.q):
+            self._grow_rows(2 * max(1, len(self.q)))
+        if len(state) > self.states.shape[1]:
+            states = np.full((len(self.states), len(state), 3), _PAD, dtype=np.int32)
+            states[:, :self.states.shape[1]] = self.states
+            self.states = states
+        row = self.n_rows
+        if state:
+            self.states[row, :len(state)] = state
+        self._rows[key] = row
+        self.n_rows += 1
+        return row
+
+    def _grow_rows(self, capacity):
+        # also turns a memory-mapped table into an in-memory one
+        q = np.full((capacity, self.q.shape[1]), np.nan)
+        q[:self.n_rows] = self.q[:self.n_rows]
+        states = np.full((capacity,) + self.states.shape[1:], _PAD, dtype=np.int32)
+        states[:self.n_rows] = self.states[:self.n_rows]
+        self.q, self.states = q, states
+
+    def column(self, action, create=False):
+        col = self._col.get(action)
+        if col is None and create:
+            col = len(self.actions)
+            self.actions.append(action)
+            self._col[action] = col
+            q = np.full((len(self.q), col + 1), np.nan)
+            q[:, :col] = self.q
+            self.q = q
+        return col
+
+    # --- dict interface used by QAgent ---
+    def get(self, key, default=None):
+        state, action = key
+        row, col = self.row(state), self._col.get(action)
+        if row is None or col is None:
+            return default
+        value = self.q[row, col]
+        return default if value != value else float(value)   # NaN: never visited
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        state, action = key
+        col = self.column(action, create=True)
+        row = self.row(state, create=True)   # may reallocate self.q
+        self.q[row, col] = value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return int(np.count_nonzero(~np.isnan(self.q[:self.n_rows])))
+
+    def values(self, state, actions, default=0.0):
+        """
+        [get((state, a), default) for a in actions] with a single row lookup.
+        """
+        row = self.row(state)
+        if row is None:
+            return [default] * len(actions)
+        q = self.q[row].tolist()
+        cols = self._col
+        out = []
+        for a in actions:
+            value = q[cols[a]] if a in cols else default
+            out.append(default if value != value else value)
+        return out
+
+    def items(self):
+        q = self.q[:self.n_rows].tolist()
+        for row, triples in enumerate(self.states[:self.n_rows].tolist()):
+            state = tuple(tuple(t) for t in triples if t[0] != _PAD)
+            for action, value in zip(self.actions, q[row]):
+                if value == value:
+                    yield (state, action), value
+
+    # --- conversion ---
+    @classmethod
+    def from_dict(cls, q_dict, actions=(), bins=DEFAULT_BINS):
+        """
+        Import a dict table (e.g. a pickled q_table.pkl).
+        """
+        actions = list(actions) + sorted({a for _, a in q_dict} - set(actions))
+        table = cls(actions, bins, capacity=max(1, len({s for s, _ in q_dict})))
+        for key, value in q_dict.items():
+            table[key] = value
+        return table
+
+    def to_dict(self):
+        return dict(self.items())
+
+    # --- persistence ---
+    def save(self, path):
+        """
+        Write q.npy, states.npy and actions.npy into directory `path`.
+        The directory is replaced whole. A memory-mapped table (load) reads
+        its values into memory first, so saving over the directory it was
+        loaded from does not delete files it still maps (which fails on
+        Windows).
+        """
+        if isinstance(self.q, np.memmap):
+            self.q = np.array(self.q)
+        tmp = path.rstrip("/") + ".tmp"
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+        np.save(os.path.join(tmp, "q.npy"), np.ascontiguousarray(self.q[:self.n_rows]))
+        np.save(os.path.join(tmp, "states.npy"), np.ascontiguousarray(self.states[:self.n_rows]))
+        np.save(os.path.join(tmp, "actions.npy"), np.asarray(self.actions))
+        np.save(os.path.join(tmp, "bins.npy"), np.asarray(self.bins))
+        old = path.rstrip("/") + ".old"
+        if os.path.exists(old):
+            shutil.rmtree(old)
+        if os.path.exists(path):
+            os.replace(path, old)
+        os.replace(tmp, path)
+        if os.path.exists(old):
+            shutil.rmtree(old)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Open a table written by save(). mmap=True maps q.npy copy-on-write:
+        updates stay in memory until the next save().
+        """
+        actions = np.load(os.path.join(path, "actions.npy")).tolist()
+        bins = np.load(os.path.join(path, "bins.npy")).tolist()
+        table = cls(actions, bins, capacity=0)
+        table.q = np.load(os.path.join(path, "q.npy"), mmap_mode="c" if mmap else None)
+        table.states = np.load(os.path.join(path, "states.npy"))
+        table.n_rows = len(table.q)
+        table._rows = {key: row for row, key in enumerate(table._keys_of_rows())}
+        return table
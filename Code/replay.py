@@ -0,0 +1,246 @@
+import argparse
+import io
+import json
+import os
+import time
+from contextlib import redirect_stdout, nullcontext
+
+import numpy as np
+
+import calculate_cooling_time
+from calculate_cooling_time import start_print, end_print, get_cooling_time
+from filter_outliers import filter_points_by_layer
+from Voxel_grid import process_voxel, save_bounding_boxes_from_grid, IncrementalVoxelGrid
+from heat import simulate_heat, HEAT_BACKENDS
+from save_heat_stats import save_heat_stats
+from thermal_state import reset_piece_states
+from point_log import read_log, load_layers
+
+# ---------------------------
+# Offline replay of recorded prints through the processing pipeline
+# ---------------------------
+# Feeds stored deposition logs layer by layer through the same stages as
+# main.py (filter → voxelize → bboxes → heat → heat stats) without a robot.
+# Print and idle time run on a simulated clock, so cooling times match the
+# recording while the replay runs as fast as the pipeline allows; the real
+# time spent in each stage is measured and written out per layer.
+
+STAGES = ("filter", "voxelize", "bbox", "heat", "stats")
+
+
+class SimulatedClock:
+    """
+    Stand-in for time.perf_counter that only moves when told to.
+    """
+
+    def __init__(self, start=0.0):
+        self.t = float(start)
+
+    def __call__(self):
+        return self.t
+
+    def advance(self, seconds):
+        self.t += max(0.0, float(seconds))
+        return self.t
+
+
+def find_recording(piece_id, directory="."):
+    for name in (f"deposition_points_piece_{piece_id}.bin", f"deposition_points_piece_{piece_id}.json"):
+        path = os.path.join(directory, name)
+        if os.path.exists(path) and os.path.getsize(path) > 2:
+            return os.path.abspath(path)
+    return None
+
+
+def build_schedule(recordings, layer_height=1.0, rate=100.0, gap=0.0):
+    """
+    Order in which the recorded layers are replayed: list of dicts with
+    piece, layer, points, duration (s of printing) and gap (idle s before it).
+
+    If every recording is a point log with sample times, layers follow the
+    recorded timeline; otherwise pieces take turns (1, 2, 3, 4, 1, ...), each
+    layer lasting len(points) / rate seconds, separated by `gap`.
+    """
+    timed = {}
+    for pid, path in recordings.items():
+        if path.endswith(".json"):
+            break
+        records = read_log(path)
+        t = np.asarray(records["t"])
+        if not len(t) or not t.any():
+            break
+        layers = np.asarray(records["layer"])
+        bounds = np.flatnonzero(np.diff(layers)) + 1
+        timed[pid] = [
+            {"piece": pid, "t0": float(t[a]), "t1": float(t[b - 1]),
+             "points": np.column_stack([records["x"][a:b], records["y"][a:b], records["z"][a:b]])}
+            for a, b in zip(np.r_[0, bounds], np.r_[bounds, len(layers)])
+        ]
+    else:
+        if timed:
+            entries = sorted((e for layers in timed.values() for e in layers), key=lambda e: e["t0"])
+            schedule, last_end = [], entries[0]["t0"]
+            for e in entries:
+                schedule.append({"piece": e["piece"], "points": e["points"],
+                                 "duration": e["t1"] - e["t0"], "gap": max(0.0, e["t0"] - last_end)})
+                last_end = max(last_end, e["t1"])
+            return _number_layers(schedule)
+
+    queues = {pid: load_layers(path, layer_height) for pid, path in recordings.items()}
+    schedule = []
+    while any(queues.values()):
+        for pid in sorted(queues):
+            if queues[pid]:
+                points = queues[pid].pop(0)
+                schedule.append({"piece": pid, "points": points,
+                                 "duration": len(points) / rate, "gap": gap})
+    return _number_layers(schedule)
+
+
+def _number_layers(schedule):
+    counts = {}
+    for step in schedule:
+        counts[step["piece"]] = counts.get(step["piece"], 0) + 1
+        step["layer"] = counts[step["piece"]]
+    return schedule
+
+
+def replay(schedule, nx=400, ny=400, layer_height=1.0, min_points=50, fill_radius=3,
+           voxel="full", bbox_fmt="json", heat_backend=None, incremental=True,
+           charge_processing=False, quiet=True):
+    """
+    Run every scheduled layer through the pipeline on a simulated clock.
+    Returns one record per layer with its simulated time, the real seconds
+    spent in each stage and the pieces' average temperatures.
+
+    voxel="full" re-filters and re-voxelizes the piece's whole history like
+    the original loop; "incremental" uses IncrementalVoxelGrid like main.py.
+    charge_processing=True also advances the clock by the real processing
+    time, as the robot waits paused while it runs.
+    """
+    clock = SimulatedClock()
+    calculate_cooling_time.reset_timers()
+    calculate_cooling_time.set_clock(clock)
+    reset_piece_states()
+
+    history, grids, layer_counts, results = {}, {}, {}, []
+    try:
+        for step in schedule:
+            pid = step["piece"]
+            clock.advance(step["gap"])
+            start_print(pid)
+            clock.advance(step["duration"])
+            end_print(pid)
+
+            layer_counts[pid] = step["layer"]
+            nz = layer_counts[pid]
+            timings = dict.fromkeys(STAGES, 0.0)
+            mute = redirect_stdout(io.StringIO()) if quiet else nullcontext()
+            with mute:
+                t = time.perf_counter()
+                if voxel == "incremental":
+                    grid = grids.setdefault(pid, IncrementalVoxelGrid(nx, ny, layer_height, fill_radius=fill_radius))
+                    t = time.perf_counter()
+                    voxel_grid = grid.add_points(step["points"], nz, min_points=min_points)
+                    timings["voxelize"] = time.perf_counter() - t
+                else:
+                    history.setdefault(pid, []).extend(np.asarray(step["points"]).tolist())
+                    filtered = filter_points_by_layer(history[pid], layer_height, min_points=min_points)
+                    timings["filter"] = time.perf_counter() - t
+                    t = time.perf_counter()
+                    voxel_grid = process_voxel(filtered, nz, nx, ny, layer_height, fill_radius=fill_radius) \
+                        if filtered else np.zeros((nx, ny, nz), dtype=bool)
+                    timings["voxelize"] = time.perf_counter() - t
+
+                t = time.perf_counter()
+                _, bbox_path = save_bounding_boxes_from_grid(voxel_grid, pid, fmt=bbox_fmt)
+                timings["bbox"] = time.perf_counter() - t
+
+                t = time.perf_counter()
+                simulate_heat(bbox_path, nz, nx, ny, get_cooling_time(pid), steps_per_layer=1, backend=heat_backend)
+                timings["heat"] = time.perf_counter() - t
+
+                t = time.perf_counter()
+                printed = sorted(layer_counts)
+                stats = save_heat_stats(printed, nx, ny, incremental=incremental,
+                                        workers=len(printed) if incremental else 1, layer_counts=layer_counts)
+                timings["stats"] = time.perf_counter() - t
+
+            if charge_processing:
+                clock.advance(sum(timings.values()))
+            results.append({
+                "piece": pid, "layer": step["layer"], "points": len(step["points"]),
+                "sim_time": clock(), "print_duration": step["duration"], "gap": step["gap"],
+                "timings": timings,
+                "avg_temps": {str(p): float(info["avg_temp"]) for p, info in stats.items()},
+            })
+    finally:
+        calculate_cooling_time.set_clock(None)
+        calculate_cooling_time.reset_timers()
+    return results
+
+
+def summarize(results):
+    totals = {s: sum(r["timings"][s] for r in results) for s in STAGES}
+    return {
+        "layers": len(results),
+        "simulated_time": results[-1]["sim_time"] if results else 0.0,
+        "stage_totals": totals,
+        "processing_time": sum(totals.values()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded prints through the processing pipeline")
+    parser.add_argument("--pieces", type=int, nargs="*", default=[1, 2, 3, 4])
+    parser.add_argument("--data", default=".", help="directory holding deposition_points_piece_N.bin/.json")
+    parser.add_argument("--workdir", default="replay_out",
+                        help="where bbox files and heatmaps are written (keeps the recorded ones intact)")
+    parser.add_argument("--out", default="replay_results.json")
+    parser.add_argument("--max-layers", type=int, default=None, help="stop after this many layers")
+    parser.add_argument("--nx", type=int, default=400)
+    parser.add_argument("--ny", type=int, default=400)
+    parser.add_argument("--layer-height", type=float, default=1.0)
+    parser.add_argument("--min-points", type=int, default=50)
+    parser.add_argument("--rate", type=float, default=100.0,
+                        help="points per second, for recordings without sample times")
+    parser.add_argument("--gap", type=float, default=0.0,
+                        help="idle seconds between layers, for recordings without sample times")
+    parser.add_argument("--voxel", choices=("full", "incremental"), default="full")
+    parser.add_argument("--bbox-format", choices=("json", "npz"), default="json")
+    parser.add_argument("--heat-backend", choices=sorted(HEAT_BACKENDS), default=None)
+    parser.add_argument("--full-stats", action="store_true",
+                        help="re-simulate every piece in save_heat_stats instead of using its cached thermal state")
+    parser.add_argument("--charge-processing", action="store_true",
+                        help="advance the simulated clock by the real processing time too")
+    parser.add_argument("--verbose", action="store_true", help="keep the stages' own output")
+    args = parser.parse_args()
+
+    recordings = {pid: find_recording(pid, args.data) for pid in args.pieces}
+    recordings = {pid: path for pid, path in recordings.items() if path}
+    if not recordings:
+        raise SystemExit(f"No deposition recordings found in {args.data}")
+    schedule = build_schedule(recordings, args.layer_height, args.rate, args.gap)[:args.max_layers]
+    out_path = os.path.abspath(args.out)
+
+    os.makedirs(args.workdir, exist_ok=True)
+    os.chdir(args.workdir)
+    results = replay(schedule, args.nx, args.ny, args.layer_height, args.min_points,
+                     voxel=args.voxel, bbox_fmt=args.bbox_format, heat_backend=args.heat_backend,
+                     incremental=not args.full_stats, charge_processing=args.charge_processing,
+                     quiet=not args.verbose)
+
+    for r in results:
+        temps = "  ".join(f"{p}:{t:6.1f}" for p, t in r["avg_temps"].items())
+        print(f"t={r['sim_time']:8.1f}s  piece {r['piece']} layer {r['layer']:>2} ({r['points']:>5} pts)  "
+              f"processing {sum(r['timings'].values()):6.2f}s  avg °C {temps}")
+    summary = summarize(results)
+    print("stage totals: " + ", ".join(f"{s} {summary['stage_totals'][s]:.2f}s" for s in STAGES))
+
+    with open(out_path, "w") as f:
+        json.dump({"args": vars(args), "summary": summary, "layers": results}, f, indent=2)
+    print(f"Results → {out_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPDigestAuth
+
+# ---------------------------
+# One client for every Robot Web Services call
+# ---------------------------
+# Connection pool sized for the parallel reads, strict (connect, read)
+# timeouts, retry with exponential backoff on transport errors and 5xx, a
+# Digest nonce shared by every thread, and a bulk read of N RAPID symbols.
+# RWS_BASE_URL overrides the controller address (e.g. a mock_rws instance).
+
+DEFAULT_BASE_URL = os.environ.get("RWS_BASE_URL", "http://localhost")
+RETRY_STATUS = (502, 503, 504)
+
+
+class SharedDigestAuth(HTTPDigestAuth):
+    """
+    HTTPDigestAuth keeps the server nonce per thread, so every new thread
+    (each worker of a parallel read) pays an extra 401 round trip before its
+    first request. Here the last challenge and nonce count are shared: any
+    thread can answer preemptively with the nonce another thread obtained.
+    """
+
+    def __init__(self, username, password):
+        super().__init__(username, password)
+        self._shared_lock = threading.Lock()
+        self._shared_chal = {}
+        self._shared_nonce = ""
+        self._shared_count = 0
+
+    def __call__(self, r):
+        self.init_per_thread_state()
+        with self._shared_lock:
+            if self._shared_nonce and not self._thread_local.last_nonce:
+                self._thread_local.last_nonce = self._shared_nonce   # enables the preemptive header
+        return super().__call__(r)
+
+    def build_digest_header(self, method, url):
+        local = self._thread_local
+        with self._shared_lock:
+            if getattr(local, "answering_401", False):
+                # fresh challenge from the server: it becomes the shared one
+                header = super().build_digest_header(method, url)
+                self._shared_chal = dict(local.chal)
+            else:
+                if self._shared_chal:
+                    local.chal = dict(self._shared_chal)
+                local.last_nonce, local.nonce_count = self._shared_nonce, self._shared_count
+                header = super().build_digest_header(method, url)
+            self._shared_nonce, self._shared_count = local.last_nonce, local.nonce_count
+        return header
+
+    def handle_401(self, r, **kwargs):
+        self._thread_local.answering_401 = True
+        try:
+            return super().handle_401(r, **kwargs)
+        finally:
+            self._thread_local.answering_401 = False
+
+
+def parse_bool(value):
+    return value == "TRUE"
+
+
+def parse_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        print(f"Cannot parse value {value!r}, defaulting to 0")
+        return 0
+
+
+def rap_value(data):
+    """
+    The `value` of the rap-data entry in an RWS JSON reply (None if absent).
+    """
+    for entry in data.get('_embedded', {}).get('_state', []):
+        if 'value' in entry and entry.get('_type', 'rap-data') == 'rap-data':
+            return entry['value']
+    return None
+
+
+class RWSClient:
+    """
+        rws = RWSClient()
+        rws.read_symbol("layer_finished")                     # "TRUE"
+        rws.read_symbols(["wielding", "which_pieces"])       # in parallel
+        rws.write_symbol("pause_printing", "FALSE")
+        rws.robtarget(tool="bendedTool", coordinate="Base")  # (x, y, z)
+    """
+
+    def __init__(self, base_url=None, user="Default User", password="robotics",
+                 timeout=(1.0, 2.0), retries=2, backoff=0.05, pool_size=8,
+                 task="T_ROB1", module="MainModule"):
+        self.base_url = (base_url or DEFAULT_BASE_URL).rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.symbol_path = f"/rw/rapid/symbol/data/RAPID/{task}/{module}/"
+
+        self.auth = SharedDigestAuth(user, password)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    # --- transport ---
+    def url(self, path_or_url):
+        if path_or_url.startswith(("http://", "https://")):
+            # absolute URLs from older call sites: keep only path and query
+            parsed = urlparse(path_or_url)
+            path_or_url = parsed.path + (f"?{parsed.query}" if parsed.query else "")
+        return self.base_url + path_or_url
+
+    def request(self, method, path, retries=None, **kwargs):
+        """
+        One HTTP call with the client's timeout; transport errors and 5xx
+        replies are retried `retries` times (default: the client's) with
+        exponential backoff. Returns the last response, or raises the last
+        transport error.
+        """
+        retries = self.retries if retries is None else retries
+        kwargs.setdefault("timeout", self.timeout)
+        url = self.url(path)
+        for attempt in range(retries + 1):
+            try:
+                resp = self.session.request(method, url, auth=self.auth, **kwargs)
+                if resp.status_code not in RETRY_STATUS or attempt == retries:
+                    return resp
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == retries:
+                    raise
+            time.sleep(self.backoff * 2 ** attempt)
+
+    def get_json(self, path, **params):
+        resp = self.request("GET", path, params=params or None)
+        resp.raise_for_status()
+        return resp.json()
+
+    # --- RAPID symbols ---
+    def symbol_url(self, name):
+        return self.symbol_path + name
+
+    def read_symbol(self, name):
+        """
+        Raw string value of a RAPID symbol (e.g. "TRUE", "3").
+        """
+        return rap_value(self.get_json(self.symbol_url(name), json=1))
+
+    def read_symbols(self, names):
+        """
+        Read several symbols at once, in parallel over the connection pool.
+        Returns name → value (None for a symbol that could not be read).
+        """
+        names = list(names)
+        if len(names) <= 1:
+            return {n: self._read_or_none(n) for n in names}
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.pool_size)
+        return dict(zip(names, self._pool.map(self._read_or_none, names)))
+
+    def _read_or_none(self, name):
+        try:
+            return self.read_symbol(name)
+        except (requests.RequestException, ValueError) as e:
+            print(f"Error reading {name}: {e}")
+            return None
+
+    def write_symbol(self, name, value):
+        """
+        Set a RAPID symbol; True if the controller accepted it (204).
+        """
+        resp = self.request("POST", self.symbol_url(name) + "?action=set",
+                            data={"value": str(value)},
+                            headers={"Content-Type": "application/x-www-form-urlencoded"})
+        if resp.status_code != 204:
+            print(f"Failed to set {name}: {resp.status_code}")
+            print(resp.text)
+        return resp.status_code == 204
+
+    # --- motion ---
+    def robtarget(self, tool=None, coordinate=None, mechunit="ROB_1"):
+        """
+        Current (x, y, z) of the mechanical unit.
+        """
+        params = {"json": 1}
+        if tool:
+            params["tool"] = tool
+        if coordinate:
+            params["coordinate"] = coordinate
+        data = self.get_json(f"/rw/motionsystem/mechunits/{mechunit}/robtarget", **params)
+        for target in data.get('_embedded', {}).get('_state', []):
+            return float(target['x']), float(target['y']), float(target['z'])
+        return None
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+        self.session.close()
@@ -1,41 +1,125 @@
 # stats_utils.py
 import numpy as np
-from heat      import simulate_heat, load_piece_bbox, compute_piece_avg_temp, visualize_slice
+from heat      import (simulate_heat_cropped, embed_in_plate, load_voxel_data,
+                       compute_piece_avg_temp, visualize_slice)
 from ABB_control import fetch_number_of_layer
-from calculate_cooling_time import get_cooling_time
+from calculate_cooling_time import get_cooling_time, now as clock_now
+from thermal_state import get_piece_state
+from geometry_analysis import geometry_cache_path, load_geometry_cache, save_geometry_cache
+from bbox_store import piece_bbox_path
 import json
 import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from metrics import timed
 # grid size & which pieces to process
 piece_ids = [1,2,3,4]
 nx, ny    = 400, 400
 
-def save_heat_stats(piece_ids, nx, ny, out_json=None):
+# geometry cache files already merged into this process
+_loaded_geometry = set()
+
+
+def _piece_heat_stats(pid, nx, ny, cool_time, incremental=False, full_plate_heatmap=False, persist_geometry=False,
+                      nz=None):
+    """
+    Simulate one piece and save its heatmap; returns its stats entry.
+    Top-level so it can run in a worker process (cool_time is measured by
+    the caller, since the print timers live in the parent process).
+    nz=None asks the controller for the piece's layer count.
+    """
+    bbox_path = piece_bbox_path(pid)
+    geometry_path = geometry_cache_path(bbox_path)
+    if persist_geometry and geometry_path not in _loaded_geometry:
+        load_geometry_cache(geometry_path)
+        _loaded_geometry.add(geometry_path)
+    url_nl    = (
+        "http://localhost/rw/rapid/symbol/data/"
+        "RAPID/T_ROB1/MainModule/"
+        f"number_of_layer_piece_{pid}?json=1"
+    )
+    if nz is None:
+        nz    = fetch_number_of_layer(url_nl)
+    if incremental:
+        now = clock_now()
+        state = get_piece_state(pid, nx, ny)
+        state.update(bbox_path, nz, deposited_at=now - cool_time, now=now)
+        # from the state's own voxels: the file's XY frame may differ from the one a layer was cached in
+        avg_temp = state.avg_temp()
+        heatmap, origin = state.heatmap()
+    else:
+        piece_bbox = load_voxel_data(bbox_path)
+        output, origin = simulate_heat_cropped(piece_bbox, nz, nx, ny, cool_time, steps_per_layer=1, piece=pid)
+        avg_temp, heatmap = compute_piece_avg_temp(output, piece_bbox, mask_heatmap=True, origin=origin)
+    if persist_geometry:
+        save_geometry_cache(geometry_path, piece_prefix=f"{pid}/")
+    if full_plate_heatmap and heatmap.shape[1:] != (ny, nx):
+        heatmap = embed_in_plate(heatmap, origin, nx, ny, fill=0.0)
+        origin = (0, 0)
+
+    heatmap_file = f"piece_{pid}_heatmap.npy"
+    np.save(heatmap_file, heatmap)
+
+    return {
+        "avg_temp":     avg_temp,
+        "cool_time":    cool_time,
+        "heatmap_file": heatmap_file,
+        "heatmap_origin": [int(origin[0]), int(origin[1])],
+        "nz":           nz,
+        "nx":           nx,
+        "ny":           ny,
+    }
+
+
+@timed("stage_seconds", stage="save_heat_stats")
+def save_heat_stats(piece_ids, nx, ny, out_json=None, incremental=False, full_plate_heatmap=False,
+                    workers=1, executor="thread", persist_geometry=False, layer_counts=None):
+    """
+    incremental=False re-simulates every piece from layer 0, on the piece's
+    own cropped domain.
+    incremental=True keeps a PieceThermalState per piece, which caches the
+    active voxels and geometry statistics of the layers already seen: only
+    new (or moved) layers are read and analysed. Temperatures are not
+    carried over; the field is evaluated again on the cached voxels, with
+    the same stats as the full simulation.
+    The saved heatmap covers the piece's domain only; its (y0, x0) offset on
+    the plate is stored as "heatmap_origin". full_plate_heatmap=True saves
+    the (nz, ny, nx) plate instead, as before.
+
+    persist_geometry=True also keeps each piece's per-layer geometry cache in
+    piece_{id}_bounding_boxes.geometry.json, so it survives restarts.
+
+    workers > 1 simulates the pieces concurrently and collects them as they
+    finish, with executor="thread" (NumPy, KDTree and HTTP release the GIL)
+    or "process". Results are identical to workers=1. The thermal states of
+    incremental mode live in this process, so it needs the thread executor.
+
+    layer_counts (piece id → nz) skips the controller lookups, e.g. offline.
+    """
+    if executor not in ("thread", "process"):
+        raise ValueError(f"Unknown executor {executor!r}, expected 'thread' or 'process'")
+    if incremental and executor == "process" and workers > 1:
+        raise ValueError("incremental=True keeps its state in this process; use executor='thread'")
+
+    cool_times = {pid: get_cooling_time(pid) for pid in piece_ids}
+    layer_counts = layer_counts or {}
     stats = {}
-    for pid in piece_ids:
-        bbox_path = f"piece_{pid}_bounding_boxes.json.gz"
-        cool_time = get_cooling_time(pid)
-        url_nl    = (
-            "http://localhost/rw/rapid/symbol/data/"
-            "RAPID/T_ROB1/MainModule/"
-            f"number_of_layer_piece_{pid}?json=1"
-        )        
-        cool_time = get_cooling_time(pid)        
-        nz        = fetch_number_of_layer(url_nl)
-        output = simulate_heat(bbox_path, nz, nx, ny, cool_time, steps_per_layer=1)
-        piece_bbox = load_piece_bbox(pid)
-        avg_temp, heatmap = compute_piece_avg_temp(output, piece_bbox, mask_heatmap=True)
-
-        heatmap_file = f"piece_{pid}_heatmap.npy"
-        np.save(heatmap_file, heatmap)
-
-        stats[pid] = {
-            "avg_temp":     avg_temp,
-            "cool_time":    cool_time,
-            "heatmap_file": heatmap_file,
-            "nz":           nz,
-            "nx":           nx,
-            "ny":           ny,
-        }
+    if workers <= 1 or len(piece_ids) <= 1:
+        for pid in piece_ids:
+            stats[pid] = _piece_heat_stats(pid, nx, ny, cool_times[pid], incremental, full_plate_heatmap, persist_geometry,
+                                           layer_counts.get(pid))
+    else:
+        pool_cls = ThreadPoolExecutor if executor == "thread" else ProcessPoolExecutor
+        with pool_cls(max_workers=min(workers, len(piece_ids))) as pool:
+            futures = {
+                pool.submit(_piece_heat_stats, pid, nx, ny, cool_times[pid], incremental, full_plate_heatmap,
+                            persist_geometry, layer_counts.get(pid)): pid
+                for pid in piece_ids
+            }
+            done = {}
+            for future in as_completed(futures):
+                done[futures[future]] = future.result()
+        # same key order as the sequential path
+        stats = {pid: done[pid] for pid in piece_ids}
 
 
     if out_json:
@@ -62,4 +146,53 @@ def display_stats(stats):
         # shape (nz, ny, nx)
 
         # 4) (Optional) visualize layer 0 of this piece:
-        visualize_slice(heatmap, z=0)
\ No newline at end of file
+        visualize_slice(heatmap, z=0)
+
+@timed("stage_seconds", stage="refresh_cooling_stats")
+def refresh_cooling_stats(stats, piece_ids):
+    """
+    Cheap update for idle pieces: bring each piece's thermal state to now
+    and refresh avg_temp / cool_time in `stats`. No file read, controller
+    round trip, heatmap write or field evaluation: the average of an idle
+    piece is a sum over its components (PieceThermalState.avg_temp_at).
+    Requires a previous save_heat_stats(..., incremental=True) call.
+    """
+    now = clock_now()
+    for pid in piece_ids:
+        info = stats[pid]
+        cool_time = get_cooling_time(pid)
+        state = get_piece_state(pid, info["nx"], info["ny"])
+        state.cool(now, deposited_at=now - cool_time)
+        info["avg_temp"]  = state.avg_temp()
+        info["cool_time"] = cool_time
+    return stats
+
+
+class NoPieceCools(RuntimeError):
+    """
+    Raised by time_until_cold: no piece is predicted to cool below the
+    threshold, so waiting for one would never end.
+    """
+
+
+@timed("stage_seconds", stage="time_until_cold")
+def time_until_cold(stats, piece_ids, threshold):
+    """
+    Seconds until the first of piece_ids cools below `threshold`, predicted
+    from the pieces' thermal states (as refresh_cooling_stats, it requires a
+    previous save_heat_stats(..., incremental=True) call). Returns
+    (seconds, piece id). Raises NoPieceCools if no piece gets there within
+    the prediction horizon, e.g. with T_init == T_amb, where idle time does
+    not lower the model's temperatures at all: the caller has to stop, not
+    wait.
+    """
+    now = clock_now()
+    best = None
+    for pid in piece_ids:
+        info = stats[pid]
+        wait = get_piece_state(pid, info["nx"], info["ny"]).time_to_temp(threshold, now)
+        if wait is not None and (best is None or wait < best[0]):
+            best = (wait, pid)
+    if best is None:
+        raise NoPieceCools(f"No piece of {list(piece_ids)} is predicted to cool below {threshold:g} °C")
+    return best
@@ -0,0 +1,59 @@
+import gzip
+import json
+import os
+import sys
+
+import pytest
+
+# the modules of Code/ import each other by bare name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import calculate_cooling_time
+from geometry_analysis import clear_geometry_cache
+from thermal_state import reset_piece_states
+
+
+def make_piece(shift=(0, 0), layers=3):
+    """
+    Small synthetic bbox content (label → str(z) → bounding_box / active_pixels):
+    a filled rectangle and a ring per layer, growing with z, moved by `shift`
+    pixels (as when the voxelizer re-normalizes the XY frame).
+    """
+    dx, dy = shift
+    piece = {"1": {}, "2": {}}
+    for z in range(layers):
+        w, h = 6 + z, 4 + z
+        rect = [[x, y] for x in range(w) for y in range(h)]
+        piece["1"][str(z)] = {"bounding_box": [[10 + dx, 12 + dy], [10 + dx + w - 1, 12 + dy + h - 1]],
+                              "active_pixels": rect}
+        ring = [[x, y] for x in range(5) for y in range(5) if x in (0, 4) or y in (0, 4)]
+        piece["2"][str(z)] = {"bounding_box": [[30 + dx + z, 8 + dy], [34 + dx + z, 12 + dy]],
+                              "active_pixels": ring}
+    return piece
+
+
+def write_piece(path, piece):
+    with gzip.open(path, "wt") as f:
+        json.dump(piece, f)
+    return str(path)
+
+
+@pytest.fixture(autouse=True)
+def fresh_caches():
+    # module-level caches and timers must not leak between tests
+    clear_geometry_cache()
+    reset_piece_states()
+    calculate_cooling_time.reset_timers()
+    yield
+    calculate_cooling_time.set_clock(None)
+    calculate_cooling_time.reset_timers()
+    reset_piece_states()
+    clear_geometry_cache()
+
+
+@pytest.fixture
+def rws():
+    # a local fake controller; clients point at rws.base_url
+    from mock_rws import MockRWS
+    with MockRWS() as server:
+        yield server
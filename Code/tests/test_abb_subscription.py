@@ -0,0 +1,41 @@
+from abb_subscription import SymbolWatcher
+
+
+def test_subscription_pushes_changes(rws):
+    rws.set_symbol("which_pieces", "3")
+    with SymbolWatcher(base=rws.base_url, mode="subscribe") as watcher:
+        assert watcher.active_mode == "subscribe"
+        assert watcher.piece() == 3 and not watcher.layer_finished()
+        since = watcher.version("layer_finished")
+        rws.set_symbol("layer_finished", "TRUE")
+        assert watcher.wait_for_change("layer_finished", since, timeout=5)
+        assert watcher.layer_finished()
+    assert rws.subscriptions == {}   # deleted on stop
+
+
+def test_event_during_the_initial_read_wins(rws):
+    watcher = SymbolWatcher(symbols=["layer_finished"], base=rws.base_url, mode="subscribe")
+    read = watcher._read_symbol
+
+    def stale_read(symbol):
+        # the value is read, then changes (and is pushed) before the read returns
+        value = read(symbol)
+        rws.set_symbol(symbol, "TRUE")
+        assert watcher.wait_for_change(symbol, 0, timeout=5)
+        return value
+
+    watcher._read_symbol = stale_read
+    with watcher:
+        assert watcher.get("layer_finished") == "TRUE"
+        assert watcher.version("layer_finished") == 1
+
+
+def test_falls_back_to_polling(rws):
+    rws.subscriptions_enabled = False
+    with SymbolWatcher(base=rws.base_url, mode="subscribe", poll_interval=0.01) as watcher:
+        assert watcher.active_mode == "poll"
+        assert watcher.get("wielding") == "FALSE"
+        since = watcher.version("wielding")
+        rws.set_symbol("wielding", "TRUE")
+        assert watcher.wait_for_change("wielding", since, timeout=5)
+        assert watcher.welding()
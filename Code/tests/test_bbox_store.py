@@ -0,0 +1,49 @@
+import numpy as np
+from scipy.ndimage import label
+
+from bbox_store import BBoxArchive, write_bbox_npz
+from heat import load_voxel_data
+from Voxel_grid import _extract_layer_bboxes_loop, extract_layer_bboxes, store_voxel_bounding_boxes
+
+
+def _labeled_grid(seed=0):
+    rng = np.random.default_rng(seed)
+    grid = rng.random((24, 20, 6)) < 0.2
+    labeled, _ = label(grid, structure=np.ones((3, 3, 3), dtype=bool))
+    return labeled
+
+
+def test_npz_matches_json(tmp_path):
+    labeled = _labeled_grid()
+    json_path, npz_path = str(tmp_path / "p.json.gz"), str(tmp_path / "p.npz")
+    store_voxel_bounding_boxes(labeled, voxel_dump=json_path)
+    store_voxel_bounding_boxes(labeled, voxel_dump=npz_path)
+    archive = load_voxel_data(npz_path)
+    assert isinstance(archive, BBoxArchive)
+    assert archive.to_dict() == load_voxel_data(json_path)
+
+
+def test_rewrite_keeps_open_archive(tmp_path):
+    path = str(tmp_path / "p.npz")
+    first = extract_layer_bboxes(_labeled_grid(1))
+    write_bbox_npz(path, first)
+    old = BBoxArchive(path)
+    before = old.to_dict()
+    assert isinstance(old.pixels, np.memmap)
+
+    write_bbox_npz(path, extract_layer_bboxes(_labeled_grid(2)))
+    # the open view let go of the replaced file and still reads what it was opened with
+    assert not isinstance(old._pixels, np.memmap)
+    assert old.to_dict() == before
+    assert BBoxArchive(path).to_dict() != before
+
+
+def test_single_pass_extraction_matches_loop():
+    labeled = _labeled_grid(3)
+    fast, loop = extract_layer_bboxes(labeled), _extract_layer_bboxes_loop(labeled)
+    assert len(fast) == len(loop) > 0
+    for (label, z, lo, hi, rel), (label_ref, z_ref, lo_ref, hi_ref, rel_ref) in zip(fast, loop):
+        assert (label, z) == (label_ref, z_ref)
+        np.testing.assert_array_equal(lo, lo_ref)
+        np.testing.assert_array_equal(hi, hi_ref)
+        np.testing.assert_array_equal(rel, rel_ref)   # same pixel order too
@@ -0,0 +1,91 @@
+import pytest
+
+import control_loop
+from conftest import make_piece
+from control_loop import PipelinedController
+from save_heat_stats import NoPieceCools
+from thermal_state import get_piece_state
+
+
+class FakeAgent:
+    temp_threshold = 400.0
+
+    def __init__(self):
+        self.updates = []
+        self.decisions = []
+
+    def encode_state(self, stats, active, layer_counts=None):
+        return tuple((pid, layer_counts[pid]) for pid in active)
+
+    def choose_action(self, state, valid):
+        self.decisions.append(state)
+        return min(valid, key=lambda pid: dict(state)[pid])   # least printed piece
+
+    def update(self, state, action, reward, next_state, next_valid):
+        self.updates.append((state, action, reward, next_state, list(next_valid)))
+
+    def decay_epsilon(self):
+        pass
+
+
+class FakeSnapshot:
+    def __init__(self, counts):
+        self.counts = counts
+
+    def layer_count(self, pid):
+        return self.counts[pid]
+
+    def layer_counts(self, pids):
+        return {pid: self.counts[pid] for pid in pids}
+
+
+def test_learning_steps_chain_decisions(monkeypatch):
+    counts = {1: 0, 2: 1, 3: 4}
+    snapshot = FakeSnapshot(counts)
+    printing = []
+
+    def print_layer(path=None, watcher=None):
+        counts[printing[-1]] += 1
+        return []
+
+    monkeypatch.setattr(control_loop, "set_piece_choice", printing.append)
+    monkeypatch.setattr(control_loop.fetch, "run_fetch_loop", print_layer)
+    monkeypatch.setattr(PipelinedController, "_process_layer", lambda self, pid, points, nz: None)
+
+    agent = FakeAgent()
+    piece_ids = [1, 2, 3]
+    stats = {pid: {"avg_temp": 0.0, "cool_time": 0.0, "nx": 40, "ny": 40} for pid in piece_ids}
+    controller = PipelinedController(agent, piece_ids, snapshot, layers_per_piece=3, layer_targets={3: 4},
+                                     stats=stats, nx=40, ny=40)
+    controller.run()
+
+    # piece 3 was complete from the start: it never shows up in a decision
+    assert 3 not in printing and all(3 not in dict(s) for s in agent.decisions)
+    assert counts == {1: 3, 2: 3, 3: 4}
+    # one learning step per printed layer, each on the state it was chosen in
+    assert [u[1] for u in agent.updates] == printing
+    for (state, action, _, next_state, _), (following, *_) in zip(agent.updates, agent.updates[1:]):
+        # the next state is the one the following choice was made in: one more layer on `action`
+        # (unless that layer completed it)
+        assert next_state == following
+        assert dict(next_state).get(action, 3) == dict(state)[action] + 1
+    assert agent.updates[-1][4] == []
+    assert controller.reward_history == [u[2] for u in agent.updates]
+
+
+def test_stops_when_no_piece_is_predicted_to_cool(monkeypatch):
+    def refresh(stats, piece_ids):
+        for pid in piece_ids:
+            stats[pid]["avg_temp"] = 500.0
+        return stats
+
+    monkeypatch.setattr(control_loop, "refresh_cooling_stats", refresh)
+    monkeypatch.setattr(control_loop.time, "sleep", lambda s: pytest.fail("slept without a predicted crossing"))
+    # the model never cools a piece below ambient: no crossing to wait for
+    get_piece_state(1, 40, 40).deposit_layers(make_piece(), 2, deposited_at=0.0)
+    agent = FakeAgent()
+    agent.temp_threshold = 10.0
+    stats = {1: {"avg_temp": 500.0, "cool_time": 0.0, "nx": 40, "ny": 40}}
+    controller = PipelinedController(agent, [1], FakeSnapshot({1: 2}), stats=stats, nx=40, ny=40)
+    with pytest.raises(NoPieceCools):
+        controller.decide_now()
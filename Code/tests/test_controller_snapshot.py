@@ -0,0 +1,68 @@
+import controller_snapshot
+from controller_snapshot import ControllerSnapshot
+
+
+class FakeRWS:
+    def __init__(self, values):
+        self.values = values
+        self.reads = 0
+
+    def read_symbols(self, names):
+        self.reads += 1
+        return {name: self.values.get(name) for name in names}
+
+
+class FakeWatcher:
+    def __init__(self):
+        self.versions = {"layer_finished": 0}
+
+    def version(self, name):
+        return self.versions[name]
+
+
+def _rws():
+    return FakeRWS({"number_of_layer_piece_1": "3", "number_of_layer_piece_2": "1", "which_pieces": "2"})
+
+
+def test_one_read_serves_every_consumer():
+    rws = _rws()
+    snapshot = ControllerSnapshot([1, 2], rws=rws)
+    assert snapshot.layer_counts() == {1: 3, 2: 1}
+    assert snapshot.layer_count(1) == 3
+    assert snapshot.current_piece() == 2
+    assert snapshot.layer_counts([2]) == {2: 1}
+    assert rws.reads == 1
+
+
+def test_layer_end_invalidates_the_snapshot():
+    rws, watcher = _rws(), FakeWatcher()
+    snapshot = ControllerSnapshot([1, 2], rws=rws, watcher=watcher)
+    assert snapshot.layer_count(2) == 1
+
+    rws.values["number_of_layer_piece_2"] = "2"
+    assert snapshot.layer_count(2) == 1            # same layer: still cached
+    watcher.versions["layer_finished"] += 1
+    assert snapshot.layer_count(2) == 2            # layer_finished changed: read again
+    assert rws.reads == 2
+
+    rws.values["number_of_layer_piece_1"] = "4"
+    snapshot.invalidate()                          # without a watcher, callers invalidate
+    assert snapshot.layer_counts() == {1: 4, 2: 2}
+    assert rws.reads == 3
+
+
+def test_ttl_and_missing_symbols(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(controller_snapshot.time, "monotonic", lambda: clock[0])
+    rws = FakeRWS({"number_of_layer_piece_1": "5"})
+    snapshot = ControllerSnapshot([1], rws=rws, ttl=30.0)
+    assert snapshot.layer_count(1) == 5
+    assert snapshot.current_piece() == 0           # which_pieces not readable: 0
+    clock[0] += 29.0
+    snapshot.layer_counts()
+    assert rws.reads == 1
+    clock[0] += 2.0                                # older than the TTL
+    snapshot.layer_counts()
+    assert rws.reads == 2
+    assert snapshot.layer_count(3) == 0            # unknown piece: added and read, 0 if missing
+    assert rws.reads == 3 and snapshot.refreshes == 3
@@ -0,0 +1,56 @@
+import copy
+
+import numpy as np
+import pytest
+
+from conftest import make_piece, write_piece
+from thermal_state import PieceThermalState
+
+
+def _overlapping_piece():
+    # a third component sharing pixels with the rectangle in every layer
+    piece = make_piece(layers=3)
+    piece["3"] = copy.deepcopy(piece["1"])
+    for layer in piece["3"].values():
+        layer["active_pixels"] = layer["active_pixels"][::2]
+    return piece
+
+
+@pytest.mark.parametrize("T_init", [20.0, 80.0])
+@pytest.mark.parametrize("piece", [make_piece(layers=3), _overlapping_piece()], ids=["disjoint", "overlapping"])
+def test_idle_average_matches_field(T_init, piece):
+    state = PieceThermalState(1, 64, 48, T_init=T_init)
+    state.deposit_layers(piece, 3, deposited_at=0.0)
+    state._flatten()
+    voxels = state._flat["voxels"]
+    for t in (0.0, 0.5, 3.0, 40.0, 600.0):
+        assert state._field_cache is None or state._field_cache[0] != t
+        avg = state.avg_temp_at(t)
+        assert state._field_cache is None or state._field_cache[0] != t   # no field built for it
+        assert avg == pytest.approx(float(np.mean(state._field(t).ravel()[voxels])), rel=1e-12)
+
+
+def test_time_to_temp_matches_stepping(tmp_path):
+    path = write_piece(tmp_path / "piece.json.gz", make_piece(layers=3))
+    state = PieceThermalState(1, 64, 48, T_init=80.0)
+    state.update(path, 3, deposited_at=0.0, now=0.0)
+    start = state.avg_temp()
+    threshold = start - 40.0
+
+    # first whole idle second below the threshold, one prediction per second
+    t = 0
+    while state.avg_temp_at(t) >= threshold:
+        t += 1
+    wait = state.time_to_temp(threshold, now=0.0, tol=0.01)
+    assert t - 1 < wait <= t
+    assert state.avg_temp_at(wait) < threshold <= state.avg_temp_at(wait - 0.01)
+    assert state.avg_temp() == start   # prediction only
+
+
+def test_time_to_temp_without_idle_losses(tmp_path):
+    # T_init == T_amb: the loss terms vanish and idle time never changes the field
+    path = write_piece(tmp_path / "piece.json.gz", make_piece(layers=2))
+    state = PieceThermalState(1, 64, 48)
+    state.update(path, 2, deposited_at=0.0, now=0.0)
+    assert state.time_to_temp(state.avg_temp() + 1.0, now=0.0) == 0.0
+    assert state.time_to_temp(state.avg_temp() - 1.0, now=0.0) is None
@@ -0,0 +1,61 @@
+import json
+import threading
+
+import pytest
+
+import fetch
+
+
+@pytest.fixture
+def robot(monkeypatch):
+    """
+    Fake controller reads: the robot welds `path` point by point and
+    finishes the layer on the fifth layer_finished read.
+    """
+    path = iter([(float(i), 0.0, 1.0) for i in range(100)])
+    state = {"layer_reads": 0, "pause": []}
+
+    def fetch_layer():
+        state["layer_reads"] += 1
+        return state["layer_reads"] >= 5
+
+    monkeypatch.setattr(fetch, "fetch_xyz", lambda: next(path))
+    monkeypatch.setattr(fetch, "fetch_welding", lambda: True)
+    monkeypatch.setattr(fetch, "fetch_pieces_being_print", lambda: 2)
+    monkeypatch.setattr(fetch, "fetch_layer", fetch_layer)
+    monkeypatch.setattr(fetch, "set_pause_printing", state["pause"].append)
+    return state
+
+
+def test_sampler_issues_the_reads_at_once(monkeypatch):
+    # each read waits for the other three: only a concurrent sample gets through
+    barrier = threading.Barrier(4, timeout=5)
+
+    def read(value):
+        def f():
+            barrier.wait()
+            return value
+        return f
+
+    monkeypatch.setattr(fetch, "fetch_xyz", read((1.0, 2.0, 3.0)))
+    monkeypatch.setattr(fetch, "fetch_welding", read(True))
+    monkeypatch.setattr(fetch, "fetch_pieces_being_print", read(3))
+    monkeypatch.setattr(fetch, "fetch_layer", read(False))
+    sampler = fetch.ConcurrentSampler()
+    try:
+        t, *values = sampler.sample()
+    finally:
+        sampler.close()
+    assert values == [(1.0, 2.0, 3.0), True, 3, False]
+
+
+@pytest.mark.parametrize("concurrent", [True, False])
+def test_fetch_loop_records_the_layer(robot, tmp_path, concurrent):
+    path = str(tmp_path / "points.json")
+    points = fetch.run_fetch_loop(path, concurrent=concurrent)
+    assert points == [(float(i), 0.0, 1.0) for i in range(5)]
+    assert robot["pause"] == [False, True]
+    assert fetch.current_piece == 2 and fetch.sample_stats["samples"] == 5
+    assert len(fetch.sample_times) == 5 and fetch.sample_times == sorted(fetch.sample_times)
+    with open(path) as f:
+        assert json.load(f) == [list(p) for p in points]
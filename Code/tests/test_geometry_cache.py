@@ -0,0 +1,72 @@
+import json
+import sys
+import threading
+
+import numpy as np
+
+import geometry_analysis
+from geometry_analysis import (analyze_geometry, cached_analyze_geometry, clear_geometry_cache,
+                               load_geometry_cache, save_geometry_cache)
+
+
+def layer_pixels(seed, n=40):
+    rng = np.random.default_rng(seed)
+    return np.unique(rng.integers(0, 20, size=(n, 2)), axis=0)
+
+
+def test_cached_stats_equal_analyze_geometry():
+    pixels = layer_pixels(0)
+    assert cached_analyze_geometry(pixels, [20, 20], piece="1/1", layer=0) == analyze_geometry(pixels, [20, 20])
+    assert len(geometry_analysis._geometry_cache) == 1
+    cached_analyze_geometry(pixels.copy(), [20, 20], piece="1/1", layer=0)
+    assert len(geometry_analysis._geometry_cache) == 1
+
+
+def test_save_load_round_trip(tmp_path):
+    path = str(tmp_path / "piece_1_bounding_boxes.geometry.json")
+    for z in range(3):
+        cached_analyze_geometry(layer_pixels(z), [20, 20], piece="1/1", layer=z)
+    cached_analyze_geometry(layer_pixels(9), [20, 20], piece="2/1", layer=0)
+    before = dict(geometry_analysis._geometry_cache)
+
+    assert save_geometry_cache(path, piece_prefix="1/") == 3
+    clear_geometry_cache()
+    assert load_geometry_cache(path) == 3
+    for key, stats in geometry_analysis._geometry_cache.items():
+        assert stats == {k: float(v) if not isinstance(v, int) else v for k, v in before[key].items()}
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_save_while_workers_insert(tmp_path):
+    path = str(tmp_path / "cache.geometry.json")
+    stop = threading.Event()
+    errors = []
+
+    def worker(offset):
+        for z in range(300):
+            if stop.is_set():
+                break
+            cached_analyze_geometry(layer_pixels(offset + z, n=8), [20, 20], piece=f"{offset}/1", layer=z)
+
+    def saver():
+        try:
+            for _ in range(20):
+                save_geometry_cache(path)
+                with open(path) as f:
+                    json.load(f)   # never a truncated file
+        except Exception as e:   # RuntimeError: dictionary changed size during iteration
+            errors.append(e)
+        finally:
+            stop.set()
+
+    threads = [threading.Thread(target=worker, args=(1000 * i,)) for i in range(4)] + [threading.Thread(target=saver)]
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)   # switch threads often enough to hit the race
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert not errors
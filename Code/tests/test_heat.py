@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from conftest import make_piece
+from heat import HEAT_BACKENDS, compute_piece_avg_temp, embed_in_plate, simulate_heat_cropped
+
+NX, NY = 48, 40
+
+
+@pytest.mark.parametrize("shift", [(0, 0), (-10, -12)])   # the second piece touches the plate edge
+@pytest.mark.parametrize("T_init", [20.0, 80.0])
+def test_vectorized_matches_loop(shift, T_init):
+    piece = make_piece(shift, layers=4)
+    args = (piece, 4, NX, NY, 120.0, T_init, 20.0, 660.0, 1.0, 2)
+    np.testing.assert_allclose(HEAT_BACKENDS["vectorized"](*args), HEAT_BACKENDS["loop"](*args),
+                               rtol=1e-12, atol=1e-9)
+
+
+@pytest.mark.parametrize("shift", [(0, 0), (-10, -12)])
+@pytest.mark.parametrize("T_init", [20.0, 80.0])
+def test_sparse_matches_loop(shift, T_init):
+    piece = make_piece(shift, layers=4)
+    args = (piece, 4, NX, NY, 120.0, T_init, 20.0, 660.0, 1.0, 2)
+    np.testing.assert_allclose(HEAT_BACKENDS["sparse"](*args), HEAT_BACKENDS["loop"](*args),
+                               rtol=1e-12, atol=1e-9)
+
+
+@pytest.mark.parametrize("shift", [(0, 0), (-10, -12)])
+def test_cropped_domain_matches_full_plate(shift):
+    piece = make_piece(shift, layers=4)
+    T, origin = simulate_heat_cropped(piece, 4, NX, NY, 120.0, T_init=80.0)
+    full = HEAT_BACKENDS["loop"](piece, 4, NX, NY, 120.0, 80.0, 20.0, 660.0, 1.0, 1)
+    np.testing.assert_allclose(embed_in_plate(T, origin, NX, NY, 80.0), full, rtol=1e-12, atol=1e-9)
+
+    avg, heatmap = compute_piece_avg_temp(T, piece, mask_heatmap=True, origin=origin)
+    full_avg, full_heatmap = compute_piece_avg_temp(full, piece, mask_heatmap=True)
+    assert avg == pytest.approx(full_avg, rel=1e-12)
+    np.testing.assert_allclose(embed_in_plate(heatmap, origin, NX, NY, 0.0), full_heatmap, rtol=1e-12, atol=1e-9)
+
+
+@pytest.mark.parametrize("backend", sorted(HEAT_BACKENDS))
+def test_no_layers_gives_an_empty_field(backend):
+    # fetch_number_of_layer reports 0 layers on any error
+    T = HEAT_BACKENDS[backend](make_piece(), 0, NX, NY, 0.0, 20.0, 20.0, 660.0, 1.0, 1)
+    assert T.shape == (0, NY, NX)
@@ -0,0 +1,81 @@
+import json
+import re
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def collecting():
+    metrics.reset()
+    metrics.enable()
+    yield
+    metrics.disable()
+    metrics.reset()
+
+
+@metrics.timed("work_seconds", step="demo")
+def _work(fail=False):
+    if fail:
+        raise ValueError("boom")
+    return 42
+
+
+def test_disabled_records_nothing():
+    metrics.reset()
+    metrics.count("events_total")
+    metrics.observe("latency_seconds", 0.1)
+    with metrics.timer("block_seconds"):
+        pass
+    assert _work() == 42
+    snap = metrics.snapshot()
+    assert snap["counters"] == {} and snap["histograms"] == {}
+
+
+def test_timed_observes_calls_and_counts_errors(collecting):
+    assert _work() == 42
+    with pytest.raises(ValueError):
+        _work(fail=True)
+    snap = metrics.snapshot()
+    hist = snap["histograms"]['work_seconds{step="demo"}']
+    assert hist["count"] == 2 and hist["buckets"]["+Inf"] == 2
+    assert snap["counters"] == {'work_seconds_errors_total{step="demo"}': 1}
+
+
+def test_prometheus_text_format(collecting):
+    metrics.count("rws_requests_total", call="fetch_xyz")
+    metrics.count("rws_requests_total", 2, call="fetch_layer")
+    for value in (0.0007, 0.003, 0.2, 100.0):
+        metrics.observe("rws_request_seconds", value, call="fetch_xyz", host="a")
+    lines = metrics.prometheus_text().splitlines()
+
+    sample = re.compile(r'^[a-z_]+(\{([a-z_]+="[^"]*",?)+\})? \S+$')
+    assert all(line.startswith("# TYPE ") or sample.match(line) for line in lines)
+    assert lines[:3] == ["# TYPE rws_requests_total counter",
+                         'rws_requests_total{call="fetch_layer"} 2',
+                         'rws_requests_total{call="fetch_xyz"} 1']
+    assert lines[3] == "# TYPE rws_request_seconds histogram"
+    buckets = [line for line in lines if line.startswith("rws_request_seconds_bucket")]
+    # labels sorted by name, `le` last; cumulative counts ending at +Inf
+    assert buckets[0] == f'rws_request_seconds_bucket{{call="fetch_xyz",host="a",le="{metrics.BUCKETS[0]}"}} 0'
+    counts = [int(line.rsplit(" ", 1)[1]) for line in buckets]
+    assert counts == sorted(counts) and len(counts) == len(metrics.BUCKETS) + 1
+    assert buckets[-1] == 'rws_request_seconds_bucket{call="fetch_xyz",host="a",le="+Inf"} 4'
+    assert 'rws_request_seconds_count{call="fetch_xyz",host="a"} 4' in lines
+    total = float(next(line for line in lines if line.startswith("rws_request_seconds_sum")).rsplit(" ", 1)[1])
+    assert total == pytest.approx(100.2037)
+
+
+def test_export_appends_jsonl_and_replaces_prom(collecting, tmp_path):
+    jsonl, prom = str(tmp_path / "m.jsonl"), str(tmp_path / "m.prom")
+    metrics.count("layers_total")
+    metrics.export(jsonl, prom)
+    metrics.count("layers_total")
+    metrics.export(jsonl, prom)
+    with open(jsonl) as f:
+        rows = [json.loads(line) for line in f]
+    assert [row["counters"]["layers_total"] for row in rows] == [1, 2]
+    with open(prom) as f:
+        assert f.read() == "# TYPE layers_total counter\nlayers_total 2\n"
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["m.jsonl", "m.prom"]
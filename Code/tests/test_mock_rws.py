@@ -0,0 +1,58 @@
+import time
+
+import numpy as np
+import requests
+
+from mock_rws import ROBTARGET_PATH, SYMBOL_PREFIX, MockRWS
+
+
+def _get(rws, name):
+    data = requests.get(rws.base_url + SYMBOL_PREFIX + name, params={"json": 1}, timeout=2).json()
+    return data["_embedded"]["_state"][0]["value"]
+
+
+def _set(rws, name, value):
+    resp = requests.post(rws.base_url + SYMBOL_PREFIX + name + "?action=set", data={"value": value}, timeout=2)
+    assert resp.status_code == 204
+
+
+def _wait(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def _points(n, z):
+    return np.array([[float(i), 1.0, z] for i in range(n)])
+
+
+def test_unpausing_replays_the_chosen_piece():
+    layers = {1: [_points(3, 0.0), _points(2, 1.0)], 2: [_points(4, 0.0)]}
+    with MockRWS(layers=layers, rate=1000.0) as rws:
+        assert _get(rws, "number_of_layer_piece_2") == "0"
+        _set(rws, "piece_choice", "2")
+        _set(rws, "pause_printing", "FALSE")
+        _wait(lambda: rws.get_symbol("layer_finished") == "TRUE")
+        assert _get(rws, "number_of_layer_piece_2") == "1" and _get(rws, "which_pieces") == "2"
+        assert _get(rws, "wielding") == "FALSE"
+        x = requests.get(rws.base_url + ROBTARGET_PATH, timeout=2).json()["_embedded"]["_state"][0]["x"]
+        assert float(x) == 3.0
+
+        # piece 2 is done: the next un-pause falls back to the first remaining piece
+        _set(rws, "pause_printing", "TRUE")
+        _set(rws, "pause_printing", "FALSE")
+        _wait(lambda: len(rws.stats()["layers"]) == 2)
+        first, second = rws.stats()["layers"]
+        assert (first["piece"], first["layer"], first["points"]) == (2, 1, 4)
+        assert (second["piece"], second["layer"], second["points"]) == (1, 1, 3)
+        assert second["total"] == 0   # no HTTP while it printed
+
+
+def test_unknown_symbol_and_digest_challenge():
+    with MockRWS(digest=True) as rws:
+        resp = requests.get(rws.base_url + SYMBOL_PREFIX + "which_pieces", params={"json": 1}, timeout=2)
+        assert resp.status_code == 401 and resp.headers["WWW-Authenticate"].startswith("Digest ")
+        auth = requests.auth.HTTPDigestAuth("Default User", "robotics")
+        assert requests.get(rws.base_url + SYMBOL_PREFIX + "no_such_symbol", auth=auth, timeout=2).status_code == 400
+        assert rws.stats()["counts"]["401"] == 2 and rws.stats()["counts"]["which_pieces"] == 1
@@ -0,0 +1,62 @@
+import json
+
+import numpy as np
+
+from point_log import (RECORD_DTYPE, DepositionLog, convert_json_log, iter_layers, layer_points, load_layers,
+                       log_points, read_log)
+
+
+def _layer(n, z):
+    return [(float(i), float(2 * i), float(z)) for i in range(n)]
+
+
+def test_round_trip_across_chunks(tmp_path):
+    path = str(tmp_path / "piece_1.bin")
+    layers = [_layer(5, 0.0), _layer(3, 1.0)]
+    with DepositionLog(path, chunk=2) as log:
+        for points in layers:
+            log.begin_layer()
+            for i, xyz in enumerate(points):
+                log.append(xyz, t=float(i))
+    records = read_log(path)
+    assert len(records) == 8 and records["t"][4] == 4.0
+    assert np.array_equal(log_points(path), np.array(layers[0] + layers[1]))
+    assert np.array_equal(layer_points(path, 0), np.array(layers[0]))
+    assert np.array_equal(layer_points(path), np.array(layers[1]))
+    assert [(layer, len(points)) for layer, points in iter_layers(path)] == [(0, 5), (1, 3)]
+
+
+def test_reopen_continues_numbering_and_drops_a_torn_record(tmp_path):
+    path = str(tmp_path / "piece_1.bin")
+    with DepositionLog(path) as log:
+        log.begin_layer()
+        log.append((1.0, 2.0, 3.0))
+    with open(path, "ab") as f:
+        f.write(b"\0" * (RECORD_DTYPE.itemsize // 2))   # crash mid-write
+    assert len(read_log(path)) == 1
+
+    with DepositionLog(path) as log:
+        assert log.begin_layer() == 1
+        log.append((4.0, 5.0, 6.0))
+    assert [layer for layer, _ in iter_layers(path)] == [0, 1]
+    assert np.array_equal(log_points(path), [[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]])
+
+
+def test_empty_log_reads_empty(tmp_path):
+    path = str(tmp_path / "piece_1.bin")
+    DepositionLog(path).close()
+    assert log_points(path).shape == (0, 3) and layer_points(path).shape == (0, 3)
+    assert list(iter_layers(path)) == []
+
+
+def test_legacy_json_layers_from_z(tmp_path):
+    points = _layer(4, 0.0) + _layer(2, 1.2) + _layer(3, 2.5)
+    json_path = str(tmp_path / "piece_1.json")
+    with open(json_path, "w") as f:
+        json.dump([list(p) for p in points], f)
+    assert [len(layer) for layer in load_layers(json_path)] == [4, 2, 3]
+
+    log_path = str(tmp_path / "piece_1.bin")
+    assert convert_json_log(json_path, log_path) == 9
+    assert [len(layer) for layer in load_layers(log_path)] == [4, 2, 3]
+    assert np.array_equal(log_points(log_path), np.array(points))
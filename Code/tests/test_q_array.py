@@ -0,0 +1,85 @@
+import os
+import random
+
+import numpy as np
+
+from q_agent import QAgent
+from q_array import ArrayQTable
+
+
+def _random_state(rng, pieces):
+    return tuple((rng.randrange(0, 60), rng.randrange(0, 300), rng.randrange(0, 12)) for _ in range(pieces))
+
+
+def _train(table, steps=2000, seed=0):
+    agent = QAgent(table=table, actions=[1, 2, 3, 4])
+    rng = random.Random(seed)
+    states = [_random_state(rng, rng.randint(1, 4)) for _ in range(50)]
+    random.seed(seed)   # exploration in choose_action
+    state = states[0]
+    for _ in range(steps):
+        valid = rng.sample([1, 2, 3, 4], rng.randint(1, 4))
+        action = agent.choose_action(state, valid)
+        next_state = rng.choice(states)
+        agent.update(state, action, rng.uniform(-6, 4), next_state, rng.sample([1, 2, 3, 4], rng.randint(0, 4)))
+        state = next_state
+    return agent
+
+
+def test_array_table_matches_dict():
+    as_dict, as_array = _train("dict"), _train("array")
+    assert as_array.q_table.to_dict() == as_dict.q_table
+    for (state, action), value in as_dict.q_table.items():
+        assert as_array.q_table.get((state, action), 0.0) == value
+
+
+def test_bins_outside_the_radices_stay_distinct(tmp_path):
+    table = ArrayQTable(actions=[1])
+    table[(((1, 2, 3),), 1)] = 1.0
+    table[(((1, 2, 1023), (5, 4095, 0)), 1)] = 2.0
+    bins = table.bins
+    # outside the default radices: own rows, not clipped onto the states above
+    assert table.get((((1, 2, 1024), (5, 4095, 0)), 1)) is None
+    assert table.values(((-1, 0, 0),), [1]) == [0.0]
+    assert table.n_rows == 2 and table.bins == bins   # reads leave the table alone
+    table[(((1, 2, 1024), (5, 4095, 0)), 1)] = 3.0
+    table[(((1, 2, 1023), (5, 4096, 0)), 1)] = 4.0
+    table[(((300, 2, 5000),), 1)] = 5.0
+    table[(((-24203, 29, 1),), 1)] = 6.0
+    table[(((-1, 0, 0), (0, 0, 0)), 1)] = 7.0
+    expected = {
+        (((1, 2, 3),), 1): 1.0,
+        (((1, 2, 1023), (5, 4095, 0)), 1): 2.0,
+        (((1, 2, 1024), (5, 4095, 0)), 1): 3.0,
+        (((1, 2, 1023), (5, 4096, 0)), 1): 4.0,
+        (((300, 2, 5000),), 1): 5.0,
+        (((-24203, 29, 1),), 1): 6.0,
+        (((-1, 0, 0), (0, 0, 0)), 1): 7.0,
+    }
+    assert table.bins == bins and table.to_dict() == expected
+    assert table.get((((-24203, 29, 1),), 1)) == 6.0
+
+    table.save(str(tmp_path / "q"))
+    loaded = ArrayQTable.load(str(tmp_path / "q"))
+    assert loaded.to_dict() == expected
+    for (state, action), value in expected.items():
+        assert loaded.get((state, action)) == value
+
+
+def test_save_over_loaded_directory(tmp_path):
+    path = str(tmp_path / "q_table_array")
+    agent = _train("array", steps=300)
+    agent.save(path)
+
+    loaded = QAgent(table="array", actions=[1, 2, 3, 4])
+    loaded.load(path)
+    assert isinstance(loaded.q_table.q, np.memmap)
+    state, action = next(iter(loaded.q_table.to_dict()))
+    loaded.q_table[(state, action)] = 42.0   # copy-on-write: still mapped
+    assert isinstance(loaded.q_table.q, np.memmap)
+    expected = loaded.q_table.to_dict()
+    loaded.save(path)   # over the directory it is mapped from
+
+    assert sorted(os.listdir(tmp_path)) == ["q_table_array"]
+    assert ArrayQTable.load(path).to_dict() == expected
+    assert loaded.q_table.to_dict() == expected
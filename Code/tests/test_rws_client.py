@@ -0,0 +1,47 @@
+from mock_rws import MockRWS
+from rws_client import RWSClient
+
+SYMBOLS = {f"number_of_layer_piece_{pid}": str(pid) for pid in range(1, 7)}
+
+
+def _connections(client):
+    # TCP connections opened by the session, over all its pools
+    pools = client.session.get_adapter(client.base_url).poolmanager.pools
+    return sum(pools[key].num_connections for key in pools.keys())
+
+
+def test_digest_challenge_is_answered_once_for_every_thread():
+    with MockRWS(symbols=SYMBOLS, digest=True) as rws:
+        client = RWSClient(rws.base_url)
+        assert client.read_symbol("number_of_layer_piece_1") == "1"
+        assert rws.stats()["counts"]["401"] == 1
+        # the pool's worker threads reuse the nonce instead of each taking a 401
+        assert client.read_symbols(SYMBOLS) == SYMBOLS
+        assert client.read_symbols(SYMBOLS) == SYMBOLS
+        assert rws.stats()["counts"]["401"] == 1
+        client.close()
+
+
+def test_sequential_calls_share_one_connection(rws):
+    client = RWSClient(rws.base_url)
+    for _ in range(20):
+        assert client.read_symbol("which_pieces") == "1"
+    assert client.write_symbol("piece_choice", 3)
+    assert client.read_symbol("piece_choice") == "3"
+    assert _connections(client) == 1
+    client.close()
+
+
+def test_server_errors_are_retried(rws):
+    rws.subscriptions_enabled = False   # POST /subscription answers 503
+    client = RWSClient(rws.base_url, retries=2, backoff=0.0)
+    assert client.request("POST", "/subscription", data={"resources": "1"}).status_code == 503
+    assert rws.stats()["counts"]["subscription"] == 3
+    client.close()
+
+
+def test_absolute_urls_keep_only_path_and_query():
+    client = RWSClient("http://10.0.0.5:8080/")
+    url = "http://localhost/rw/rapid/symbol/data/RAPID/T_ROB1/MainModule/wielding?json=1"
+    assert client.url(url) == "http://10.0.0.5:8080/rw/rapid/symbol/data/RAPID/T_ROB1/MainModule/wielding?json=1"
+    client.close()
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from conftest import make_piece, write_piece
+from q_agent import QAgent
+from thermal_env import ThermalPrintEnv, build_cooling_curves, run_episode
+from thermal_state import PieceThermalState
+
+NX, NY = 64, 48
+
+
+def test_env_temperatures_match_thermal_state(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_piece(tmp_path / "piece_1_bounding_boxes.json.gz", make_piece(layers=3))
+    curves = build_cooling_curves([1], NX, NY, max_layers=5)
+    env = ThermalPrintEnv([1], curves=curves, layer_durations={1: [40.0]}, layer_targets={1: 5},
+                          temp_threshold=1e9, bind_timers=False)
+    env.reset()
+
+    state = PieceThermalState(1, NX, NY)
+    state.deposit_layers(make_piece(layers=3), 1, deposited_at=0.0)
+    assert env.avg_temp(1, env.clock() + 30.0) == pytest.approx(state.avg_temp_at(30.0), rel=1e-12)
+    for layers in (2, 3):
+        env.step(1)
+        state.deposit_layers(make_piece(layers=3), layers, deposited_at=0.0)
+        assert env.avg_temp(1) == pytest.approx(state.avg_temp_at(0.0), rel=1e-12)
+
+
+def test_env_stalls_when_nothing_can_cool(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for pid in (1, 2):
+        write_piece(tmp_path / f"piece_{pid}_bounding_boxes.json.gz", make_piece(layers=2))
+    env = ThermalPrintEnv([1, 2], curves=build_cooling_curves([1, 2], NX, NY, max_layers=3),
+                          layer_durations={}, layer_targets={1: 3, 2: 3}, temp_threshold=0.0, bind_timers=False)
+    obs = env.reset()
+    assert env.stalled and not obs["active"]
+
+
+def test_run_episode_reports_stall(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_piece(tmp_path / "piece_1_bounding_boxes.json.gz", make_piece(layers=2))
+    env = ThermalPrintEnv([1], curves=build_cooling_curves([1], NX, NY, max_layers=3),
+                          layer_durations={}, layer_targets={1: 3}, temp_threshold=0.0, bind_timers=False)
+    agent = QAgent(actions=[1], temp_threshold=0.0)
+    total, _, steps, stalled = run_episode(agent, env)
+    assert stalled and steps == 0 and total == 0.0
+
+
+def test_curves_cool_when_deposited_above_ambient(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_piece(tmp_path / "piece_1_bounding_boxes.json.gz", make_piece(layers=2))
+    flat = build_cooling_curves([1], NX, NY, max_layers=2, points=16)[1]["avg"]
+    warm = build_cooling_curves([1], NX, NY, max_layers=2, points=16, T_init=80.0)[1]["avg"]
+    assert (flat == flat[:, :1]).all()
+    assert (np.diff(warm, axis=1) <= 0).all() and (warm[:, -1] < warm[:, 0]).all()
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+import calculate_cooling_time
+from conftest import make_piece, write_piece
+from heat import compute_piece_avg_temp, embed_in_plate, simulate_heat_cropped
+from save_heat_stats import save_heat_stats
+from thermal_state import PieceThermalState
+
+NX, NY = 64, 48
+
+
+def full_stats(piece, nz, cool_time, **kwargs):
+    T, origin = simulate_heat_cropped(piece, nz, NX, NY, cool_time, piece=1, **kwargs)
+    avg, heatmap = compute_piece_avg_temp(T, piece, mask_heatmap=True, origin=origin)
+    return avg, embed_in_plate(heatmap, origin, NX, NY, fill=0.0)
+
+
+@pytest.mark.parametrize("T_init", [20.0, 80.0])
+def test_incremental_state_matches_full_simulation(tmp_path, T_init):
+    path = write_piece(tmp_path / "piece.json.gz", make_piece(layers=3))
+    state = PieceThermalState(1, NX, NY, T_init=T_init)
+    for nz in (1, 2, 3, 5, 2):
+        for cool_time in (0.0, 0.4, 3.0):
+            state.update(path, nz, deposited_at=10.0 - cool_time, now=10.0)
+            avg, heatmap = full_stats(make_piece(layers=3), nz, cool_time, T_init=T_init)
+            assert state.avg_temp() == pytest.approx(avg, rel=1e-12)
+            inc_heatmap, origin = state.heatmap()
+            np.testing.assert_allclose(embed_in_plate(inc_heatmap, origin, NX, NY, fill=0.0), heatmap, rtol=1e-12)
+
+
+def test_moved_layers_are_read_again(tmp_path):
+    path = tmp_path / "piece.json.gz"
+    state = PieceThermalState(1, NX, NY)
+    state.update(write_piece(path, make_piece(layers=2)), 2, deposited_at=0.0, now=0.0)
+
+    # the next layer widens the piece: the voxelizer shifts every earlier layer
+    moved = make_piece(shift=(3, -2), layers=3)
+    state.update(write_piece(path, moved), 3, deposited_at=0.0, now=0.0)
+    avg, heatmap = full_stats(moved, 3, 0.0)
+    assert state.avg_temp() == pytest.approx(avg, rel=1e-12)
+    inc_heatmap, origin = state.heatmap()
+    np.testing.assert_array_equal(embed_in_plate(inc_heatmap, origin, NX, NY, fill=0.0), heatmap)
+
+
+def test_save_heat_stats_incremental_matches_full(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    clock = [0.0]
+    calculate_cooling_time.set_clock(lambda: clock[0])
+    for pid in (1, 2):
+        write_piece(tmp_path / f"piece_{pid}_bounding_boxes.json.gz", make_piece(shift=(pid, 0), layers=4))
+        calculate_cooling_time.start_print(pid)
+        clock[0] += 5.0
+        calculate_cooling_time.end_print(pid)
+
+    for nz, wait in ((1, 0.0), (2, 12.0), (4, 30.0)):
+        clock[0] += wait
+        counts = {1: nz, 2: max(1, nz - 1)}
+        full = save_heat_stats([1, 2], NX, NY, layer_counts=counts)
+        inc = save_heat_stats([1, 2], NX, NY, incremental=True, layer_counts=counts)
+        for pid in (1, 2):
+            assert inc[pid]["avg_temp"] == pytest.approx(full[pid]["avg_temp"], rel=1e-12)
+            assert inc[pid]["cool_time"] == full[pid]["cool_time"]
+
+
+@pytest.mark.parametrize("incremental, executor", [(False, "thread"), (False, "process"), (True, "thread")])
+def test_concurrent_save_heat_stats_matches_sequential(tmp_path, monkeypatch, incremental, executor):
+    monkeypatch.chdir(tmp_path)
+    pieces = (1, 2, 3, 4)
+    for pid in pieces:
+        write_piece(tmp_path / f"piece_{pid}_bounding_boxes.json.gz", make_piece(shift=(2 * pid, pid), layers=3))
+    counts = {pid: 1 + pid % 3 for pid in pieces}
+    sequential = save_heat_stats(list(pieces), NX, NY, incremental=incremental, layer_counts=counts)
+    concurrent = save_heat_stats(list(pieces), NX, NY, incremental=incremental, layer_counts=counts,
+                                 workers=4, executor=executor)
+    assert list(concurrent) == list(pieces)
+    for pid in pieces:
+        assert concurrent[pid]["avg_temp"] == sequential[pid]["avg_temp"]
+        assert concurrent[pid]["cool_time"] == sequential[pid]["cool_time"]
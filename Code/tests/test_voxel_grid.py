@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from filter_outliers import filter_points_by_layer
+from Voxel_grid import IncrementalVoxelGrid, process_voxel
+
+NX, NY = 60, 50
+
+
+def _layer_points(rng, z, n, x_span=(0.0, 40.0), y_span=(0.0, 30.0)):
+    # one deposited layer: points scattered over the span at height z (+ jitter within the layer),
+    # the first two on the span's corners so the layer's XY bounds are the span
+    points = np.column_stack([rng.uniform(*x_span, n), rng.uniform(*y_span, n), z + rng.uniform(0.0, 0.5, n)])
+    points[:2, :2] = [[x_span[0], y_span[0]], [x_span[1], y_span[1]]]
+    return points
+
+
+@pytest.mark.parametrize("layer_height", [1.0, None])
+def test_vectorized_voxelization_matches_loop(layer_height):
+    rng = np.random.default_rng(0)
+    points = np.concatenate([_layer_points(rng, z, 150) for z in range(5)]).tolist()
+    vectorized = process_voxel(points, 6, NX, NY, layer_height, fill_radius=2)
+    loop = process_voxel(points, 6, NX, NY, layer_height, fill_radius=2, backend="loop")
+    assert vectorized.any()
+    np.testing.assert_array_equal(vectorized, loop)
+
+
+def test_incremental_grid_matches_process_voxel():
+    rng = np.random.default_rng(1)
+    layers = [
+        _layer_points(rng, 0, 150),
+        _layer_points(rng, 1, 150),
+        _layer_points(rng, 2, 150, x_span=(-5.0, 45.0)),            # wider: the XY frame is re-normalized
+        np.concatenate([_layer_points(rng, 3, 150),
+                        _layer_points(rng, 6, 20)]),                # stray points below min_points
+        _layer_points(rng, 4, 150),
+        _layer_points(rng, 5, 150, y_span=(5.0, 25.0)),
+    ]
+    grid = IncrementalVoxelGrid(NX, NY, 1.0, fill_radius=2, min_points=100)
+    seen = np.empty((0, 3))
+    for n, points in enumerate(layers):
+        seen = np.concatenate([seen, points])
+        # nz as the controller reports it; the last call asks for fewer slices than deposited
+        nz = n + 1 if n < len(layers) - 1 else n
+        expected = process_voxel(filter_points_by_layer(seen.tolist(), 1.0, 100), nz, NX, NY, 1.0, fill_radius=2)
+        np.testing.assert_array_equal(grid.add_points(points, nz), expected)
+    assert grid.rebuilds == 2   # the first layer and the wider one
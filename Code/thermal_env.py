@@ -0,0 +1,355 @@
+import argparse
+import csv
+import random
+import time
+
+import numpy as np
+
+import calculate_cooling_time
+from calculate_cooling_time import start_print, end_print
+from bbox_store import piece_bbox_path
+from heat import load_voxel_data
+from thermal_state import PieceThermalState
+from replay import SimulatedClock, find_recording, build_schedule
+from q_agent import QAgent
+
+# ---------------------------
+# Offline training environment for QAgent
+# ---------------------------
+# Simulates the AI phase of main.py without the robot: the agent picks the
+# next piece, the layer "prints" for its recorded duration on a simulated
+# clock, and the pieces' temperatures follow the model main.py decides on
+# (thermal_state.PieceThermalState, i.e. the save_heat_stats numbers).
+#
+# In that model a piece's average temperature only depends on its layer
+# count and on its idle time since its last layer. build_cooling_curves()
+# evaluates it once per piece and layer count, on a log-spaced grid of idle
+# times; an episode then only interpolates those curves, and waiting for a
+# piece to cool is a jump of the clock.
+#
+# With main.py's defaults (T_init == T_amb) idle time does not change the
+# model's temperatures at all: a piece above the threshold never cools, and
+# on the recorded pieces every episode stalls at the default 400 °C (see
+# ThermalPrintEnv). T_init, T_amb and the threshold are parameters, so the
+# model can be set up to give trajectories that depend on the agent.
+
+DEFAULT_LAYER_TIME = 100.0   # s per layer when a piece has no recording
+
+
+def wait_reward(waiting_time):
+    # same shaping as main.py: bonus for no wait, penalty for a long one
+    reward = -1
+    if waiting_time == 0:
+        reward += 5
+    elif waiting_time < 30:
+        reward += 1
+    else:
+        reward -= 5
+    return reward
+
+
+def linear_wait_reward(waiting_time):
+    # 4 for no wait, one point less per 10 s waited
+    return 4 - waiting_time / 10.0
+
+
+# reward shapes selectable by name (train_batch sweeps)
+REWARD_SHAPES = {"main": wait_reward, "linear": linear_wait_reward}
+
+
+def build_cooling_curves(piece_ids=(1, 2, 3, 4), nx=400, ny=400, max_layers=10, horizon=86400.0, points=240,
+                         T_init=20.0, T_amb=20.0):
+    """
+    Per piece: {"tau": (P,), "avg": (max_layers, P)} where avg[n - 1] is the
+    average temperature of the piece with n layers, `tau` idle seconds after
+    its last one, from its latest bbox file. Past the recorded geometry, the
+    top recorded layer repeats. The model's average never rises with idle
+    time, so a row equal at both ends is constant and only evaluated there.
+    T_init / T_amb are PieceThermalState's (main.py uses 20 / 20).
+    """
+    tau = np.concatenate([[0.0], np.logspace(-3, np.log10(horizon), points - 1)])
+    curves = {}
+    for pid in piece_ids:
+        data = _repeat_top_layer(load_voxel_data(piece_bbox_path(pid)), max_layers)
+        state = PieceThermalState(pid, nx, ny, T_init=T_init, T_amb=T_amb)
+        avg = np.empty((max_layers, len(tau)))
+        for nz in range(1, max_layers + 1):
+            state.deposit_layers(data, nz, deposited_at=0.0)
+            first, last = state.avg_temp_at(tau[0]), state.avg_temp_at(tau[-1])
+            avg[nz - 1] = first if first == last else [state.avg_temp_at(t) for t in tau]
+        curves[pid] = {"tau": tau, "avg": avg}
+    return curves
+
+
+def _repeat_top_layer(voxel_data, layers):
+    # bbox content with every component's top recorded layer copied up to `layers`
+    padded = {}
+    for label, component in voxel_data.items():
+        padded[label] = dict(component)
+        top = max(component, key=int, default=None)
+        for z in range(int(top) + 1 if top is not None else layers, layers):
+            padded[label][str(z)] = component[top]
+    return padded
+
+
+def recorded_layer_durations(piece_ids=(1, 2, 3, 4), directory=".", rate=100.0):
+    """
+    Seconds per layer of each piece, from its deposition recording (sample
+    timestamps of a point log, else points / `rate`). Pieces without a
+    recording are left out.
+    """
+    durations = {}
+    for pid in piece_ids:
+        path = find_recording(pid, directory)
+        if path is not None:
+            durations[pid] = [step["duration"] for step in build_schedule({pid: path}, rate=rate)]
+    return durations
+
+
+class ThermalPrintEnv:
+    """
+    gym-style environment of the AI phase:
+
+        env = ThermalPrintEnv(curves=build_cooling_curves())
+        obs = env.reset()
+        obs, reward, done, info = env.step(action)
+
+    obs holds what main.py feeds the agent: "stats" (piece id → avg_temp,
+    cool_time, nz), "active" piece ids, "valid" ids (below temp_threshold),
+    "layer_counts" and "cool_times". After a layer, if no piece is cold
+    enough, the clock jumps to the first predicted crossing; the reward is
+    `reward` (wait_reward by default) of that wait. Episodes start after
+    `start_layers` layers per piece (the manual phase) and end when every
+    piece reached its target, or stall: when no piece cools below the
+    threshold within the curves' horizon (main.py would wait forever), the
+    wait is charged the horizon and the episode ends with env.stalled set.
+    A stalled episode teaches nothing about the order of the pieces: callers
+    should report them (run_episode returns the flag).
+
+    Without `curves`, they are built from the latest bbox files with T_init
+    and T_amb.
+
+    With bind_timers=True the print timers of calculate_cooling_time (read by
+    encode_state) run on the environment's clock, so only one such
+    environment is live per process at a time. With bind_timers=False,
+    pass obs["cool_times"] to encode_state instead; any number of
+    environments can then run side by side.
+    """
+
+    def __init__(self, piece_ids=(1, 2, 3, 4), curves=None, layer_durations=None, layer_targets=None,
+                 layers_per_piece=10, start_layers=1, temp_threshold=400, decision_time=0.0,
+                 duration_jitter=0.0, reward=wait_reward, bind_timers=True, seed=None, T_init=20.0, T_amb=20.0):
+        self.piece_ids = list(piece_ids)
+        self.layer_targets = {1: 5} if layer_targets is None else layer_targets
+        self.layers_per_piece = layers_per_piece
+        self.curves = curves if curves is not None else build_cooling_curves(
+            self.piece_ids, max_layers=max([layers_per_piece, *self.layer_targets.values()]),
+            T_init=T_init, T_amb=T_amb)
+        self.layer_durations = layer_durations if layer_durations is not None else \
+            recorded_layer_durations(self.piece_ids)
+        self.start_layers = start_layers
+        self.temp_threshold = temp_threshold
+        self.decision_time = decision_time      # robot idle per decision (processing), s
+        self.duration_jitter = duration_jitter  # ± relative spread of the layer times
+        self.reward = reward
+        self.bind_timers = bind_timers
+        self.random = random.Random(seed)
+        self.clock = SimulatedClock()
+
+    # --- thermal model ---
+    def avg_temp(self, piece_id, t=None):
+        layers = self.layer_counts[piece_id]
+        if not layers:
+            return 0.0
+        t = self.clock() if t is None else t
+        curve = self.curves[piece_id]
+        row = curve["avg"][min(layers, len(curve["avg"])) - 1]   # past max_layers, the last row repeats
+        return float(np.interp(t - self.deposits[piece_id][-1], curve["tau"], row))
+
+    def time_to_cold(self, piece_id, tol=0.5):
+        """
+        Idle seconds until piece_id's average drops below temp_threshold,
+        on the cold side within `tol`; None if not within the curves' horizon.
+        """
+        now = self.clock()
+        if self.avg_temp(piece_id, now) < self.temp_threshold:
+            return 0.0
+        hi = self.curves[piece_id]["tau"][-1]
+        if self.avg_temp(piece_id, now + hi) >= self.temp_threshold:
+            return None
+        lo = 0.0
+        while hi - lo > tol:
+            mid = 0.5 * (lo + hi)
+            if self.avg_temp(piece_id, now + mid) < self.temp_threshold:
+                hi = mid
+            else:
+                lo = mid
+        return hi
+
+    def cool_time(self, piece_id):
+        # get_cooling_time on this environment's clock: observations never fall mid-layer
+        deposits = self.deposits[piece_id]
+        return self.clock() - deposits[-1] if deposits else 0.0
+
+    # --- episode ---
+    def target(self, piece_id):
+        return self.layer_targets.get(piece_id, self.layers_per_piece)
+
+    def layer_time(self, piece_id):
+        durations = self.layer_durations.get(piece_id) or [DEFAULT_LAYER_TIME]
+        seconds = durations[min(self.layer_counts[piece_id], len(durations) - 1)]
+        if self.duration_jitter:
+            seconds *= 1.0 + self.random.uniform(-self.duration_jitter, self.duration_jitter)
+        return seconds
+
+    def _print_layer(self, piece_id):
+        seconds = self.layer_time(piece_id)
+        self.clock.advance(self.decision_time)
+        if self.bind_timers:
+            start_print(piece_id)
+        self.clock.advance(seconds)
+        if self.bind_timers:
+            end_print(piece_id)
+        self.deposits[piece_id].append(self.clock())
+        self.layer_counts[piece_id] += 1
+        if self.layer_counts[piece_id] >= self.target(piece_id) and piece_id in self.active:
+            self.active.remove(piece_id)
+        return seconds
+
+    def _valid(self):
+        return [pid for pid in self.active if self.avg_temp(pid) < self.temp_threshold]
+
+    def _wait_until_cold(self):
+        waited = 0.0
+        while self.active and not self._valid():
+            waits = [w for w in (self.time_to_cold(pid) for pid in self.active) if w is not None]
+            if not waits:
+                # main.py would poll forever: charge the curves' horizon and end the episode
+                horizon = max(self.curves[pid]["tau"][-1] for pid in self.active)
+                self.clock.advance(horizon)
+                self.stalled = True
+                self.active = []
+                return waited + horizon
+            waited += min(waits)
+            self.clock.advance(min(waits))
+        return waited
+
+    def _observe(self):
+        cool_times = {pid: self.cool_time(pid) for pid in self.active}
+        stats = {pid: {"avg_temp": self.avg_temp(pid), "cool_time": cool_times[pid],
+                       "nz": self.layer_counts[pid]} for pid in self.active}
+        return {"stats": stats, "active": list(self.active), "valid": self._valid(),
+                "layer_counts": {pid: self.layer_counts[pid] for pid in self.active},
+                "cool_times": cool_times, "time": self.clock()}
+
+    def reset(self):
+        self.clock = SimulatedClock()
+        if self.bind_timers:
+            calculate_cooling_time.reset_timers()
+            calculate_cooling_time.set_clock(self.clock)
+        self.deposits = {pid: [] for pid in self.piece_ids}
+        self.layer_counts = {pid: 0 for pid in self.piece_ids}
+        self.active = list(self.piece_ids)
+        self.stalled = False
+        for _ in range(self.start_layers):
+            for pid in self.piece_ids:
+                if pid in self.active:
+                    self._print_layer(pid)
+        self._wait_until_cold()
+        return self._observe()
+
+    def step(self, action):
+        if action not in self.active:
+            raise ValueError(f"Piece {action} is not being printed (active: {self.active})")
+        seconds = self._print_layer(action)
+        waited = self._wait_until_cold()
+        obs = self._observe()
+        info = {"layer_time": seconds, "waiting_time": waited, "time": self.clock(), "stalled": self.stalled}
+        return obs, self.reward(waited), not self.active, info
+
+    def close(self):
+        if self.bind_timers:
+            calculate_cooling_time.reset_timers()
+            calculate_cooling_time.set_clock(None)
+
+
+def run_episode(agent, env, learn=True):
+    """
+    One print job with agent.encode_state / choose_action / update as in
+    main.py. Returns (total reward, simulated seconds, layers printed,
+    stalled).
+    """
+    obs = env.reset()
+    state = agent.encode_state(obs["stats"], obs["active"], layer_counts=obs["layer_counts"],
+                               cool_times=obs["cool_times"])
+    total, steps, done = 0.0, 0, not obs["active"]
+    while not done:
+        action = agent.choose_action(state, obs["valid"])
+        obs, reward, done, _ = env.step(action)
+        next_state = agent.encode_state(obs["stats"], obs["active"], layer_counts=obs["layer_counts"],
+                                        cool_times=obs["cool_times"])
+        if learn:
+            agent.update(state, action, reward, next_state, obs["valid"])
+        state = next_state
+        total += reward
+        steps += 1
+    if learn:
+        agent.decay_epsilon()
+    return total, obs["time"], steps, env.stalled
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train QAgent offline on the thermal model")
+    parser.add_argument("--episodes", type=int, default=1000)
+    parser.add_argument("--pieces", type=int, nargs="*", default=[1, 2, 3, 4])
+    parser.add_argument("--load", help="Q-table to start from (.pkl or array directory)")
+    parser.add_argument("--save", default="q_table_array", help="Q-table output (.pkl or array directory)")
+    parser.add_argument("--rate", type=float, default=100.0, help="points/s for recordings without timestamps")
+    parser.add_argument("--jitter", type=float, default=0.1, help="± relative spread of the layer times")
+    parser.add_argument("--threshold", type=float, help="agent temp_threshold in °C (default: QAgent's)")
+    parser.add_argument("--t-init", type=float, default=20.0, help="thermal model T_init in °C")
+    parser.add_argument("--t-amb", type=float, default=20.0, help="thermal model T_amb in °C")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--out", default="offline_rewards.csv", help="reward per episode")
+    args = parser.parse_args()
+
+    agent = QAgent(table="array", actions=args.pieces)
+    if args.load:
+        agent.load(args.load)
+    if args.threshold is not None:
+        agent.temp_threshold = args.threshold
+    start = time.perf_counter()
+    env = ThermalPrintEnv(args.pieces, curves=build_cooling_curves(args.pieces, T_init=args.t_init, T_amb=args.t_amb),
+                          layer_durations=recorded_layer_durations(args.pieces, rate=args.rate),
+                          temp_threshold=agent.temp_threshold, duration_jitter=args.jitter, seed=args.seed)
+    print(f"Cooling curves ready in {time.perf_counter() - start:.1f}s")
+
+    rows = []
+    start = time.perf_counter()
+    try:
+        for episode in range(args.episodes):
+            total, seconds, steps, stalled = run_episode(agent, env)
+            rows.append((episode, total, seconds, steps, int(stalled)))
+    finally:
+        env.close()
+    elapsed = time.perf_counter() - start
+    stalls = sum(r[4] for r in rows)
+    print(f"{len(rows)} episodes in {elapsed:.1f}s ({len(rows) / elapsed:.0f} episodes/s, "
+          f"{sum(r[3] for r in rows) / elapsed:.0f} layers/s), {stalls} stalled")
+
+    with open(args.out, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(("episode", "reward", "simulated_seconds", "layers", "stalled"))
+        writer.writerows(rows)
+    if rows and stalls == len(rows):
+        raise SystemExit(f"Every episode stalled: no piece cools below {env.temp_threshold:g} °C with "
+                         f"T_init={args.t_init:g} °C, T_amb={args.t_amb:g} °C. Nothing was learned, "
+                         f"Q-table not saved (rewards → {args.out}).")
+    if stalls:
+        print(f"Warning: {stalls} of {len(rows)} episodes stalled (no piece could cool below the threshold)")
+    agent.save(args.save)
+    print(f"Q-table → {args.save}, rewards → {args.out}")
+
+
+if __name__ == "__main__":
+    main()
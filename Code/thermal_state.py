@@ -0,0 +1,259 @@
+import os
+import numpy as np
+from heat import heat_equation_ode, load_voxel_data, layer_components, layer_step, voxel_parameters
+from calculate_cooling_time import now as clock_now
+
+# One persistent thermal state per piece, shared by every caller in the process.
+_piece_states = {}
+
+
+class PieceThermalState:
+    """
+    Thermal model of one piece with its voxels and geometry cached.
+
+    Keeps the active voxels and geometry statistics of the layers already
+    deposited, so a new layer only reads and analyses that layer. Temperatures
+    are not cached: in the model every layer is heated from T_init with
+    voxel_parameters of the piece's current layer count and cooling time, so
+    the field of simulate_heat_cropped (same voxel_parameters, same
+    layer_step) is evaluated again on the cached voxels, one layer_step pass
+    per layer, for each new cooling time. Its stats match the full simulation.
+
+    An idle piece only needs its average (refresh_cooling_stats, predictions):
+    with one step per layer, every voxel of a component gains the same dT
+    from T_init, so avg_temp_at() is a sum over the components, without
+    building the field.
+
+    The voxelizer re-normalizes a piece's XY frame when its bounds grow, which
+    moves the bboxes of layers deposited earlier; a cached layer whose bboxes
+    moved is read and analysed again from the file.
+    """
+
+    def __init__(self, piece_id, nx, ny, T_init=20.0, T_amb=20.0, Q_val=660.0, dt=1.0, steps_per_layer=1):
+        self.piece_id = piece_id
+        self.nx, self.ny = nx, ny
+        self.T_init = T_init
+        self.T_amb = T_amb
+        self.Q_val = Q_val
+        self.dt = dt
+        self.steps_per_layer = steps_per_layer
+        self.reset()
+
+    def reset(self):
+        self.nz = 0
+        # per layer: [(ys, xs, geometry_stats)] of its components, and where they sat (label, bbox, pixels)
+        self.layers = []
+        self.signatures = []
+        self.deposited_at = None   # clock time the piece's idle time counts from
+        self.last_update = None
+        self._source = None
+        self._flat = None
+        self._field_cache = None
+
+    # --- time ---
+    def cool(self, now=None, deposited_at=None):
+        """
+        Bring the state to `now` (seconds on the calculate_cooling_time clock).
+        deposited_at = now - cooling time restarts the idle time, e.g. after a
+        layer of this piece was printed.
+        """
+        now = clock_now() if now is None else now
+        if deposited_at is not None:
+            self.deposited_at = deposited_at
+        elif self.deposited_at is None:
+            self.deposited_at = now
+        self.last_update = now
+
+    def cool_time(self, when=None):
+        when = self.last_update if when is None else when
+        if when is None or self.deposited_at is None:
+            return 0.0
+        return max(when - self.deposited_at, 0.0)
+
+    # --- stats ---
+    def field(self, when=None):
+        """
+        (T, origin) at `when` (default: the last update), as simulate_heat_cropped:
+        the (nz, h, w) field on the piece's domain and its (y0, x0) offset.
+        """
+        self._flatten()
+        return self._field(self.cool_time(when)), self._flat["origin"]
+
+    def avg_temp(self):
+        """
+        Mean temperature over the piece's active voxels (0.0 if none), each
+        voxel counted once as in compute_piece_avg_temp.
+        """
+        return self.avg_temp_at(self.last_update)
+
+    def avg_temp_at(self, when):
+        """
+        avg_temp() the piece will have at `when` if it stays idle until then.
+        The state itself is left untouched (prediction only).
+        """
+        self._flatten()
+        voxels = self._flat["voxels"]
+        if not voxels.size:
+            return 0.0
+        cool_time = self.cool_time(when)
+        if self.steps_per_layer == 1:
+            return self._idle_avg(cool_time)
+        return float(np.mean(self._field(cool_time).ravel()[voxels]))
+
+    def heatmap(self, when=None):
+        """
+        (heatmap, origin): the field with every voxel outside the piece set to
+        0, as compute_piece_avg_temp(..., mask_heatmap=True).
+        """
+        T, origin = self.field(when)
+        voxels = self._flat["voxels"]
+        heatmap = np.zeros_like(T)
+        heatmap.ravel()[voxels] = T.ravel()[voxels]
+        return heatmap, origin
+
+    def time_to_temp(self, threshold, now=None, horizon=86400.0, tol=0.5):
+        """
+        Idle seconds from `now` until avg_temp() drops below `threshold`
+        (0.0 if it already is, None if not within `horizon` seconds).
+        The returned time is on the cold side of the crossing, within `tol`.
+        The model's average never rises with idle time, so the crossing is
+        bisected between `now` and `now + horizon`: 2 + log2(horizon / tol)
+        avg_temp_at calls (20 with the defaults), each a sum over the piece's
+        components (a pass over all of its layers if steps_per_layer > 1).
+        The state itself is left untouched.
+        """
+        now = self.last_update if now is None else now
+        now = clock_now() if now is None else now
+        if self.avg_temp_at(now) < threshold:
+            return 0.0
+        if self.avg_temp_at(now + horizon) >= threshold:
+            return None   # e.g. T_init == T_amb: idle time does not change the field
+
+        lo, hi = 0.0, horizon
+        while hi - lo > tol:
+            mid = 0.5 * (lo + hi)
+            if self.avg_temp_at(now + mid) < threshold:
+                hi = mid
+            else:
+                lo = mid
+        return hi
+
+    # --- deposits ---
+    def deposit_layers(self, voxel_data, nz, deposited_at=None):
+        """
+        Take the layers [0, nz) from a loaded bbox dict. Layers already cached
+        are kept unless their bboxes moved (re-normalized XY frame); only new
+        or moved layers are analysed. deposited_at restarts the idle time.
+        """
+        signatures = [_layer_signature(voxel_data, z) for z in range(nz)]
+        keep = 0
+        while keep < min(len(self.layers), nz) and self.signatures[keep] == signatures[keep]:
+            keep += 1
+        self.layers = self.layers[:keep] + [layer_components(voxel_data, z, self.nx, self.ny, self.piece_id)
+                                            for z in range(keep, nz)]
+        self.signatures = signatures
+        self.nz = nz
+        self._flat = None
+        self._field_cache = None
+        if deposited_at is not None:
+            self.cool(deposited_at, deposited_at)
+
+    def update(self, bbox_path, nz, deposited_at=None, now=None):
+        """
+        Bring the state up to `now`: re-read the bbox file when nz or the file
+        changed, then set the idle time (deposited_at = now - cooling time).
+        Returns (T, origin) as field().
+        """
+        source = (bbox_path, _file_version(bbox_path))
+        if nz != self.nz or source != self._source:
+            self.deposit_layers(load_voxel_data(bbox_path), nz)
+            self._source = source
+        self.cool(now, deposited_at)
+        return self.field()
+
+    def _flatten(self):
+        # flat voxels of every cached layer, the piece's domain and the piece's unique voxels in it
+        if self._flat is not None:
+            return
+        ys, xs, counts, geoms, layer_ptr = [], [], [], [], [0]
+        for components in self.layers:
+            for y, x, geom in components:
+                ys.append(y)
+                xs.append(x)
+                counts.append(y.size)
+                geoms.append(geom)
+            layer_ptr.append(layer_ptr[-1] + sum(y.size for y, _, _ in components))
+        ys = np.concatenate(ys) if ys else np.empty(0, dtype=np.int64)
+        xs = np.concatenate(xs) if xs else np.empty(0, dtype=np.int64)
+        zs = np.repeat(np.arange(self.nz), np.diff(layer_ptr))
+        if ys.size:
+            # one-pixel halo, as piece_domain: neighbour means stay those of the full plate
+            y0, y1 = max(0, int(ys.min()) - 1), min(self.ny, int(ys.max()) + 2)
+            x0, x1 = max(0, int(xs.min()) - 1), min(self.nx, int(xs.max()) + 2)
+        else:
+            y0 = y1 = x0 = x1 = 0
+        shape = (self.nz, y1 - y0, x1 - x0)
+        voxels = np.unique(np.ravel_multi_index((zs, ys - y0, xs - x0), shape)) if ys.size \
+            else np.empty(0, dtype=np.int64)
+        self._flat = {"ys": ys - y0, "xs": xs - x0, "counts": np.asarray(counts, dtype=np.int64), "geoms": geoms,
+                      "layer_ptr": layer_ptr, "origin": (y0, x0), "shape": shape, "voxels": voxels}
+
+    def _idle_avg(self, cool_time):
+        # one layer_step from a uniform T_init plane: every neighbour mean is T_init, so each
+        # component adds the same dT to each of its pixels (overlaps add up, as np.add.at does)
+        flat = self._flat
+        params = np.array([voxel_parameters(None, geom, self.nz, cool_time) for geom in flat["geoms"]])
+        dT = self.dt * heat_equation_ode(self.T_init, self.Q_val, self.T_amb, params[:, 0], params[:, 1], params[:, 2])
+        return self.T_init + float(np.dot(flat["counts"], dT)) / flat["voxels"].size
+
+    def _field(self, cool_time):
+        # simulate_heat_cropped on the cached voxels: every layer heated from T_init with
+        # voxel_parameters at the current layer count and cooling time
+        if self._field_cache is not None and self._field_cache[0] == cool_time:
+            return self._field_cache[1]
+        flat = self._flat
+        T = np.full(flat["shape"], self.T_init, dtype=np.float64)
+        if flat["geoms"]:
+            params = np.array([voxel_parameters(None, geom, self.nz, cool_time) for geom in flat["geoms"]])
+            alpha, beta, gamma = (np.repeat(params[:, i], flat["counts"]) for i in range(3))
+            ptr = flat["layer_ptr"]
+            for z in range(self.nz):
+                s, e = ptr[z], ptr[z + 1]
+                if s == e:
+                    continue
+                for _ in range(self.steps_per_layer):
+                    T[z] = layer_step(T[z], flat["ys"][s:e], flat["xs"][s:e], alpha[s:e], beta[s:e], gamma[s:e],
+                                      self.T_amb, self.Q_val, self.dt)
+        self._field_cache = (cool_time, T)
+        return T
+
+
+def _layer_signature(voxel_data, z):
+    # where each component of layer z sits on the plate; changes when the voxelizer re-normalizes XY
+    key = str(z)
+    return tuple((label, tuple(map(tuple, layers[key]["bounding_box"])), len(layers[key]["active_pixels"]))
+                 for label, layers in voxel_data.items() if key in layers)
+
+
+def _file_version(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def get_piece_state(piece_id, nx, ny, **kwargs):
+    """
+    Return the persistent state of piece_id, creating it on first use
+    (or when the grid size changed).
+    """
+    state = _piece_states.get(piece_id)
+    if state is None or (state.nx, state.ny) != (nx, ny):
+        state = PieceThermalState(piece_id, nx, ny, **kwargs)
+        _piece_states[piece_id] = state
+    return state
+
+
+def reset_piece_states():
+    _piece_states.clear()
@@ -0,0 +1,243 @@
+import argparse
+import itertools
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+from q_agent import QAgent
+from thermal_env import ThermalPrintEnv, REWARD_SHAPES, build_cooling_curves, recorded_layer_durations
+
+# ---------------------------
+# Batched offline training: sweeps over simulated print cells
+# ---------------------------
+# A run is one configuration (alpha, gamma, epsilon, temp_threshold, reward
+# shape, seed) trained on `cells` independent ThermalPrintEnv print cells
+# stepped in lock-step: every tick, each cell takes one transition. The
+# cells of a run update one shared Q-array (share="run") or one each
+# (share="cell", independent replicates of the same configuration). Runs are
+# spread over a process pool; the cooling curves are computed once in the
+# parent and handed to every worker. Results: episodes/s and, per run, the
+# convergence curve (mean episode reward over the cells), as JSON and a PNG.
+
+_curves = None
+_durations = None
+
+
+def _init_worker(curves, durations):
+    global _curves, _durations
+    _curves, _durations = curves, durations
+
+
+def sweep_configs(alphas, gammas, epsilons, thresholds, rewards, seeds):
+    return [{"alpha": a, "gamma": g, "epsilon": e, "threshold": t, "reward": r, "seed": s}
+            for a, g, e, t, r, s in itertools.product(alphas, gammas, epsilons, thresholds, rewards, seeds)]
+
+
+def config_label(config):
+    return (f"α={config['alpha']:g} γ={config['gamma']:g} ε={config['epsilon']:g} "
+            f"T<{config['threshold']:g} {config['reward']} #{config['seed']}")
+
+
+def _encode(agent, obs):
+    return agent.encode_state(obs["stats"], obs["active"], layer_counts=obs["layer_counts"],
+                              cool_times=obs["cool_times"])
+
+
+def run_config(config, cells=8, episodes=200, share="run", piece_ids=(1, 2, 3, 4), jitter=0.1,
+               load=None, save_path=None):
+    """
+    Train one configuration on `cells` print cells in lock-step.
+    Returns its config, the (cells, episodes) episode rewards, the
+    simulated hours per episode, the stalled episodes per cell (see
+    ThermalPrintEnv) and the achieved episodes/s.
+    Epsilon decays once per finished episode of any cell, so a shared
+    Q-array explores for `cells` times fewer episodes per cell.
+    """
+    if share not in ("run", "cell"):
+        raise ValueError(f"Unknown share {share!r}, expected 'run' or 'cell'")
+    random.seed(config["seed"])   # exploration in choose_action
+
+    def make_agent():
+        agent = QAgent(alpha=config["alpha"], gamma=config["gamma"], epsilon=config["epsilon"],
+                       temp_threshold=config["threshold"], table="array", actions=piece_ids)
+        if load:
+            agent.load(load)
+        return agent
+
+    shared = make_agent() if share == "run" else None
+    agents = [shared or make_agent() for _ in range(cells)]
+    envs = [ThermalPrintEnv(piece_ids, curves=_curves, layer_durations=_durations,
+                            temp_threshold=config["threshold"], duration_jitter=jitter,
+                            reward=REWARD_SHAPES[config["reward"]], bind_timers=False,
+                            seed=config["seed"] * 1000 + i)
+            for i in range(cells)]
+
+    start = time.perf_counter()
+    obs = [env.reset() for env in envs]
+    states = [_encode(agent, o) for agent, o in zip(agents, obs)]
+    totals = [0.0] * cells
+    rewards = [[] for _ in range(cells)]
+    hours = [[] for _ in range(cells)]
+    stalls = [0] * cells
+    running = list(range(cells))
+    while running:
+        for i in list(running):
+            agent, env = agents[i], envs[i]
+            if obs[i]["active"]:
+                action = agent.choose_action(states[i], obs[i]["valid"])
+                o, reward, done, _ = env.step(action)
+                state = _encode(agent, o)
+                agent.update(states[i], action, reward, state, o["valid"])
+                totals[i] += reward
+            else:
+                o, state, done = obs[i], states[i], True   # stalled before its first decision
+            if done:
+                rewards[i].append(totals[i])
+                hours[i].append(o["time"] / 3600.0)
+                stalls[i] += env.stalled
+                totals[i] = 0.0
+                agent.decay_epsilon()
+                if len(rewards[i]) == episodes:
+                    running.remove(i)
+                    continue
+                o = env.reset()
+                state = _encode(agent, o)
+            obs[i], states[i] = o, state
+    elapsed = time.perf_counter() - start
+
+    if save_path:
+        agents[0].save(save_path)
+    return {
+        "config": config,
+        "rewards": rewards,
+        "hours": hours,
+        "stalls": stalls,
+        "seconds": elapsed,
+        "episodes_per_s": cells * episodes / elapsed if elapsed > 0 else 0.0,
+        "q_rows": agents[0].q_table.n_rows,
+        "q_table": save_path,
+    }
+
+
+def summarize(result, tail=0.1):
+    rewards = np.asarray(result["rewards"], dtype=np.float64)
+    curve = rewards.mean(axis=0)
+    n_tail = max(1, int(len(curve) * tail))
+    return {
+        "config": result["config"],
+        "label": config_label(result["config"]),
+        "curve": curve.tolist(),
+        "curve_std": rewards.std(axis=0).tolist(),
+        "final_reward": float(curve[-n_tail:].mean()),
+        "final_hours": float(np.mean(np.asarray(result["hours"])[:, -n_tail:])),
+        "stall_rate": float(np.sum(result["stalls"]) / rewards.size),
+        "episodes_per_s": result["episodes_per_s"],
+        "seconds": result["seconds"],
+        "q_rows": result["q_rows"],
+        "q_table": result["q_table"],
+    }
+
+
+def plot_curves(summaries, path, window=20):
+    plt.figure(figsize=(10, 5))
+    for s in summaries:
+        curve = np.asarray(s["curve"])
+        w = max(1, min(window, len(curve)))
+        smooth = np.convolve(curve, np.ones(w) / w, mode="valid")
+        plt.plot(np.arange(w - 1, len(curve)), smooth, label=s["label"])
+    plt.xlabel("episode (per cell)")
+    plt.ylabel(f"reward per episode (mean over cells, {window}-episode average)")
+    plt.title("Offline training convergence")
+    plt.legend(fontsize="small")
+    plt.grid()
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batched offline training of QAgent on simulated print cells")
+    parser.add_argument("--alpha", type=float, nargs="*", default=[0.1])
+    parser.add_argument("--gamma", type=float, nargs="*", default=[0.9])
+    parser.add_argument("--epsilon", type=float, nargs="*", default=[0.2])
+    parser.add_argument("--threshold", type=float, nargs="*", default=[400.0])
+    parser.add_argument("--t-init", type=float, default=20.0, help="thermal model T_init in °C")
+    parser.add_argument("--t-amb", type=float, default=20.0, help="thermal model T_amb in °C")
+    parser.add_argument("--reward", nargs="*", default=["main"], choices=sorted(REWARD_SHAPES))
+    parser.add_argument("--seeds", type=int, default=1, help="runs per configuration")
+    parser.add_argument("--cells", type=int, default=8, help="print cells stepped in lock-step per run")
+    parser.add_argument("--episodes", type=int, default=200, help="episodes per cell")
+    parser.add_argument("--share", choices=("run", "cell"), default="run",
+                        help="one Q-array per run, shared by its cells, or one per cell")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--pieces", type=int, nargs="*", default=[1, 2, 3, 4])
+    parser.add_argument("--rate", type=float, default=100.0, help="points/s for recordings without timestamps")
+    parser.add_argument("--jitter", type=float, default=0.1, help="± relative spread of the layer times")
+    parser.add_argument("--load", help="Q-table every run starts from (.pkl or array directory)")
+    parser.add_argument("--save-dir", help="save each run's Q-array here (run_<n>/)")
+    parser.add_argument("--out", default="training_results.json")
+    parser.add_argument("--plot", default="training_curves.png")
+    args = parser.parse_args()
+
+    configs = sweep_configs(args.alpha, args.gamma, args.epsilon, args.threshold, args.reward, range(args.seeds))
+    start = time.perf_counter()
+    curves = build_cooling_curves(args.pieces, T_init=args.t_init, T_amb=args.t_amb)
+    durations = recorded_layer_durations(args.pieces, rate=args.rate)
+    print(f"Cooling curves ready in {time.perf_counter() - start:.1f}s; "
+          f"{len(configs)} run(s) × {args.cells} cells × {args.episodes} episodes on {args.workers} worker(s)")
+
+    def task(n, config):
+        save_path = os.path.join(args.save_dir, f"run_{n}") if args.save_dir else None
+        return (config, args.cells, args.episodes, args.share, args.pieces, args.jitter, args.load, save_path)
+
+    if args.save_dir:
+        os.makedirs(args.save_dir, exist_ok=True)
+    results = []
+    start = time.perf_counter()
+    if args.workers <= 1 or len(configs) <= 1:
+        _init_worker(curves, durations)
+        for n, config in enumerate(configs):
+            results.append(run_config(*task(n, config)))
+            print(f"  {config_label(config)}: {results[-1]['episodes_per_s']:.0f} episodes/s")
+    else:
+        with ProcessPoolExecutor(max_workers=min(args.workers, len(configs)), initializer=_init_worker,
+                                 initargs=(curves, durations)) as pool:
+            futures = [pool.submit(run_config, *task(n, config)) for n, config in enumerate(configs)]
+            for future in as_completed(futures):
+                results.append(future.result())
+                print(f"  {config_label(results[-1]['config'])}: {results[-1]['episodes_per_s']:.0f} episodes/s")
+    elapsed = time.perf_counter() - start
+
+    # same order as the sweep, whatever order the runs finished in
+    summaries = sorted((summarize(r) for r in results), key=lambda s: configs.index(s["config"]))
+    total = len(configs) * args.cells * args.episodes
+    print(f"{total} episodes in {elapsed:.1f}s ({total / elapsed:.0f} episodes/s)")
+    for s in sorted(summaries, key=lambda s: -s["final_reward"]):
+        print(f"{s['label']:<48} final reward {s['final_reward']:8.2f}   job {s['final_hours']:.2f} h   "
+              f"stalled {100 * s['stall_rate']:.0f}%")
+
+    report = {
+        "meta": {"workers": args.workers, "cells": args.cells, "episodes": args.episodes, "share": args.share,
+                 "pieces": args.pieces, "T_init": args.t_init, "T_amb": args.t_amb,
+                 "seconds": elapsed, "episodes_per_s": total / elapsed},
+        "runs": summaries,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    plot_curves(summaries, args.plot)
+    print(f"Results → {args.out}, curves → {args.plot}")
+    stalled = [s for s in summaries if s["stall_rate"] == 1.0]
+    if len(stalled) == len(summaries):
+        raise SystemExit(f"Every episode of every run stalled (T_init={args.t_init:g} °C, T_amb={args.t_amb:g} °C): "
+                         f"no piece cools below the threshold, nothing was learned.")
+    for s in stalled:
+        print(f"Warning: every episode of {s['label']} stalled")
+
+
+if __name__ == "__main__":
+    main()